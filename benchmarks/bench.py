@@ -0,0 +1,267 @@
+"""
+Offline benchmarks for the scrapers' parse, clean and write paths
+
+Pages are served from the fixture corpus in benchmarks/fixtures and the database is an in-memory mongomock
+client, so nothing touches cagematch, puwota or a real MongoDB. Each case reports throughput and peak memory,
+and can be compared against a saved baseline to catch regressions. Timings depend on the machine, so baselines
+aren't committed, save one on the machine the comparisons will run on
+
+Usage
+-----
+python3 benchmarks/bench.py                      Run every case and compare against baseline.json
+python3 benchmarks/bench.py --save-baseline      Run every case and save the results as the new baseline
+python3 benchmarks/bench.py --no-compare         Run every case without comparing
+python3 benchmarks/bench.py --case clean_titles  Run only the named cases
+"""
+# External Imports
+import os
+import sys
+import copy
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+import mongomock
+from mongoengine import connect, disconnect
+
+# The scraper modules import each other by name, as when run with "python3 scraper"
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scraper'))
+
+# Internal Imports
+from models import Promotions
+from results import ResultsScraper
+from schedule import ScheduleScraper
+from promotions import PromotionsScraper
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Dates the fixture pages were built for
+RESULTS_DATE = "16.10.2026"
+SCHEDULE_DAY = "2026-10-17"
+
+## Classes
+# FixtureTransport Class
+class FixtureTransport:
+    """
+    A stand-in for Transport that serves pages from the fixture corpus instead of the network
+
+    Methods
+    -------
+    get()
+        Return the fixture page matching a url
+    """
+    def __init__(self):
+        self.pages = {}
+        for name in os.listdir(FIXTURES_DIR):
+            with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+                self.pages[name.split('.')[0]] = f.read()
+
+    def get(self, url, ttl=None, **kwargs):
+        """
+        Return the fixture page matching a url
+
+        Parameters
+        ----------
+        url : str
+            URL the scraper asked for
+
+        Returns
+        -------
+        response : SimpleNamespace
+            Object with the page in its text attribute, like a requests.Response
+        """
+        if 'puwota' in url:
+            name = 'puwota_front'
+        elif 'view=promotions' in url:
+            name = 'cagematch_promotions'
+        elif 'view=results' in url:
+            name = 'cagematch_listing'
+        elif 'vDay=16' in url:
+            name = 'cagematch_results'
+        else:
+            name = 'cagematch_results_empty'
+        return SimpleNamespace(text=self.pages[name], status_code=200)
+
+## Functions
+def connect_mock_db():
+    """
+    Connect mongoengine to an in-memory mongomock database, replacing any previous connection
+    """
+    disconnect()
+    connect('bench', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+def build_cases(transport):
+    """
+    Build the benchmark cases, each a setup function and the function being timed
+
+    Parameters
+    ----------
+    transport : FixtureTransport
+        Transport serving the fixture pages
+
+    Returns
+    -------
+    cases : dict
+        Cases keyed by name, as (setup, run, items) where items is the number of units each run processes
+    """
+    results_scraper = ResultsScraper(transport=transport)
+    schedule_scraper = ScheduleScraper(transport=transport)
+    schedule_scraper.today = SCHEDULE_DAY
+    promotions_scraper = PromotionsScraper(transport=transport)
+
+    promotion = SimpleNamespace(name="New Japan Pro Wrestling", cagematch_id="?id=8&nr=7")
+    date_list = [RESULTS_DATE]
+
+    # Raw (uncleaned) input for the cleaners, scraped once from the fixtures and copied for each run
+    raw_shows = [results_scraper.parse_show(show, RESULTS_DATE) for show in results_scraper.find_shows(transport.get('listing?view=results').text)]
+    raw_schedule = schedule_scraper.get_today_schedule()
+    match_count = sum(len(show['results']) for show in raw_shows)
+
+    def seed_promotions():
+        connect_mock_db()
+        Promotions.objects(cagematch_id__in=["?id=8&nr=7", "?id=8&nr=467"]).delete()
+        Promotions(name="New Japan Pro Wrestling", cagematch_id="?id=8&nr=7", short_name="NewJapanProWrestling").save()
+        Promotions(name="DDT Pro-Wrestling", cagematch_id="?id=8&nr=467", short_name="DDTProWrestling").save()
+
+    def no_setup():
+        return None
+
+    cases = {
+        'get_events': (no_setup, lambda _: results_scraper.get_events(promotion, date_list), 1),
+        'find_shows_listing': (no_setup, lambda _: results_scraper.find_shows(transport.get('listing?view=results').text), 1),
+        'clean_titles': (lambda: copy.deepcopy(raw_shows), results_scraper.clean_titles, len(raw_shows)),
+        'clean_results': (lambda: copy.deepcopy(raw_shows), results_scraper.clean_results, match_count),
+        'get_today_schedule': (no_setup, lambda _: schedule_scraper.get_today_schedule(), 1),
+        'clean_schedule': (lambda: copy.deepcopy(raw_schedule), schedule_scraper.clean_schedule, len(raw_schedule)),
+        'update_events': (seed_promotions, lambda _: results_scraper.update_events(date_list), 2),
+        'update_schedule_db': (
+            lambda: (connect_mock_db(), schedule_scraper.clean_schedule(copy.deepcopy(raw_schedule)))[1],
+            schedule_scraper.update_db,
+            len(raw_schedule),
+        ),
+        'update_promotions': (connect_mock_db, lambda _: promotions_scraper.update_promotions(), 1),
+    }
+    return cases
+
+def run_case(setup, run, items, repeat):
+    """
+    Time a case and measure its peak memory
+
+    Parameters
+    ----------
+    setup : function
+        Builds fresh input for each run, not included in the timing
+    run : function
+        The code being measured, called with the output of setup
+    items : int
+        Number of units (pages, shows, matches) processed by each run
+    repeat : int
+        Number of timed runs
+
+    Returns
+    -------
+    result : dict
+        Best and mean seconds per run, items per second and peak memory in KiB
+    """
+    timings = []
+    for _ in range(repeat):
+        data = setup()
+        start = time.perf_counter()
+        run(data)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run, tracemalloc slows everything down too much to time alongside it
+    data = setup()
+    tracemalloc.start()
+    run(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(timings)
+    return {
+        'best_s': best,
+        'mean_s': sum(timings) / len(timings),
+        'items_per_s': items / best if best else float('inf'),
+        'peak_kib': peak / 1024,
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a saved baseline, printing any regressions
+
+    Parameters
+    ----------
+    results : dict
+        Results of this run, keyed by case
+    baseline : dict
+        Saved baseline results, keyed by case
+    tolerance : float
+        Allowed slowdown or memory growth as a fraction, ie 0.2 for 20%
+
+    Returns
+    -------
+    regressions : list
+        Names of the cases that regressed
+    """
+    regressions = []
+    print(f"\n{'case':<22}{'time vs baseline':>18}{'memory vs baseline':>20}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<22}{'(no baseline)':>18}")
+            continue
+        time_ratio = result['best_s'] / baseline[name]['best_s']
+        memory_ratio = result['peak_kib'] / baseline[name]['peak_kib'] if baseline[name]['peak_kib'] else 1.0
+        flag = ""
+        if time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22}{time_ratio:>17.2f}x{memory_ratio:>19.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Puroview scraper benchmarks")
+    parser.add_argument("--case", action="append", help="Only run the named case, can be given more than once")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of timed runs per case")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="Only print the results, without comparing against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a case is flagged as a regression")
+    args = parser.parse_args()
+
+    # The scrapers log every show and match, which would swamp both the output and the timings
+    logging.disable(logging.ERROR)
+
+    connect_mock_db()
+    cases = build_cases(FixtureTransport())
+    names = args.case or list(cases)
+
+    results = {}
+    print(f"{'case':<22}{'best ms':>10}{'mean ms':>10}{'items/s':>12}{'peak KiB':>12}")
+    for name in names:
+        result = run_case(*cases[name], repeat=args.repeat)
+        results[name] = result
+        print(f"{name:<22}{result['best_s'] * 1000:>10.2f}{result['mean_s'] * 1000:>10.2f}{result['items_per_s']:>12.1f}{result['peak_kib']:>12.1f}")
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {BASELINE_PATH}")
+        return 0
+
+    if args.no_compare:
+        return 0
+    if not os.path.exists(BASELINE_PATH):
+        print(f"\nNo baseline to compare against at {BASELINE_PATH}, save one with --save-baseline first", file=sys.stderr)
+        return 2
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    if compare(results, baseline, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
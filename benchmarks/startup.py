@@ -0,0 +1,209 @@
+"""
+Startup time benchmark for the scraper's subcommands
+
+Each subcommand is started in a fresh interpreter under "python -X importtime", which parses its command line and
+imports the modules its job needs, stopping short of connecting to the database or fetching anything. Reports the
+wall time to get that far, the time spent importing on top of a bare interpreter and the slowest imports, so
+cold-start latency for short jobs like schedule can be tracked against a saved baseline
+
+Usage
+-----
+python3 benchmarks/startup.py                          Time every subcommand and compare against startup_baseline.json
+python3 benchmarks/startup.py --save-baseline          Time every subcommand and save the results as the new baseline
+python3 benchmarks/startup.py --no-compare             Time every subcommand without comparing
+python3 benchmarks/startup.py --command schedule -v    Time only the schedule subcommand and list its slowest imports
+"""
+# External Imports
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRAPER_DIR = os.path.join(BENCH_DIR, '..', 'scraper')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'startup_baseline.json')
+
+# Command lines to time, with any arguments the subcommand requires
+COMMANDS = {
+    "promotions": ["promotions"],
+    "results": ["results"],
+    "schedule": ["schedule"],
+    "scheduled": ["scheduled"],
+    "backfill": ["backfill", "2020-01-01", "2020-01-31"],
+    "enqueue": ["enqueue"],
+    "worker": ["worker"],
+    "migrate": ["migrate", "matches"],
+}
+
+# Run in the child interpreter, the same steps __main__ takes before the job starts its work
+STARTUP = """
+import sys
+import metrics
+from cli import parse_args
+from jobs import load
+from runtime import Runtime
+from logconfig import configure_logging
+args = parse_args(sys.argv[1:])
+Runtime(args)
+load(args.command)
+"""
+
+## Functions
+def parse_importtime(stderr):
+    """
+    Read the report written by -X importtime
+
+    Parameters
+    ----------
+    stderr : str
+        Standard error of the interpreter
+
+    Returns
+    -------
+    imports : dict
+        Cumulative microseconds of each top-level import, keyed by module
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that imported them, and are already in its cumulative time
+        if not name[1:].startswith(" "):
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+def run_startup(code, argv=()):
+    """
+    Start a fresh interpreter with -X importtime and run some code in the scraper directory
+
+    Parameters
+    ----------
+    code : str
+        Code to run
+    argv : list
+        Arguments passed to the code in sys.argv
+
+    Returns
+    -------
+    wall : float
+        Seconds until the interpreter exited
+    imports : dict
+        Cumulative microseconds of each top-level import
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code, *argv], cwd=SCRAPER_DIR,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(f"Startup of {' '.join(argv)} failed:\n{process.stderr[-2000:]}")
+    return wall, parse_importtime(process.stderr)
+
+def time_command(argv, bare, repeat):
+    """
+    Time a subcommand's startup, keeping the quickest of several runs
+
+    Parameters
+    ----------
+    argv : list
+        Command line for the subcommand
+    bare : dict
+        Imports made by an interpreter that runs nothing, which aren't counted against the subcommand
+    repeat : int
+        Number of runs
+
+    Returns
+    -------
+    result : dict
+        Wall seconds, seconds spent in the subcommand's own imports and its slowest top-level imports
+    """
+    best = None
+    for _ in range(repeat):
+        wall, imports = run_startup(STARTUP, argv)
+        own = {name: us for name, us in imports.items() if name not in bare}
+        if best is None or wall < best['wall_s']:
+            best = {
+                'wall_s': wall,
+                'import_s': sum(own.values()) / 1e6,
+                'modules': len(own),
+                'slowest': sorted(own.items(), key=lambda item: item[1], reverse=True)[:10],
+            }
+    return best
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a saved baseline, printing any regressions
+
+    Parameters
+    ----------
+    results : dict
+        Results of this run, keyed by subcommand
+    baseline : dict
+        Saved baseline results, keyed by subcommand
+    tolerance : float
+        Allowed slowdown as a fraction, ie 0.2 for 20%
+
+    Returns
+    -------
+    regressions : list
+        Names of the subcommands that regressed
+    """
+    regressions = []
+    print(f"\n{'command':<14}{'wall vs baseline':>18}{'imports vs baseline':>21}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<14}{'(no baseline)':>18}")
+            continue
+        wall_ratio = result['wall_s'] / baseline[name]['wall_s']
+        import_ratio = result['import_s'] / baseline[name]['import_s'] if baseline[name]['import_s'] else 1.0
+        flag = ""
+        if wall_ratio > 1 + tolerance or import_ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<14}{wall_ratio:>17.2f}x{import_ratio:>20.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Puroview scraper startup benchmark")
+    parser.add_argument("--command", action="append", choices=list(COMMANDS), help="Only time the named subcommand, can be given more than once")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per subcommand, the quickest is kept")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="Only print the results, without comparing against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a subcommand is flagged as a regression")
+    parser.add_argument("-v", "--verbose", action="store_true", help="List the slowest imports of each subcommand")
+    args = parser.parse_args()
+
+    # Whatever the interpreter imports to start up isn't down to the scraper
+    _, bare = run_startup("pass")
+
+    results = {}
+    print(f"{'command':<14}{'wall ms':>10}{'imports ms':>12}{'modules':>10}")
+    for name in args.command or list(COMMANDS):
+        result = time_command(COMMANDS[name], bare, args.repeat)
+        results[name] = result
+        print(f"{name:<14}{result['wall_s'] * 1000:>10.1f}{result['import_s'] * 1000:>12.1f}{result['modules']:>10}")
+        if args.verbose:
+            for module, us in result['slowest']:
+                print(f"    {module:<30}{us / 1000:>10.1f} ms")
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {BASELINE_PATH}")
+        return 0
+
+    if args.no_compare:
+        return 0
+    if not os.path.exists(BASELINE_PATH):
+        print(f"\nNo baseline to compare against at {BASELINE_PATH}, save one with --save-baseline first", file=sys.stderr)
+        return 2
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    if compare(results, baseline, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
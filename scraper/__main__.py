@@ -1,103 +1,71 @@
 # External imports
-import os
+import sys
 import logging
-import argparse 
-from datetime import datetime, timedelta
-from mongoengine import connect
+from datetime import datetime
 
 # Internal Imports
-from notifier import Pushover
-from results import ResultsScraper
-from schedule import ScheduleScraper
-from promotions import PromotionsScraper
+# Only light modules are imported here, each job imports its scrapers and the database models when it runs
+import metrics
+from cli import parse_args
+from jobs import JOBS
+from runtime import Runtime
+from logconfig import configure_logging, parse_module_levels, log_summary
 
-## Configure Logging
-
-# Create handlers
-c_handler = logging.StreamHandler()
-f_handler = logging.FileHandler('scraper.log')
-c_handler.setLevel(logging.DEBUG)
-f_handler.setLevel(logging.DEBUG)
-
-# Create formatters and add it to handlers
-c_format = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s# %(message)s', datefmt='%d.%m.%y-%H:%M:%S')
-f_format = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s# %(message)s', datefmt='%d.%m.%y-%H:%M:%S')
-c_handler.setFormatter(c_format)
-f_handler.setFormatter(f_format)
-
-# Add handlers to the logger
-# Level also set here as logs weren't being output without it
-logging.basicConfig(
-    level=logging.DEBUG,
-    handlers=[c_handler, f_handler]
-    )
+logger = logging.getLogger("scraper")
 
 ## Parse Arguments
-parser = argparse.ArgumentParser(description="Puroview scraper")
-
-# Set mutually exclusive arguments
-group = parser.add_mutually_exclusive_group(required=True)
-group.add_argument("--promotions", action="store_true", help="Updates promotions listed on cagematch")
-group.add_argument("--results", action="store_true", help="Daily results scraper")
-group.add_argument("--schedule", action="store_true", help="Daily schedule scraper")
+# Each job is a subcommand, ie "scraper results --days 3". The old "--results" style flags still work
+args = parse_args(sys.argv[1:])
 
-# Parse arguments
-args = parser.parse_args()
-
-# Create pushover notifier
-pushover = Pushover()
-
-# Establish connection to the mongodb cluster
-# http://docs.mongoengine.org/apireference.html?highlight=connect#mongoengine.connect
-connect(host=os.environ['DBURL'])
+## Configure Logging
+# Logs are written by a background thread, so the scrapers never wait on console or file I/O
+configure_logging(args.log_level, parse_module_levels(args.log_module_level))
+
+# The database connection, HTTP transport and notifier are created the first time a job uses them
+runtime = Runtime(args)
+
+# Serve metrics for Prometheus to pull, mostly useful in daemon mode
+if args.metrics_port:
+    metrics.serve(args.metrics_port)
+
+def run_job(name):
+    """
+    Run a single job, then log its transfer stats and item counts and save its run report
+    """
+    before = metrics.snapshot()
+    started_at = datetime.utcnow()
+    succeeded = False
+    try:
+        JOBS[name](args, runtime)
+        succeeded = True
+    finally:
+        # Log how much was transferred and how many connections were opened for the run, and the run's item counts
+        runtime.log_stats()
+        log_summary()
+
+        # Store the timings for the run alongside the data, and export them for Prometheus
+        from models import RunReports
+
+        runtime.connect()
+        finished_at = datetime.utcnow()
+        report = metrics.run_report(before)
+        RunReports(job=name, started_at=started_at, finished_at=finished_at, duration=(finished_at - started_at).total_seconds(),
+                   succeeded=succeeded, report=report).save()
+        for slowest in report['slowest_promotions'][:3]:
+            logger.info("Slow promotion: %s, %.2fs", slowest['promotion'], slowest['seconds'])
+        if args.metrics_textfile:
+            metrics.write_textfile(args.metrics_textfile)
 
 # Run script based on provided arguments
-# Promotions scraper
-if args.promotions:
-    logging.info("Launching promotions scraper")
-    scraper = PromotionsScraper()
-    scraper.update_promotions()
-
-
-# Results scraper
-if args.results:
-    logging.info("Launching results scraper")
-    
-    #Instantiate an instance of the ResultsScraper class
-    scraper = ResultsScraper()
-
-    # Build a list of the dates for the last 7 days
-    date_list = [(datetime.today() - timedelta(days=x)).strftime('%d.%m.%Y') for x in reversed(range(7))]
-    logging.debug(f"date_list: {date_list}")
-
-    # Run the event scraper and store the returned string
-    updated_events = scraper.update_events(date_list)
-
-    # Build notifiers
-    logging.info("Sending notifications")
-
-    # Send message based on whether updated_events contains any entries
-    if updated_events:
-        pushover.push_message('Results Scraper complete, added shows:\n' + updated_events)
-    else:
-        pushover.push_message('Results Scraper complete, no shows added.')
-
-# Schedule scraper
-if args.schedule:
-    logging.info("Launching schedule scraper")
-
-    # Instantiate an instance of the ScheduleScraper class
-    scraper = ScheduleScraper()
-
-    # Scrape scheduled shows and add to the database
-    show_list = scraper.get_today_schedule()
-    show_list = scraper.clean_schedule(show_list)
-    scraper.update_db(show_list)
-
-    # Sent a pushover with the scraped shows
-    updated_shows = '\n'.join(s['promotion'] + ", " + s['time'] for s in show_list)
-
-    if show_list:
-        pushover.push_message('Schedule scraper complete, added shows:\n' + updated_shows)
-    else:
-        pushover.push_message('Schedule scraper complete, no shows added.')
+if args.command == "daemon":
+    from daemon import Job, Scheduler, parse_schedule
+
+    # The database connection and HTTP pool stay open between runs, so each run skips the connection setup
+    schedules = {"promotions": args.promotions_every, "results": args.results_every, "schedule": args.schedule_every, "scheduled": args.scheduled_every}
+    jobs = [Job(name, lambda name=name: run_job(name), parse_schedule(spec), jitter=args.jitter) for name, spec in schedules.items() if spec]
+    Scheduler(jobs).run()
+else:
+    run_job(args.command)
+
+# Send any notifications still queued before exiting
+runtime.close()
@@ -0,0 +1,169 @@
+"""
+Per-promotion activity, used to decide how much of the results scan each promotion gets
+
+Most promotions in the database run rarely or not at all, but every one of them costs a request per date on every
+run. Activity is worked out from the Results saved recently: when each promotion last ran a show, how many shows a
+week it runs and which weekdays it usually runs on. Active promotions are scanned in full on every run, occasional
+ones only on the weekdays they run, and dormant ones not at all, with every promotion swept in full every few days
+so a dormant promotion coming back, or a show on an unusual day, is still picked up
+"""
+# External Imports
+import logging
+from datetime import datetime, timedelta
+
+# Internal Imports
+from models import Results, Promotions, PromotionActivity
+from bulk import bulk_upsert
+from logconfig import count
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# Activity Class
+class Activity:
+    """
+    Activity of every promotion, and when each was last scanned in full
+
+    Attributes
+    ----------
+    active_days : int
+        Promotions that have run a show within this many days are scanned in full on every run
+
+    window_days : int
+        Shows within this many days make up the activity stats. Promotions without a show in the window are dormant
+
+    sweep_days : int
+        Every promotion is scanned in full at least this often, whatever its activity. Counted in calendar days, so a
+        run starting a little early still sweeps on the day it's due
+
+    dates_migrated : bool
+        False while some Results still have string dates, which the stats can't see. Every promotion is then scanned
+        in full until "migrate dates" has run
+
+    entries : dict
+        Activity for each promotion, keyed by cagematch id
+
+    Methods
+    -------
+    tier()
+        Classify a promotion as new, active, occasional or dormant
+
+    due_dates()
+        Filter a date list down to the dates worth scanning for a promotion
+
+    flush()
+        Write the activity stats and full scans to the database in one batch
+    """
+    def __init__(self, active_days=30, window_days=90, sweep_days=6):
+        logger.info("Loading promotion activity")
+
+        self.active_days = active_days
+        self.window_days = window_days
+        self.sweep_days = sweep_days
+        self.now = datetime.utcnow()
+
+        stored = {entry.promotion: entry for entry in PromotionActivity.objects()}
+
+        # Shows saved before dates were stored as datetimes don't show up in the range scan, so until they are migrated
+        # most promotions would look dormant
+        self.dates_migrated = not Results._get_collection().find_one({'date': {'$type': 'string'}}, {'_id': 1})
+        if not self.dates_migrated:
+            logger.warning("Some results still have string dates, scanning every promotion until \"migrate dates\" has run")
+
+        # The stats come from a range scan over the window on the date index, rather than the whole collection
+        shows = {}
+        for show in Results._get_collection().find({'date': {'$gte': self.now - timedelta(days=window_days)}}, {'promotion': 1, 'date': 1}):
+            if isinstance(show.get('date'), datetime):
+                shows.setdefault(show.get('promotion'), []).append(show['date'])
+
+        self.entries = {}
+        for promotion in Promotions.objects().only('cagematch_id', 'name'):
+            previous = stored.get(promotion.cagematch_id)
+            dates = shows.get(promotion.name, [])
+
+            # Older shows have dropped out of the window, so the last show date is carried over from the stored stats
+            last_show = max(dates + ([previous.last_show] if previous and previous.last_show else []), default=None)
+            weekday_counts = {}
+            for date in dates:
+                weekday_counts[date.weekday()] = weekday_counts.get(date.weekday(), 0) + 1
+
+            self.entries[promotion.cagematch_id] = {
+                'promotion': promotion.cagematch_id,
+                'name': promotion.name,
+                'last_show': last_show,
+                'shows_per_week': round(len(dates) * 7 / window_days, 2),
+                'weekdays': sorted(weekday_counts),
+                'last_full_scan': previous.last_full_scan if previous else None,
+                'new': previous is None,
+                'updated_at': self.now,
+            }
+        logger.info("Loaded activity for %s promotions from %s recent shows", len(self.entries), sum(len(dates) for dates in shows.values()))
+
+    def tier(self, cagematch_id):
+        """
+        Classify a promotion by how recently it last ran a show
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+
+        Returns
+        -------
+        str
+            "new" if nothing is known about it yet, otherwise "active", "occasional" or "dormant"
+        """
+        entry = self.entries.get(cagematch_id)
+        if not entry or entry['new']:
+            return "new"
+        if entry['last_show'] and self.now - entry['last_show'] <= timedelta(days=self.active_days):
+            return "active"
+        if entry['weekdays']:
+            return "occasional"
+        return "dormant"
+
+    def due_dates(self, cagematch_id, date_list):
+        """
+        Filter a date list down to the dates worth scanning for a promotion
+
+        New and active promotions get every date, occasional ones the dates on the weekdays they run and dormant ones
+        none, unless they are due a full sweep
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date_list : list
+            List of dates in the run, in the format %d.%m.%Y
+
+        Returns
+        -------
+        due : list
+            Dates to scan, in the original order
+        """
+        if not self.dates_migrated:
+            return list(date_list)
+
+        entry = self.entries.get(cagematch_id)
+        tier = self.tier(cagematch_id)
+        swept = entry and entry['last_full_scan'] and (self.now.date() - entry['last_full_scan'].date()).days < self.sweep_days
+        if tier in ("occasional", "dormant") and not swept:
+            tier = "swept"
+        count(f'promotions_{tier}')
+
+        if tier in ("new", "active", "swept"):
+            if entry:
+                entry['last_full_scan'] = self.now
+            return list(date_list)
+
+        due = [date for date in date_list if datetime.strptime(date, '%d.%m.%Y').weekday() in entry['weekdays']] if tier == "occasional" else []
+        count('pages_deprioritized', len(date_list) - len(due))
+        logger.debug("%s of %s dates due for %s promotion %s", len(due), len(date_list), tier, cagematch_id)
+        return due
+
+    def flush(self):
+        """
+        Write the activity stats and full scans to the database in one batch
+        """
+        if self.entries and self.dates_migrated:
+            bulk_upsert(PromotionActivity, [{key: value for key, value in entry.items() if key != 'new'} for entry in self.entries.values()], ['promotion'])
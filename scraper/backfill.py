@@ -0,0 +1,203 @@
+"""
+Historical backfill of results over a date range, resumable after the process is stopped
+
+A backfill runs the normal results pipeline over every (promotion, date) page in the range, a chunk of dates at a
+time so only that chunk's ledger entries are held in memory. Each page is recorded in the scrape ledger once its
+shows are saved, and the run itself is recorded in BackfillRun, so re-running the same range picks up where the
+last attempt stopped by skipping pages already recorded since the run began
+"""
+# External Imports
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Internal Imports
+from models import BackfillRun, Promotions, ScrapeLedger
+from ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+# Dates scraped, and ledger entries loaded, at a time
+CHUNK_DAYS = 30
+
+## Classes
+# BackfillLedger Class
+class BackfillLedger(Ledger):
+    """
+    A scrape ledger for a backfill, treating every page recorded since the run began as done, and reporting progress
+
+    Attributes
+    ----------
+    run : BackfillRun
+        Checkpoint document for the date range
+
+    total : int
+        Pages due in the whole range when this attempt started
+
+    report_every : float
+        Seconds between progress lines in the log
+
+    Methods
+    -------
+    load()
+        Load the entries recorded since the backfill began for a chunk of dates
+
+    is_due()
+        Check whether a (promotion, date) page still needs fetching in this backfill
+
+    record()
+        Record a scraped page and count it towards the progress
+
+    flush()
+        Write the recorded entries and move the checkpoint on
+
+    log_progress()
+        Log pages done, pages per second and the estimated time left
+    """
+    def __init__(self, run, date_list=(), report_every=30):
+        self.run = run
+        super().__init__(date_list)
+        self.total = 0
+        self.report_every = report_every
+
+        self._done = 0
+        self._checkpointed = 0
+        self._started = time.monotonic()
+        self._reported = self._started
+        self._progress_lock = threading.Lock()
+
+    def load(self, date_list):
+        """
+        Load the entries recorded since the backfill began for a chunk of dates, replacing the last chunk's
+
+        Older entries don't affect what is due, so they aren't loaded
+
+        Parameters
+        ----------
+        date_list : list
+            Dates in the format %d.%m.%Y
+        """
+        query = ScrapeLedger.objects(date__in=list(date_list), fetched_at__gte=self.run.started_at).only('promotion', 'date', 'fetched_at')
+        self.entries = {(entry.promotion, entry.date): entry for entry in query} if date_list else {}
+        logger.debug("Loaded %s ledger entries", len(self.entries))
+
+    def is_due(self, cagematch_id, date):
+        """
+        Check whether a (promotion, date) page still needs fetching in this backfill
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date : str
+            Date in the format %d.%m.%Y
+
+        Returns
+        -------
+        bool
+            True unless the page has been recorded since the backfill began
+        """
+        entry = self.entries.get((cagematch_id, date))
+        return not entry or not entry.fetched_at or entry.fetched_at < self.run.started_at
+
+    def record(self, cagematch_id, date, shows):
+        """
+        Record a scraped page, to be written on the next flush(), and count it towards the progress
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date : str
+            Date in the format %d.%m.%Y
+        shows : list
+            Show dicts found for the date, empty if there were none
+        """
+        super().record(cagematch_id, date, shows)
+        with self._progress_lock:
+            self._done += 1
+
+    def flush(self):
+        """
+        Write the recorded entries, then move the checkpoint on so a restart skips them
+        """
+        super().flush()
+
+        with self._progress_lock:
+            written, self._checkpointed = self._done - self._checkpointed, self._done
+        if written:
+            BackfillRun.objects(id=self.run.id).update_one(inc__pages_done=written)
+
+        if time.monotonic() - self._reported >= self.report_every:
+            self.log_progress()
+
+    def log_progress(self):
+        """
+        Log pages done, pages per second and the estimated time left
+        """
+        self._reported = time.monotonic()
+        rate = self._done / max(self._reported - self._started, 1e-6)
+        remaining = max(0, self.total - self._done)
+        eta = timedelta(seconds=int(remaining / rate)) if rate else "unknown"
+        logger.info("Backfill progress: %s of %s pages, %.2f pages/sec, ETA %s", self._done, self.total, rate, eta)
+
+## Functions
+def backfill(scraper, start, end):
+    """
+    Scrape results for every promotion and date in a range, resuming an unfinished backfill of the same range
+
+    Parameters
+    ----------
+    scraper : ResultsScraper
+        Scraper used to fetch and save the pages, its workers set how many pages are fetched at once
+    start : str
+        First date of the range, in the format %Y-%m-%d
+    end : str
+        Last date of the range, in the format %Y-%m-%d
+
+    Returns
+    -------
+    updated_shows : str
+        Simple list of updated shows for use in notifications
+    """
+    first = datetime.strptime(start, '%Y-%m-%d')
+    last = datetime.strptime(end, '%Y-%m-%d')
+    if last < first:
+        raise ValueError(f"Backfill range ends before it starts: {start} to {end}")
+    date_list = [(first + timedelta(days=x)).strftime('%d.%m.%Y') for x in range((last - first).days + 1)]
+
+    # Carry on from an unfinished run of the same range, otherwise start a fresh one
+    run = BackfillRun.objects(start=start, end=end).first()
+    if run and not run.finished_at:
+        logger.info("Resuming backfill %s to %s started %s, %s pages already done", start, end, run.started_at, run.pages_done)
+    else:
+        run = run or BackfillRun(start=start, end=end)
+        run.started_at = datetime.utcnow()
+        run.finished_at = None
+        run.pages_done = 0
+        logger.info("Starting backfill %s to %s", start, end)
+
+    # Pages left are counted in the database, the entries themselves are only loaded a chunk at a time
+    ledger = BackfillLedger(run)
+    done = ScrapeLedger.objects(date__in=date_list, fetched_at__gte=run.started_at).count()
+    ledger.total = max(0, Promotions.objects.count() * len(date_list) - done)
+    run.pages_total = (run.pages_done or 0) + ledger.total
+    run.save()
+    logger.info("%s pages to fetch over %s dates", ledger.total, len(date_list))
+
+    updated_shows = []
+    for index in range(0, len(date_list), CHUNK_DAYS):
+        chunk = date_list[index:index + CHUNK_DAYS]
+        ledger.load(chunk)
+        shows = scraper.update_events(chunk, ledger)
+        if shows:
+            updated_shows.append(shows)
+
+    ledger.log_progress()
+    run.reload()
+    run.finished_at = datetime.utcnow()
+    run.save()
+    logger.info("Backfill %s to %s finished", start, end)
+
+    return '\n'.join(updated_shows)
@@ -0,0 +1,123 @@
+"""
+Batched upserts for the scrapers' write paths, built on pymongo bulk_write
+https://pymongo.readthedocs.io/en/stable/examples/bulk.html
+"""
+# External Imports
+import json
+import hashlib
+import logging
+from pymongo import UpdateOne
+
+# Internal Imports
+from metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+## Functions
+def content_hash(values):
+    """
+    Build a stable hash of some content, independent of dict key order
+
+    Parameters
+    ----------
+    values
+        JSON serialisable content, dates are hashed by their string form
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest of the content
+    """
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def bulk_upsert(document_cls, docs, key_fields, batch_size=500, hash_fields=None):
+    """
+    Upsert a list of documents in unordered batches, keyed on the model's natural key
+
+    Each document is converted through the model first, so it is stored exactly as save() would store it,
+    including the _cls field on models that allow inheritance
+
+    With hash_fields, each document is stored with a content_hash of those fields, and documents whose stored hash
+    already matches are skipped without being written at all
+
+    Parameters
+    ----------
+    document_cls : Document
+        Model class the documents belong to
+    docs : list
+        Documents to upsert, as dicts of field values
+    key_fields : list
+        Field names that identify a document, used as the upsert filter
+    batch_size : int
+        Maximum number of operations sent in one bulk_write
+    hash_fields : list, optional
+        Field names making up the document's content, used to skip writes that wouldn't change anything
+
+    Returns
+    -------
+    result : dict
+        Total inserted, modified, unchanged and skipped counts, the inserted docs, the docs written (every doc not skipped
+        by its hash) and the counts for each batch
+    """
+    collection = document_cls._get_collection()
+    result = {'inserted': 0, 'modified': 0, 'unchanged': 0, 'skipped': 0, 'inserted_docs': [], 'written_docs': [], 'batches': []}
+    key_db_fields = [document_cls._fields[field].db_field for field in key_fields]
+
+    # Keep only the last document for each key, unordered upserts of the same key in one batch could insert it twice
+    unique_docs = {}
+    for doc in docs:
+        unique_docs[tuple(doc.get(field) for field in key_fields)] = doc
+    docs = list(unique_docs.values())
+
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+
+        sons = []
+        for doc in batch:
+            son = document_cls(**doc).to_mongo().to_dict()
+            son.pop('_id', None)
+            if hash_fields:
+                son['content_hash'] = content_hash({field: son.get(document_cls._fields[field].db_field) for field in hash_fields})
+            sons.append(son)
+
+        # Look up the stored hashes for the whole batch in one query, and drop the documents that haven't changed
+        skipped = 0
+        if hash_fields:
+            keys = [{db_field: son.get(db_field) for db_field in key_db_fields} for son in sons]
+            with timed("scraper_db_operation_seconds", collection=collection.name, operation="find_hashes"):
+                stored = {
+                    tuple(existing.get(db_field) for db_field in key_db_fields): existing.get('content_hash')
+                    for existing in collection.find({'$or': keys}, dict.fromkeys(key_db_fields + ['content_hash'], 1))
+                }
+            changed = [(doc, son) for doc, son in zip(batch, sons) if stored.get(tuple(son.get(db_field) for db_field in key_db_fields)) != son['content_hash']]
+            skipped = len(batch) - len(changed)
+            batch, sons = [doc for doc, _ in changed], [son for _, son in changed]
+
+        operations = [UpdateOne({db_field: son.get(db_field) for db_field in key_db_fields}, {'$set': son}, upsert=True) for son in sons]
+
+        # Unordered so one bad document doesn't stop the rest of the batch being written
+        if operations:
+            with timed("scraper_db_operation_seconds", collection=collection.name, operation="bulk_write"):
+                write = collection.bulk_write(operations, ordered=False)
+            upserted, modified, matched, upserted_ids = write.upserted_count, write.modified_count, write.matched_count, write.upserted_ids
+        else:
+            upserted, modified, matched, upserted_ids = 0, 0, 0, {}
+
+        # Matched documents that weren't modified already held the same values
+        batch_result = {
+            'inserted': upserted,
+            'modified': modified,
+            'unchanged': matched - modified,
+            'skipped': skipped,
+        }
+        result['inserted_docs'].extend(batch[index] for index in sorted(upserted_ids))
+        result['written_docs'].extend(batch)
+        result['batches'].append(batch_result)
+        for count in ('inserted', 'modified', 'unchanged', 'skipped'):
+            result[count] += batch_result[count]
+            inc("scraper_db_operations_total", batch_result[count], collection=collection.name, result=count)
+
+        logger.info("Bulk upsert to %s: %s inserted, %s modified, %s unchanged, %s skipped by content hash",
+                    collection.name, batch_result['inserted'], batch_result['modified'], batch_result['unchanged'], batch_result['skipped'])
+
+    return result
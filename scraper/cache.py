@@ -0,0 +1,289 @@
+# External Imports
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# CachedResponse Class
+class CachedResponse:
+    """
+    A minimal stand-in for requests.Response, for pages served from the response cache
+
+    Attributes
+    ----------
+    url : str
+        URL the page was fetched from
+
+    content : bytes
+        Body of the page
+
+    text : str
+        Body of the page decoded with the encoding stored alongside it
+
+    status_code : int
+        HTTP status of the original response
+
+    headers : dict
+        Validator headers stored with the page
+
+    from_cache : bool
+        Always True, lets callers tell cached pages apart
+    """
+    def __init__(self, url, content, encoding, status_code=200, headers=None):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.text = content.decode(encoding or 'utf-8', errors='replace')
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.from_cache = True
+
+# ResponseCache Class
+class ResponseCache:
+    """
+    A persistent on-disk cache of page responses, keyed by URL
+
+    Each entry is a body file and a json metadata file holding the fetch time, encoding and any ETag/Last-Modified
+    validators, so expired entries can be revalidated with a conditional request rather than downloaded again
+
+    Attributes
+    ----------
+    path : str
+        Directory the cache entries are stored in
+
+    max_bytes : int
+        Total size of cached bodies allowed before the least recently used entries are evicted
+
+    Methods
+    -------
+    lookup()
+        Find the cache entry for a url, if there is one
+
+    is_fresh()
+        Check whether a cache entry is still within its TTL
+
+    validators()
+        Build the conditional request headers for revalidating an entry
+
+    load()
+        Load the cached body for an entry as a CachedResponse
+
+    store()
+        Save a response to the cache
+
+    touch()
+        Mark an entry as revalidated, resetting its age
+
+    evict()
+        Remove least recently used entries until the cache is under max_bytes
+    """
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        logger.info("Building response cache in %s", path)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+        # Work out the current size once, then keep it up to date as entries are added and removed
+        self._lock = threading.Lock()
+        self._size = sum(meta['size'] for meta in self._all_meta())
+        logger.debug("Response cache size: %s bytes, limit %s bytes", self._size, self.max_bytes)
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _body_path(self, key):
+        return os.path.join(self.path, key + '.body')
+
+    def _write_atomic(self, path, data):
+        # Write to a temp file and rename over the target, so a killed run never leaves a half written entry
+        # The temp file gets a unique name, as processes sharing the cache directory may write the same entry at once
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False) as f:
+            f.write(data)
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+    def _write_meta(self, meta):
+        self._write_atomic(self._meta_path(meta['key']), json.dumps(meta).encode('utf-8'))
+
+    def _all_meta(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.path, name)) as f:
+                        yield json.load(f)
+                except (OSError, ValueError):
+                    continue
+
+    def lookup(self, url):
+        """
+        Find the cache entry for a url, if there is one
+
+        Parameters
+        ----------
+        url : str
+            URL of the page
+
+        Returns
+        -------
+        meta : dict or None
+            Metadata of the cache entry, None on a miss
+        """
+        key = self._key(url)
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Guard against the body having been evicted by another process
+        if not os.path.exists(self._body_path(key)):
+            return None
+        return meta
+
+    def is_fresh(self, meta, ttl):
+        """
+        Check whether a cache entry is still within its TTL
+
+        Parameters
+        ----------
+        meta : dict
+            Metadata of the cache entry
+        ttl : float
+            Maximum age of the entry in seconds
+
+        Returns
+        -------
+        bool
+            True if the entry can be served without contacting the server
+        """
+        return time.time() - meta['fetched_at'] < ttl
+
+    def validators(self, meta):
+        """
+        Build the conditional request headers for revalidating an entry
+
+        Parameters
+        ----------
+        meta : dict
+            Metadata of the cache entry
+
+        Returns
+        -------
+        headers : dict
+            If-None-Match/If-Modified-Since headers, empty if the server sent no validators
+        """
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, meta):
+        """
+        Load the cached body for an entry as a CachedResponse
+
+        Parameters
+        ----------
+        meta : dict
+            Metadata of the cache entry
+
+        Returns
+        -------
+        response : CachedResponse or None
+            The cached page, None if the body has gone missing
+        """
+        try:
+            with open(self._body_path(meta['key']), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+
+        # Record the access so eviction removes the least recently used entries first
+        meta['accessed_at'] = time.time()
+        self._write_meta(meta)
+
+        return CachedResponse(meta['url'], content, meta['encoding'], headers=self.validators(meta))
+
+    def store(self, url, response):
+        """
+        Save a response to the cache
+
+        Parameters
+        ----------
+        url : str
+            URL the response was fetched from
+        response : requests.Response
+            A successful response, with its content already read
+        """
+        key = self._key(url)
+        previous = self.lookup(url)
+        now = time.time()
+        meta = {
+            'key': key,
+            'url': url,
+            'fetched_at': now,
+            'accessed_at': now,
+            'encoding': response.encoding or response.apparent_encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': len(response.content),
+        }
+
+        self._write_atomic(self._body_path(key), response.content)
+        self._write_meta(meta)
+        logger.debug("Cached %s, %s bytes", url, meta['size'])
+
+        with self._lock:
+            self._size += meta['size'] - (previous['size'] if previous else 0)
+            over_limit = self._size > self.max_bytes
+
+        if over_limit:
+            self.evict()
+
+    def touch(self, meta):
+        """
+        Mark an entry as revalidated, resetting its age
+
+        Parameters
+        ----------
+        meta : dict
+            Metadata of the cache entry
+        """
+        meta['fetched_at'] = meta['accessed_at'] = time.time()
+        self._write_meta(meta)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is under max_bytes
+        """
+        with self._lock:
+            entries = sorted(self._all_meta(), key=lambda meta: meta.get('accessed_at', 0))
+            self._size = sum(meta['size'] for meta in entries)
+            logger.info("Evicting from response cache, %s bytes over a %s byte limit", self._size, self.max_bytes)
+
+            # Stop at 90% of the limit so we're not evicting again on the very next store
+            target = self.max_bytes * 0.9
+            for meta in entries:
+                if self._size <= target:
+                    break
+                for path in (self._meta_path(meta['key']), self._body_path(meta['key'])):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._size -= meta['size']
+                logger.debug("Evicted %s", meta['url'])
@@ -0,0 +1,187 @@
+"""
+Command line parsing for the scraper
+
+Each job is a subcommand with only the options it uses, ie "python3 scraper results --days 3". The older
+"--results" style flags are still accepted and mapped to the matching subcommand. Only the standard library is
+imported here, so working out what was asked for costs next to nothing before the job's own imports
+"""
+# External Imports
+import os
+import argparse
+
+# The old mutually exclusive flags, with the number of values each one takes
+LEGACY_FLAGS = {
+    "--promotions": 0,
+    "--results": 0,
+    "--schedule": 0,
+    "--backfill": 2,
+    "--enqueue": 0,
+    "--worker": 0,
+    "--daemon": 0,
+}
+
+# Migrations that can be run with the migrate subcommand, as in migrations.MIGRATIONS
+MIGRATIONS = ["matches", "weekly", "dates"]
+
+## Functions
+def common_options():
+    """
+    Options shared by every subcommand: logging, HTTP transport, notifications and metrics
+
+    Returns
+    -------
+    parser : ArgumentParser
+        Parent parser holding the options
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--host-concurrency", type=int, default=int(os.environ.get("SCRAPER_HOST_CONCURRENCY", 4)), help="Maximum parallel requests to a single host")
+    parser.add_argument("--cache-dir", default=os.environ.get("SCRAPER_CACHE_DIR", ".http_cache"), help="Directory for the on-disk HTTP response cache")
+    parser.add_argument("--cache-max-mb", type=int, default=int(os.environ.get("SCRAPER_CACHE_MAX_MB", 512)), help="Size limit of the response cache before old pages are evicted")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch pages from the network")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"), help="Log level for all modules, ie DEBUG or WARNING")
+    parser.add_argument("--log-module-level", action="append", default=[os.environ.get("LOG_MODULE_LEVELS", "")], help="Log level for a single module, as module=LEVEL, ie results=DEBUG. Can be given more than once")
+    parser.add_argument("--initial-rate", type=float, default=float(os.environ.get("SCRAPER_INITIAL_RATE", 5)), help="Requests per second to a host before its rate has adapted")
+    parser.add_argument("--max-wait", type=float, default=float(os.environ.get("SCRAPER_MAX_WAIT", 300)), help="Seconds a request waits for a host's circuit breaker to close before giving up")
+    parser.add_argument("--max-rate", type=float, default=float(os.environ.get("SCRAPER_MAX_RATE", 0)) or None, help="Highest requests per second the rate limiter will allow to a single host")
+    parser.add_argument("--notify-timeout", type=float, default=float(os.environ.get("PUSHOVER_TIMEOUT", 10)), help="Seconds to wait on the Pushover API for each message")
+    parser.add_argument("--notify-linger", type=float, default=float(os.environ.get("PUSHOVER_LINGER", 2)), help="Seconds to wait for more notifications to combine into one digest")
+    parser.add_argument("--metrics-textfile", default=os.environ.get("METRICS_TEXTFILE"), help="Write Prometheus metrics to this file after each run, for the node exporter's textfile collector")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", 0)), help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--timeout", type=float, default=float(os.environ.get("SCRAPER_TIMEOUT", 30)), help="Read timeout in seconds for page fetches")
+    return parser
+
+def results_options(workers_env="SCRAPER_WORKERS", workers=1):
+    """
+    Options for the subcommands that scrape results
+
+    Parameters
+    ----------
+    workers_env : str
+        Environment variable holding the default for --workers
+    workers : int
+        Default for --workers when the environment variable isn't set
+
+    Returns
+    -------
+    parser : ArgumentParser
+        Parent parser holding the options
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get(workers_env, workers)), help="Number of pages to fetch in parallel for the results scraper")
+    parser.add_argument("--by-date", action="store_true", help="Fetch cagematch's all-events listing once per date instead of each promotion's page")
+    parser.add_argument("--listing-location", default=os.environ.get("RESULTS_LISTING_LOCATION", "japan"), help="Location filter for the --by-date listing. Empty searches every location, which also finds shows run abroad but fetches many more pages")
+    parser.add_argument("--days", type=int, default=int(os.environ.get("SCRAPER_DAYS", 7)), help="Number of days back the results scraper looks for shows")
+    parser.add_argument("--settle-days", type=int, default=int(os.environ.get("LEDGER_SETTLE_DAYS", 2)), help="Dates within this many days are always fetched as results may still change")
+    parser.add_argument("--recheck-days", type=int, default=int(os.environ.get("LEDGER_RECHECK_DAYS", 7)), help="Settled pages are fetched again after this many days")
+    parser.add_argument("--full-scan", action="store_true", help="Ignore the scrape ledger and promotion activity and fetch every page in the date range")
+    parser.add_argument("--active-days", type=int, default=int(os.environ.get("ACTIVITY_ACTIVE_DAYS", 30)), help="Promotions that have run a show within this many days are scanned on every run")
+    parser.add_argument("--activity-window", type=int, default=int(os.environ.get("ACTIVITY_WINDOW_DAYS", 90)), help="Days of results used to work out each promotion's activity. Promotions without a show in the window are dormant")
+    parser.add_argument("--sweep-days", type=int, default=int(os.environ.get("ACTIVITY_SWEEP_DAYS", 6)), help="Every promotion, however inactive, is scanned in full at least this often, in calendar days. Kept below --days so no date is missed")
+    parser.add_argument("--lease-seconds", type=float, default=float(os.environ.get("WORKER_LEASE_SECONDS", 300)), help="How long a worker holds a queued page before other workers may take it, unless renewed")
+    return parser
+
+def schedule_options():
+    """
+    Options for the subcommands that scrape the schedule
+
+    Returns
+    -------
+    parser : ArgumentParser
+        Parent parser holding the options
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--all-days", action="store_true", default=os.environ.get("SCHEDULE_ALL_DAYS", "") not in ("", "0"), help="Save the schedule for every upcoming day on the puwota page, not just today, and remove shows no longer listed")
+    return parser
+
+def scheduled_options():
+    """
+    Options for the subcommands that fetch results for scheduled shows
+
+    Returns
+    -------
+    parser : ArgumentParser
+        Parent parser holding the options
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--poll-days", type=int, default=int(os.environ.get("SCHEDULED_POLL_DAYS", 2)), help="Scheduled shows from this many days ago are still polled for results")
+    parser.add_argument("--poll-delay", type=int, default=int(os.environ.get("SCHEDULED_POLL_DELAY", 120)), help="Minutes after a scheduled show starts before its results are first looked for")
+    return parser
+
+def build_parser():
+    """
+    Build the parser for every subcommand
+
+    Returns
+    -------
+    parser : ArgumentParser
+        The scraper's command line parser
+    """
+    common = common_options()
+    results = results_options()
+    schedule = schedule_options()
+    scheduled = scheduled_options()
+
+    parser = argparse.ArgumentParser(prog="scraper", description="Puroview scraper")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    commands.add_parser("promotions", parents=[common], help="Updates promotions listed on cagematch")
+    commands.add_parser("results", parents=[common, results], help="Daily results scraper")
+    commands.add_parser("schedule", parents=[common, schedule], help="Daily schedule scraper")
+    commands.add_parser("scheduled", parents=[common, scheduled], help="Fetch results for the promotions in the schedule, polling shows until their results are posted")
+
+    # A backfill has far more pages to get through than a daily run, so fetches several at once by default
+    backfill = commands.add_parser("backfill", parents=[common, results_options("BACKFILL_WORKERS", 4)], help="Scrape results for every date in a range, resuming an unfinished backfill of the same range")
+    backfill.add_argument("backfill", nargs=2, metavar=("FROM", "TO"), help="First and last dates, as YYYY-MM-DD")
+
+    commands.add_parser("enqueue", parents=[common, results], help="Queue results pages for the last few days, to be scraped by worker processes")
+    commands.add_parser("worker", parents=[common, results], help="Scrape queued results pages until the queue is empty. Any number of workers can run at once")
+
+    migrate = commands.add_parser("migrate", parents=[common], help="Run a data migration. Safe to run alongside the scrapers, and to stop and run again")
+    migrate.add_argument("migration", choices=MIGRATIONS, help="Migration to run")
+    migrate.add_argument("--batch-size", type=int, default=500, help="Documents updated in each round trip")
+
+    # Daemon schedules, as an interval (30m, 6h, 1d) or a five field cron expression. An empty schedule disables the job
+    daemon = commands.add_parser("daemon", parents=[common, results, schedule, scheduled], help="Stay running and run each scraper on its own schedule")
+    daemon.add_argument("--promotions-every", default=os.environ.get("DAEMON_PROMOTIONS", "0 4 * * 1"), help="Daemon schedule for the promotions scraper")
+    daemon.add_argument("--results-every", default=os.environ.get("DAEMON_RESULTS", "1h"), help="Daemon schedule for the results scraper")
+    daemon.add_argument("--schedule-every", default=os.environ.get("DAEMON_SCHEDULE", "0 */3 * * *"), help="Daemon schedule for the schedule scraper")
+    daemon.add_argument("--scheduled-every", default=os.environ.get("DAEMON_SCHEDULED", "10m"), help="Daemon schedule for the scheduled results scraper")
+    daemon.add_argument("--jitter", type=float, default=float(os.environ.get("DAEMON_JITTER", 60)), help="Maximum random delay in seconds added to each daemon job start")
+
+    return parser
+
+def normalise_argv(argv):
+    """
+    Map the old "--results" style flags to their subcommand, so existing cron entries and compose files keep working
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, without the program name
+
+    Returns
+    -------
+    argv : list
+        Arguments with the subcommand first
+    """
+    for index, arg in enumerate(argv):
+        if arg in LEGACY_FLAGS:
+            values = LEGACY_FLAGS[arg]
+            return [arg[2:]] + argv[index + 1:index + 1 + values] + argv[:index] + argv[index + 1 + values:]
+    return argv
+
+def parse_args(argv):
+    """
+    Parse the command line, accepting either a subcommand or one of the old flags
+
+    Parameters
+    ----------
+    argv : list
+        Command line arguments, without the program name
+
+    Returns
+    -------
+    args : Namespace
+        Parsed arguments, with the job name in args.command
+    """
+    return build_parser().parse_args(normalise_argv(argv))
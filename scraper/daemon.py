@@ -0,0 +1,301 @@
+"""
+A long-running mode that keeps the Mongo connection and HTTP pool open, running jobs on an internal schedule
+
+Each job has either an interval ("30m", "6h", "1d") or a five field cron expression ("0 */3 * * *", in local
+time). Start times get random jitter so runs don't line up with other clients, a job is skipped rather than
+started twice if its previous run is still going, and SIGTERM/SIGINT let running jobs finish before exiting. Jobs
+run one at a time, as the per-run counters, metrics and transport stats are shared by the whole process, so a job
+that comes due while another is running waits for it to finish
+"""
+# External Imports
+import re
+import time
+import random
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+## Classes
+# IntervalSchedule Class
+class IntervalSchedule:
+    """
+    Runs a job a fixed time after its previous start
+
+    Attributes
+    ----------
+    seconds : int
+        Time between starts
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def next_after(self, moment, first=False):
+        """
+        Find the next start time
+
+        Parameters
+        ----------
+        moment : datetime
+            Time of the previous start, or the daemon start time
+        first : bool
+            True when the daemon has just started, interval jobs then run straight away
+
+        Returns
+        -------
+        datetime
+            Time of the next start
+        """
+        return moment if first else moment + timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return f"every {self.seconds}s"
+
+# CronSchedule Class
+class CronSchedule:
+    """
+    Runs a job at the times matching a five field cron expression: minute, hour, day of month, month, day of week
+
+    Each field accepts *, numbers, ranges (1-5), lists (1,3,5) and steps (*/15, 0-30/10). Day of week is 0-6 from
+    Sunday, and as in cron a time matches if either the day of month or the day of week matches when both are set
+
+    Attributes
+    ----------
+    expression : str
+        The cron expression
+
+    fields : list
+        Allowed values for each field
+    """
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        self.fields = [self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.RANGES)]
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-'))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high:
+                raise ValueError(f"Cron field {field} outside {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _matches(self, moment):
+        minutes, hours, days, months, weekdays = self.fields
+        if moment.minute not in minutes or moment.hour not in hours or moment.month not in months:
+            return False
+
+        day_match = moment.day in days
+        weekday_match = (moment.isoweekday() % 7) in weekdays
+        if self._any_day or self._any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, moment, first=False):
+        """
+        Find the next start time
+
+        Parameters
+        ----------
+        moment : datetime
+            Time to search from
+        first : bool
+            Unused, cron jobs always wait for their next matching time
+
+        Returns
+        -------
+        datetime
+            The first matching minute after moment
+        """
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        # Step a minute at a time, skipping whole hours and days that can't match to keep this quick
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.fields[3]:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif candidate.hour not in self.fields[1]:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif self._matches(candidate):
+                return candidate
+            else:
+                candidate += timedelta(minutes=1)
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+    def __repr__(self):
+        return f"cron '{self.expression}'"
+
+# Job Class
+class Job:
+    """
+    A job run by the daemon
+
+    Attributes
+    ----------
+    name : str
+        Name of the job, ie "results"
+
+    func : function
+        Called with no arguments to run the job
+
+    schedule : IntervalSchedule or CronSchedule
+        When the job runs
+
+    jitter : float
+        Maximum random delay in seconds added to each start
+
+    next_run : datetime
+        When the job is next due
+    """
+    def __init__(self, name, func, schedule, jitter=0):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.next_run = None
+        self.running = threading.Lock()
+        self.thread = None
+
+    def plan(self, moment, first=False):
+        """
+        Set the next start time, with jitter
+
+        Parameters
+        ----------
+        moment : datetime
+            Time to plan from
+        first : bool
+            True when the daemon has just started
+        """
+        self.next_run = self.schedule.next_after(moment, first) + timedelta(seconds=random.uniform(0, self.jitter))
+        logger.info("Next %s run at %s", self.name, self.next_run.strftime('%d.%m.%y-%H:%M:%S'))
+
+# Scheduler Class
+class Scheduler:
+    """
+    Runs jobs on their schedules until told to stop
+
+    Attributes
+    ----------
+    jobs : list
+        Jobs to run
+
+    Methods
+    -------
+    run()
+        Run jobs as they become due, until stop() is called or a SIGTERM/SIGINT is received
+
+    stop()
+        Stop starting new jobs and let the running ones finish
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._stop = threading.Event()
+
+        # Held by the job that's running, so each run's counters and stats only hold its own work
+        self._one_at_a_time = threading.Lock()
+
+    def stop(self, *_):
+        """
+        Stop starting new jobs and let the running ones finish
+        """
+        if not self._stop.is_set():
+            logger.info("Shutting down, waiting for running jobs to finish")
+        self._stop.set()
+
+    def _run_job(self, job):
+        try:
+            with self._one_at_a_time:
+                # The daemon may have been told to stop while this job waited on another
+                if self._stop.is_set():
+                    return
+                start = time.monotonic()
+                logger.info("Starting %s job", job.name)
+                job.func()
+                logger.info("Finished %s job in %.1fs", job.name, time.monotonic() - start)
+        except Exception:
+            # A failed run shouldn't take the daemon down, the job runs again at its next slot
+            logger.exception("%s job failed", job.name)
+        finally:
+            job.running.release()
+
+    def run(self):
+        """
+        Run jobs as they become due, until stop() is called or a SIGTERM/SIGINT is received
+        """
+        if not self.jobs:
+            logger.error("No jobs scheduled, every daemon schedule is disabled")
+            return
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        now = datetime.now()
+        for job in self.jobs:
+            logger.info("Scheduling %s job %s", job.name, job.schedule)
+            job.plan(now, first=True)
+
+        while not self._stop.is_set():
+            now = datetime.now()
+            for job in self.jobs:
+                if job.next_run > now:
+                    continue
+
+                # Skip this slot rather than starting a second copy of a job that is still running
+                if job.running.acquire(blocking=False):
+                    job.thread = threading.Thread(target=self._run_job, args=(job,), name=f"job-{job.name}")
+                    job.thread.start()
+                else:
+                    logger.warning("Skipping %s run, the previous run is still going", job.name)
+                job.plan(now)
+
+            # Sleep until the next job is due, waking early on shutdown
+            wait = min(job.next_run for job in self.jobs) - datetime.now()
+            self._stop.wait(max(0.0, min(wait.total_seconds(), 60)))
+
+        for job in self.jobs:
+            if job.thread and job.thread.is_alive():
+                job.thread.join()
+        logger.info("Daemon stopped")
+
+## Functions
+def parse_schedule(spec):
+    """
+    Parse a job schedule, either an interval like "30m" or a five field cron expression
+
+    Parameters
+    ----------
+    spec : str
+        The schedule
+
+    Returns
+    -------
+    IntervalSchedule or CronSchedule
+        The parsed schedule
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd])\s*', spec)
+    if match:
+        return IntervalSchedule(int(match.group(1)) * INTERVAL_UNITS[match.group(2)])
+    return CronSchedule(spec)
@@ -0,0 +1,281 @@
+"""
+The scraper jobs, shared by the one-off command line runs and the daemon
+
+Each job takes the parsed arguments along with the runtime holding the database connection, HTTP transport and
+Pushover notifier. The scrapers, and bs4 and lxml with them, are imported inside each job so a process only pays for
+the modules its own job uses
+"""
+# External Imports
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+## Functions
+def load_activity(args):
+    """
+    Load promotion activity, so dormant promotions are scanned less often, unless a full scan was asked for
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+
+    Returns
+    -------
+    Activity or None
+        Promotion activity, None with --full-scan
+    """
+    from activity import Activity
+
+    if args.full_scan:
+        return None
+    # A sweep has to come round before the oldest date it covered drops out of the run's date range
+    sweep_days = args.sweep_days
+    if sweep_days >= args.days:
+        sweep_days = max(1, args.days - 1)
+        logger.warning("Sweeping every %s days but only looking back %s days, sweeping every %s days instead", args.sweep_days, args.days, sweep_days)
+    return Activity(active_days=args.active_days, window_days=args.activity_window, sweep_days=sweep_days)
+
+def run_promotions(args, runtime):
+    """
+    Update the promotions listed on cagematch
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from promotions import PromotionsScraper
+
+    runtime.connect()
+    logger.info("Launching promotions scraper")
+    scraper = PromotionsScraper(transport=runtime.transport)
+    scraper.update_promotions()
+
+def run_results(args, runtime):
+    """
+    Scrape results for the last few days and notify with the shows added
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from ledger import Ledger
+    from results import ResultsScraper
+
+    runtime.connect()
+    logger.info("Launching results scraper")
+
+    #Instantiate an instance of the ResultsScraper class
+    scraper = ResultsScraper(transport=runtime.transport, workers=args.workers, host_concurrency=args.host_concurrency, listing_location=args.listing_location)
+
+    # Build a list of the dates for the last few days, 7 by default
+    date_list = [(datetime.today() - timedelta(days=x)).strftime('%d.%m.%Y') for x in reversed(range(args.days))]
+    logger.debug("date_list: %s", date_list)
+
+    # Load the scrape ledger so pages that have settled since they were last fetched are skipped
+    ledger = None if args.full_scan else Ledger(date_list, settle_days=args.settle_days, recheck_days=args.recheck_days)
+
+    # Run the event scraper and store the returned string
+    # The all-events listing covers every promotion in one request per date, so activity only applies per promotion
+    if args.by_date:
+        updated_events = scraper.update_events_by_date(date_list, ledger)
+    else:
+        updated_events = scraper.update_events(date_list, ledger, activity=load_activity(args))
+
+    # Build notifiers
+    logger.info("Sending notifications")
+
+    # Send message based on whether updated_events contains any entries
+    if updated_events:
+        runtime.pushover.push_message('Results Scraper complete, added shows:\n' + updated_events)
+    else:
+        runtime.pushover.push_message('Results Scraper complete, no shows added.')
+
+def run_schedule(args, runtime):
+    """
+    Scrape today's schedule, or every upcoming day on the page with --all-days, and notify with the shows found
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from schedule import ScheduleScraper
+
+    runtime.connect()
+    logger.info("Launching schedule scraper")
+
+    # Instantiate an instance of the ScheduleScraper class
+    scraper = ScheduleScraper(transport=runtime.transport, all_days=args.all_days)
+
+    # Scrape scheduled shows and add to the database
+    show_list = scraper.update_schedule()
+
+    # Sent a pushover with the scraped shows
+    if args.all_days:
+        updated_shows = '\n'.join(s['date'] + " " + s['promotion'] + ", " + s.get('time', '') for s in show_list)
+    else:
+        updated_shows = '\n'.join(s['promotion'] + ", " + s['time'] for s in show_list)
+
+    if show_list:
+        runtime.pushover.push_message('Schedule scraper complete, added shows:\n' + updated_shows)
+    else:
+        runtime.pushover.push_message('Schedule scraper complete, no shows added.')
+
+def run_scheduled(args, runtime):
+    """
+    Fetch results only for the promotions and dates of scheduled shows still waiting on them
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from ledger import Ledger
+    from results import ResultsScraper
+    from targets import ScheduleTargets
+
+    runtime.connect()
+    logger.info("Launching scheduled results scraper")
+
+    targets = ScheduleTargets(poll_days=args.poll_days, start_delay=args.poll_delay)
+    scraper = ResultsScraper(transport=runtime.transport, host_concurrency=args.host_concurrency)
+
+    # Record the polled pages in the ledger, no entries need loading as the schedule decides what's due
+    updated_shows = scraper.scrape_pages(targets.pages(), Ledger([]), ttl=ScheduleTargets.PAGE_TTL)
+
+    # This runs every few minutes, so only notify when something was found
+    if updated_shows:
+        runtime.pushover.push_message('Scheduled results complete, added shows:\n' + '\n'.join(updated_shows))
+
+def run_backfill(args, runtime):
+    """
+    Scrape results for a historical date range, resuming an unfinished backfill of the same range
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from backfill import backfill
+    from results import ResultsScraper
+
+    runtime.connect()
+    start, end = args.backfill
+    logger.info("Launching results backfill for %s to %s", start, end)
+
+    scraper = ResultsScraper(transport=runtime.transport, workers=args.workers, host_concurrency=args.host_concurrency)
+    updated_events = backfill(scraper, start, end)
+
+    shows_added = len(updated_events.splitlines())
+    runtime.pushover.push_message(f'Results backfill {start} to {end} complete, {shows_added} shows added.')
+
+def run_enqueue(args, runtime):
+    """
+    Queue a results page for every promotion over the last few days, for worker processes to scrape
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from ledger import Ledger
+    from workqueue import enqueue_results
+
+    runtime.connect()
+    date_list = [(datetime.today() - timedelta(days=x)).strftime('%d.%m.%Y') for x in reversed(range(args.days))]
+    ledger = None if args.full_scan else Ledger(date_list, settle_days=args.settle_days, recheck_days=args.recheck_days)
+    enqueue_results(date_list, ledger, activity=load_activity(args))
+
+def run_results_worker(args, runtime):
+    """
+    Scrape queued results pages until the queue is empty, alongside any number of other workers
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from ledger import Ledger
+    from results import ResultsScraper
+    from workqueue import WorkQueue, run_worker
+
+    runtime.connect()
+    scraper = ResultsScraper(transport=runtime.transport, workers=args.workers, host_concurrency=args.host_concurrency)
+
+    # Record pages in the ledger as they are saved, no entries need loading as the queue decides what's due
+    updated_shows = run_worker(scraper, WorkQueue(lease_seconds=args.lease_seconds), Ledger([]))
+
+    if updated_shows:
+        runtime.pushover.push_message('Results worker complete, added shows:\n' + '\n'.join(updated_shows))
+
+def run_migrate(args, runtime):
+    """
+    Run a data migration, which can be stopped and run again without redoing finished work
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed command line arguments
+    runtime : Runtime
+        Database connection, HTTP transport and notifier, created as they are used
+    """
+    from migrations import MIGRATIONS
+
+    runtime.connect()
+    logger.info("Running %s migration", args.migration)
+    MIGRATIONS[args.migration](batch_size=args.batch_size)
+
+# Jobs by name, as used on the command line and in the daemon
+JOBS = {
+    "promotions": run_promotions,
+    "results": run_results,
+    "schedule": run_schedule,
+    "scheduled": run_scheduled,
+    "backfill": run_backfill,
+    "enqueue": run_enqueue,
+    "worker": run_results_worker,
+    "migrate": run_migrate,
+}
+
+# Modules each job imports when it runs, so they can be loaded up front without running the job
+JOB_IMPORTS = {
+    "promotions": ["promotions"],
+    "results": ["activity", "ledger", "results"],
+    "schedule": ["schedule"],
+    "scheduled": ["ledger", "results", "targets"],
+    "backfill": ["backfill", "results"],
+    "enqueue": ["activity", "ledger", "workqueue"],
+    "worker": ["ledger", "results", "workqueue"],
+    "migrate": ["migrations"],
+}
+
+def load(name):
+    """
+    Import the modules a job needs without running it, ie to measure startup time
+
+    Parameters
+    ----------
+    name : str
+        Name of the job, as in JOBS
+    """
+    # __import__ rather than importlib, as only imports through the import statement machinery show up in -X importtime
+    for module in JOB_IMPORTS[name]:
+        __import__(module)
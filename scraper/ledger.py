@@ -0,0 +1,167 @@
+# External Imports
+import logging
+from datetime import datetime, timedelta
+
+# Internal Imports
+from models import ScrapeLedger
+from bulk import bulk_upsert, content_hash
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# Ledger Class
+class Ledger:
+    """
+    A record of when each (promotion, date) page was last scraped, used to skip pages that have settled
+
+    Attributes
+    ----------
+    settle_days : int
+        Dates within this many days of today may still change, so are always fetched
+
+    recheck_days : int
+        Settled pages are fetched again once their last fetch is older than this
+
+    entries : dict
+        Ledger documents for the run's date range, keyed by (cagematch_id, date)
+
+    Methods
+    -------
+    load()
+        Load the entries for a date range
+
+    is_due()
+        Check whether a (promotion, date) page needs fetching on this run
+
+    due_dates()
+        Filter a date list down to the dates due for a promotion
+
+    record()
+        Record the outcome of scraping a (promotion, date) page
+
+    flush()
+        Write the recorded entries to the database in one batch
+
+    content_hash()
+        Build a stable hash of the shows found for a date
+    """
+    def __init__(self, date_list, settle_days=2, recheck_days=7):
+        logger.info("Loading scrape ledger")
+
+        self.settle_days = settle_days
+        self.recheck_days = recheck_days
+        self.load(date_list)
+
+        # Entries recorded but not yet written
+        self._pending = []
+
+    def load(self, date_list):
+        """
+        Load the entries for a date range, replacing any loaded before
+
+        Parameters
+        ----------
+        date_list : list
+            Dates in the format %d.%m.%Y
+        """
+        # Load every entry for the date range in one query, rather than one lookup per page
+        self.entries = {(entry.promotion, entry.date): entry for entry in ScrapeLedger.objects(date__in=date_list)}
+        logger.info("Loaded %s ledger entries", len(self.entries))
+
+    def is_due(self, cagematch_id, date):
+        """
+        Check whether a (promotion, date) page needs fetching on this run
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date : str
+            Date in the format %d.%m.%Y
+
+        Returns
+        -------
+        bool
+            True if the page is new, may still change, or is due a periodic recheck
+        """
+        entry = self.entries.get((cagematch_id, date))
+
+        # Never fetched before
+        if not entry or not entry.fetched_at:
+            return True
+
+        # Results may still be posted or corrected for recent dates
+        age = (datetime.today().date() - datetime.strptime(date, '%d.%m.%Y').date()).days
+        if age <= self.settle_days:
+            return True
+
+        # Settled, but recheck occasionally in case of late changes on cagematch
+        return datetime.utcnow() - entry.fetched_at > timedelta(days=self.recheck_days)
+
+    def due_dates(self, cagematch_id, date_list):
+        """
+        Filter a date list down to the dates due for a promotion
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date_list : list
+            List of dates in the run
+
+        Returns
+        -------
+        due : list
+            Dates that need fetching, in the original order
+        """
+        due = [date for date in date_list if self.is_due(cagematch_id, date)]
+        logger.debug("%s of %s dates due for %s", len(due), len(date_list), cagematch_id)
+        return due
+
+    def record(self, cagematch_id, date, shows):
+        """
+        Record the outcome of scraping a (promotion, date) page, to be written on the next flush()
+
+        Parameters
+        ----------
+        cagematch_id : str
+            Cagematch id of the promotion
+        date : str
+            Date in the format %d.%m.%Y
+        shows : list
+            Show dicts found for the date, empty if there were none
+        """
+        entry = {
+            'promotion': cagematch_id,
+            'date': date,
+            'fetched_at': datetime.utcnow(),
+            'has_events': bool(shows),
+            'content_hash': self.content_hash(shows),
+        }
+        self._pending.append(entry)
+        logger.debug("Recorded ledger entry: %s", entry)
+
+    def flush(self):
+        """
+        Write the recorded entries to the database in one batch
+        """
+        if self._pending:
+            bulk_upsert(ScrapeLedger, self._pending, ['promotion', 'date'])
+            self._pending = []
+
+    @staticmethod
+    def content_hash(shows):
+        """
+        Build a stable hash of the shows found for a date
+
+        Parameters
+        ----------
+        shows : list
+            Show dicts found for the date
+
+        Returns
+        -------
+        str
+            SHA-1 hex digest of the shows, independent of key order
+        """
+        return content_hash(shows)
@@ -0,0 +1,121 @@
+"""
+Logging setup for the scraper
+
+Records are handed to a queue and written by a background thread, so console and file I/O never block the
+scraping threads. Levels can be set per module, and hot loops count items with count() rather than logging each
+one at INFO, with the totals logged once at the end of the run by log_summary()
+https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+"""
+# External Imports
+import queue
+import atexit
+import logging
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s:%(name)s:%(levelname)s# %(message)s'
+DATE_FORMAT = '%d.%m.%y-%H:%M:%S'
+
+# Per-run counters, updated from the scraper hot loops
+counters = Counter()
+_counters_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+## Functions
+def parse_module_levels(spec):
+    """
+    Parse a module level spec, ie "results=DEBUG,transport=WARNING"
+
+    Parameters
+    ----------
+    spec : str or list
+        Comma separated module=LEVEL pairs, or a list of them
+
+    Returns
+    -------
+    levels : dict
+        Level names keyed by logger name
+    """
+    if isinstance(spec, str):
+        spec = [spec]
+
+    levels = {}
+    for part in ','.join(spec or []).split(','):
+        if '=' in part:
+            name, level = part.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(level="INFO", module_levels=None, log_file="scraper.log"):
+    """
+    Send all logging through a queue to console and file handlers running on a background thread
+
+    Parameters
+    ----------
+    level : str
+        Level for the root logger, applies to any module without its own level
+    module_levels : dict, optional
+        Levels keyed by logger name, ie {"results": "DEBUG"}
+    log_file : str, optional
+        Path of the log file, None to only log to the console
+
+    Returns
+    -------
+    listener : QueueListener
+        The running listener, stopped automatically at exit
+    """
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+
+    # Create handlers, levels are controlled by the loggers so the handlers pass everything they receive
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # The root logger only puts records on the queue, the listener thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    # Skip the record fields we never output, saves work on every call
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    logger.debug("Logging configured, root level %s, module levels %s", level, module_levels)
+    return listener
+
+def count(name, amount=1):
+    """
+    Add to a per-run counter
+
+    Parameters
+    ----------
+    name : str
+        Name of the counter, ie "shows"
+    amount : int
+        Amount to add
+    """
+    with _counters_lock:
+        counters[name] += amount
+
+def log_summary():
+    """
+    Log the per-run counters in a single line, then reset them
+    """
+    with _counters_lock:
+        summary = ', '.join(f"{name}: {value}" for name, value in sorted(counters.items()))
+        counters.clear()
+    logger.info("Run summary - %s", summary or "nothing counted")
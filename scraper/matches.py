@@ -0,0 +1,129 @@
+"""
+Structured match records parsed from cagematch's match result lines
+
+Each result line, ie "Shingo Takagi defeats Kenoh (7:52) - TITLE CHANGE !!!", becomes a compact record of who
+was in the match, who won and lost, how long it went, whether a title changed hands and the match type. The
+records are stored alongside the raw lines in Results.matches, which is indexed on participant names and the
+title change flag, so questions like "every match involving a wrestler" are index lookups instead of regex scans
+"""
+# External Imports
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when the parser changes, so the migration knows which stored records to parse again
+PARSER_VERSION = 1
+
+# Pieces of a result line
+TAGS = re.compile(r'<[^>]+>')
+TITLE_CHANGE = re.compile(r'\s*-?\s*TITLE CHANGE\s*!*', re.IGNORECASE)
+MATCH_TIME = re.compile(r'\((\d{1,3}:\d{2})\)')
+DEFEATS = re.compile(r'\s+defeats?\s+')
+VERSUS = re.compile(r'\s+vs\.?\s+')
+# How the match finished, ie "by DQ", or "- Double Count Out" after a draw
+FINISH = re.compile(r'\s+(?:by\s+|-\s+)(.*)$')
+# Managers and seconds, ie "(w/ Gedo)", and champion markers, ie "(c)"
+COMPANIONS = re.compile(r'\s*\((?:w/[^)]*|c)\)')
+# Team names followed by their members, ie "Bullet Club (EVIL & Dick Togo)"
+TEAM = re.compile(r'[^(),&]*\(([^()]*)\)')
+NAME_SEPARATOR = re.compile(r'\s*(?:&|,|\band\b)\s*')
+
+# Match types for lines that weren't labelled on the page, by the number of wrestlers on each side
+TEAM_MATCH_TYPES = {1: "Singles Match", 2: "Tag Team Match", 3: "Six Man Tag Team Match", 4: "Eight Man Tag Team Match"}
+
+## Functions
+def split_side(text):
+    """
+    Split one side of a match into the wrestlers on it
+
+    Parameters
+    ----------
+    text : str
+        Side of the match, ie "Bullet Club (EVIL & Dick Togo) (w/ Gedo)"
+
+    Returns
+    -------
+    names : list
+        Wrestler names, with team names, managers and champion markers dropped
+    """
+    text = COMPANIONS.sub('', text)
+    text = TEAM.sub(lambda team: ' & ' + team.group(1) + ' & ', text)
+    return [name.strip() for name in NAME_SEPARATOR.split(text) if name.strip()]
+
+def infer_match_type(sides):
+    """
+    Work out a match type from the size of each side, for lines without a label
+
+    Parameters
+    ----------
+    sides : list
+        Wrestler names on each side of the match
+
+    Returns
+    -------
+    str or None
+        Match type, or None if the sides couldn't be worked out
+    """
+    sizes = {len(side) for side in sides}
+    if len(sides) < 2 or not all(sizes):
+        return None
+    if len(sides) == 2 and len(sizes) == 1:
+        return TEAM_MATCH_TYPES.get(sizes.pop(), "Tag Team Match")
+    return "Multi Man Match"
+
+def parse_match(text, match_type=None):
+    """
+    Parse a match result line into a structured record
+
+    Works on both the raw lines from cagematch and the cleaned lines stored in Results.results
+
+    Parameters
+    ----------
+    text : str
+        Match result line
+    match_type : str, optional
+        Match type label from the page, ie "Singles Match:". Worked out from the sides when not given
+
+    Returns
+    -------
+    match : dict
+        Participants, winners and losers, outcome (win, draw or no contest), time, title change flag and match type
+    """
+    line = TAGS.sub('', text)
+
+    title_change = bool(TITLE_CHANGE.search(line))
+    line = TITLE_CHANGE.sub('', line)
+
+    times = MATCH_TIME.findall(line)
+    line = MATCH_TIME.sub('', line).strip()
+
+    winners, losers, sides = [], [], []
+    outcome = None
+    if DEFEATS.search(line):
+        winner_text, loser_text = DEFEATS.split(line, 1)
+        loser_text = FINISH.sub('', loser_text)
+        winners, losers = split_side(winner_text), split_side(loser_text)
+        sides = [winners, losers]
+        outcome = "win"
+    elif VERSUS.search(line):
+        finish = FINISH.search(line)
+        if finish:
+            line = line[:finish.start()]
+            outcome = "no contest" if "no contest" in finish.group(1).lower() else "draw"
+        sides = [split_side(side) for side in VERSUS.split(line)]
+
+    # Lines that are neither a win nor a versus, ie segments and angles, have no participants rather than a guess
+    participants = [name for side in sides for name in side]
+
+    match = {
+        'participants': participants,
+        'winners': winners,
+        'losers': losers,
+        'outcome': outcome,
+        'time': times[-1] if times else None,
+        'title_change': title_change,
+        'match_type': match_type.strip().rstrip(':') if match_type else infer_match_type(sides),
+    }
+    logger.debug("Parsed match %s as %s", text, match)
+    return match
@@ -0,0 +1,288 @@
+"""
+Timing and throughput metrics for the scrapers, exported in the Prometheus text format and as a JSON run report
+
+Metrics are kept in-process as labelled counters and histograms. They can be written to a textfile for the node
+exporter's textfile collector, served over HTTP for Prometheus to pull, and summarised per run, so a slow run can be
+put down to cagematch latency, parsing, the cleaners or the database
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+# External Imports
+import os
+import copy
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Help text for each metric, also the list of metric names in the order they're exported
+HELP = {
+    "scraper_stage_seconds": "Time spent in each scraper stage",
+    "scraper_http_request_seconds": "Time taken by HTTP requests that went to the network",
+    "scraper_http_requests_total": "HTTP requests made, including cache hits",
+    "scraper_http_bytes_total": "Bytes transferred over the wire",
+    "scraper_db_operation_seconds": "Time taken by database writes",
+    "scraper_db_operations_total": "Documents written or skipped by database writes",
+}
+
+# Series keyed by (metric name, sorted label pairs)
+# Counters hold a number, histograms hold bucket counts, sum and count
+_series = {}
+_series_lock = threading.Lock()
+
+## Functions
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def inc(name, amount=1, **labels):
+    """
+    Add to a counter
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, ie "scraper_http_requests_total"
+    amount : float
+        Amount to add
+    **labels
+        Labels identifying the series, ie host="www.cagematch.net"
+    """
+    key = _key(name, labels)
+    with _series_lock:
+        _series[key] = _series.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """
+    Record a value in a histogram
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, ie "scraper_stage_seconds"
+    value : float
+        Value to record, in seconds for timings
+    **labels
+        Labels identifying the series, ie stage="parse"
+    """
+    key = _key(name, labels)
+    with _series_lock:
+        histogram = _series.get(key)
+        if histogram is None:
+            histogram = _series[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Record how long the block takes in a histogram, including when it raises
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, ie "scraper_stage_seconds"
+    **labels
+        Labels identifying the series, ie stage="parse"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def timed_iter(iterable, name, **labels):
+    """
+    Record the total time spent producing an iterable's items in a histogram, without waiting for all of them first
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to pass through, ie a generator parsing a page
+    name : str
+        Name of the metric, ie "scraper_stage_seconds"
+    **labels
+        Labels identifying the series, ie stage="parse"
+
+    Yields
+    ------
+    item
+        Each item of the iterable, as it is produced
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        observe(name, elapsed, **labels)
+
+def snapshot():
+    """
+    Copy every series, so the metrics for a single run can be worked out later with run_report()
+
+    Returns
+    -------
+    dict
+        Copy of the series
+    """
+    with _series_lock:
+        return copy.deepcopy(_series)
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+def render():
+    """
+    Render every series in the Prometheus text format
+
+    Returns
+    -------
+    str
+        The metrics, ready to serve or write to a textfile
+    """
+    series = snapshot()
+    lines = []
+    for name in sorted({name for name, _ in series}, key=lambda name: list(HELP).index(name) if name in HELP else len(HELP)):
+        entries = sorted((pairs, value) for (metric, pairs), value in series.items() if metric == name)
+        is_histogram = isinstance(entries[0][1], dict)
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} {'histogram' if is_histogram else 'counter'}")
+        for pairs, value in entries:
+            if is_histogram:
+                for bound, bucket_count in zip(BUCKETS, value['buckets']):
+                    lines.append(f"{name}_bucket{_labels(pairs, [('le', str(bound))])} {bucket_count}")
+                lines.append(f"{name}_bucket{_labels(pairs, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_labels(pairs)} {value['sum']}")
+                lines.append(f"{name}_count{_labels(pairs)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(pairs)} {value}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path):
+    """
+    Write the metrics to a file for the node exporter's textfile collector
+
+    The file is written alongside and renamed into place, so the collector never reads a partial file
+
+    Parameters
+    ----------
+    path : str
+        Path of the .prom file
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(render())
+    os.replace(temp_path, path)
+    logger.debug("Wrote metrics to %s", path)
+
+def serve(port, host=""):
+    """
+    Serve the metrics over HTTP for Prometheus to pull, on a background thread
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on
+    host : str
+        Address to listen on, all interfaces by default
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        The running server
+    """
+    # http.server is only imported when metrics are served, it adds noticeably to the startup of short jobs
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """
+        Serves the current metrics to Prometheus on any GET
+        """
+        def do_GET(self):
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on port %s", server.server_port)
+    return server
+
+def _quantile(buckets, total, quantile):
+    # Estimate from the bucket bounds, as Prometheus' histogram_quantile does without interpolation
+    if not total:
+        return None
+    for bound, bucket_count in zip(BUCKETS, buckets):
+        if bucket_count >= quantile * total:
+            return bound
+    return float('inf')
+
+def run_report(before):
+    """
+    Summarise the metrics recorded since a snapshot, for a single run
+
+    Parameters
+    ----------
+    before : dict
+        Snapshot taken when the run started
+
+    Returns
+    -------
+    report : dict
+        Count, total, mean and estimated 50th/95th percentiles for each histogram series, the value of each counter,
+        and the promotions that took longest across all stages
+    """
+    after = snapshot()
+    report = {'histograms': [], 'counters': [], 'slowest_promotions': []}
+    promotion_seconds = {}
+
+    for (name, pairs), value in sorted(after.items()):
+        previous = before.get((name, pairs))
+        labels = dict(pairs)
+        if isinstance(value, dict):
+            previous = previous or {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            total = value['count'] - previous['count']
+            if not total:
+                continue
+            buckets = [now - then for now, then in zip(value['buckets'], previous['buckets'])]
+            seconds = value['sum'] - previous['sum']
+            report['histograms'].append({
+                'name': name, 'labels': labels, 'count': total, 'sum': round(seconds, 6), 'mean': round(seconds / total, 6),
+                'p50': _quantile(buckets, total, 0.5), 'p95': _quantile(buckets, total, 0.95),
+            })
+            if name == "scraper_stage_seconds" and 'promotion' in labels:
+                promotion_seconds[labels['promotion']] = promotion_seconds.get(labels['promotion'], 0) + seconds
+        else:
+            amount = value - (previous or 0)
+            if amount:
+                report['counters'].append({'name': name, 'labels': labels, 'value': amount})
+
+    report['slowest_promotions'] = [
+        {'promotion': promotion, 'seconds': round(seconds, 6)}
+        for promotion, seconds in sorted(promotion_seconds.items(), key=lambda item: item[1], reverse=True)[:10]
+    ]
+    return report
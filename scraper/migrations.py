@@ -0,0 +1,204 @@
+"""
+Online data migrations, run with "python3 scraper migrate NAME"
+
+Migrations work through the collection in small batches keyed on _id, with the scrapers still running. Each
+batch only updates documents that still need it, so a migration can be stopped and run again at any time and
+carries on from where it got to
+"""
+# External Imports
+import time
+import logging
+from datetime import datetime
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import OperationFailure
+
+# Internal Imports
+from models import Results
+from matches import parse_match, PARSER_VERSION
+from weekly import rebuild, refresh, results_weeks
+
+logger = logging.getLogger(__name__)
+
+# Set once no Results are left with string dates, none are written any more so it stays that way
+_dates_migrated = {'done': False}
+
+## Functions
+def migrate_matches(batch_size=500):
+    """
+    Parse the stored result lines of every Results document into structured match records
+
+    Documents parsed by an older version of the match parser are parsed again
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of documents read and updated in each round trip
+
+    Returns
+    -------
+    migrated : int
+        Number of documents updated
+    """
+    collection = Results._get_collection()
+    pending = {'matches_version': {'$ne': PARSER_VERSION}}
+    total = collection.count_documents(pending)
+    logger.info("Parsing matches for %s results documents", total)
+
+    migrated = 0
+    last_id = None
+    started = time.monotonic()
+    while True:
+        query = dict(pending, **({'_id': {'$gt': last_id}} if last_id else {}))
+        batch = list(collection.find(query, {'results': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        # The version is part of the filter, so a document the scraper has just rewritten isn't overwritten
+        operations = [
+            UpdateOne({'_id': doc['_id'], 'matches_version': {'$ne': PARSER_VERSION}}, {'$set': {
+                'matches': [parse_match(result) for result in doc.get('results') or []],
+                'matches_version': PARSER_VERSION,
+            }})
+            for doc in batch
+        ]
+        migrated += collection.bulk_write(operations, ordered=False).modified_count
+
+        elapsed = time.monotonic() - started
+        logger.info("Parsed matches for %s/%s documents, %.0f docs/s", migrated, total, migrated / elapsed if elapsed else 0)
+
+    logger.info("Match migration complete, %s documents updated", migrated)
+    return migrated
+
+def convert_dates(batch):
+    """
+    Convert the string dates of some Results documents to datetimes, deleting any that are already stored twice
+
+    A show saved again since dates became datetimes is stored twice, once under each kind of date. The copy with
+    the string date is the older one, so it is deleted instead of converted
+
+    Parameters
+    ----------
+    batch : list
+        Results documents with string dates, with at least their _id, title and date
+
+    Returns
+    -------
+    converted : int
+        Number of documents converted or removed as duplicates
+    """
+    collection = Results._get_collection()
+    converted = []
+    for doc in batch:
+        try:
+            converted.append(dict(doc, date=datetime.strptime(doc['date'], '%d.%m.%Y'), old_date=doc['date']))
+        except ValueError:
+            logger.warning("Leaving %s with unreadable date %s", doc['_id'], doc['date'])
+    if not converted:
+        return 0
+
+    # Shows the scrapers have saved again under the new date
+    saved = {
+        (doc.get('title'), doc['date'])
+        for doc in collection.find({'title': {'$in': [doc.get('title') for doc in converted]}, 'date': {'$in': [doc['date'] for doc in converted]}}, {'title': 1, 'date': 1})
+    }
+
+    # The old date is part of the filter, so a document changed since it was read is left for the next run
+    operations = [
+        DeleteOne({'_id': doc['_id'], 'date': doc['old_date']}) if (doc.get('title'), doc['date']) in saved
+        else UpdateOne({'_id': doc['_id'], 'date': doc['old_date']}, {'$set': {'date': doc['date']}})
+        for doc in converted
+    ]
+    write = collection.bulk_write(operations, ordered=False)
+
+    # Weekly summaries only pick up shows with datetime dates, so the converted shows are added to them
+    refresh(results_weeks(converted))
+    return write.modified_count + write.deleted_count
+
+def convert_saved_dates(shows):
+    """
+    Convert the stored copies of some shows that still have string dates, ie just before the scraper saves them again
+
+    Until the dates migration has run, shows saved before it would otherwise not match on their key and be inserted
+    a second time, and reported as new. Once no string dates are left this is a single cached check
+
+    Parameters
+    ----------
+    shows : list
+        Show dicts about to be saved, with a title and a datetime date
+
+    Returns
+    -------
+    converted : int
+        Number of stored documents converted or removed as duplicates
+    """
+    if _dates_migrated['done']:
+        return 0
+    collection = Results._get_collection()
+    if not collection.find_one({'date': {'$type': 'string'}}, {'_id': 1}):
+        _dates_migrated['done'] = True
+        return 0
+
+    titles = list({show.get('title') for show in shows if show.get('title')})
+    days = list({show['date'].strftime('%d.%m.%Y') for show in shows if isinstance(show.get('date'), datetime)})
+    if not titles or not days:
+        return 0
+    batch = list(collection.find({'title': {'$in': titles}, 'date': {'$in': days}}, {'title': 1, 'date': 1, 'promotion': 1}))
+    converted = convert_dates(batch) if batch else 0
+    if converted:
+        logger.info("Converted the string dates of %s stored shows before saving them again", converted)
+    return converted
+
+def migrate_dates(batch_size=500):
+    """
+    Convert the string dates of Results documents, ie "16.10.2026", to datetimes, then drop the old indexes
+
+    Until this has run the results scrapers convert the stored copies of the shows they save, see convert_saved_dates()
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of documents read and updated in each round trip
+
+    Returns
+    -------
+    migrated : int
+        Number of documents converted or removed as duplicates
+    """
+    collection = Results._get_collection()
+    pending = {'date': {'$type': 'string'}}
+    total = collection.count_documents(pending)
+    logger.info("Converting the dates of %s results documents", total)
+
+    migrated = 0
+    last_id = None
+    started = time.monotonic()
+    while True:
+        query = dict(pending, **({'_id': {'$gt': last_id}} if last_id else {}))
+        batch = list(collection.find(query, {'title': 1, 'date': 1, 'promotion': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        migrated += convert_dates(batch)
+
+        elapsed = time.monotonic() - started
+        logger.info("Converted dates for %s/%s documents, %.0f docs/s", migrated, total, migrated / elapsed if elapsed else 0)
+
+    # The old single field indexes carry the _cls prefix so the raw upserts couldn't use them, the new ones replace them
+    Results.ensure_indexes()
+    for index in ('_cls_1_date_1', '_cls_1_title_1', '_cls_1_promotion_1'):
+        try:
+            collection.drop_index(index)
+            logger.info("Dropped index %s", index)
+        except OperationFailure:
+            pass
+
+    logger.info("Date migration complete, %s documents updated", migrated)
+    return migrated
+
+# Migrations by name, as used on the command line
+MIGRATIONS = {
+    "matches": migrate_matches,
+    "weekly": rebuild,
+    "dates": migrate_dates,
+}
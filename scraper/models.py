@@ -2,8 +2,10 @@
 MongoDB models as defined by the Document and DynamicDocument classes
 http://docs.mongoengine.org/apireference.html?highlight=connect#documents
 """
+from datetime import datetime
 from mongoengine import (
-    Document, StringField, DateTimeField, BooleanField, URLField, ListField, DynamicDocument
+    Document, EmbeddedDocument, StringField, DateTimeField, BooleanField, URLField, ListField, IntField, FloatField, DictField,
+    EmbeddedDocumentField, DynamicDocument
 )
 
 class Newsletters(Document):
@@ -29,19 +31,120 @@ class Promotions(Document):
         "allow_inheritance": True
     }
 
+class Match(EmbeddedDocument):
+    participants = ListField(StringField())
+    winners = ListField(StringField())
+    losers = ListField(StringField())
+    outcome = StringField()
+    time = StringField()
+    title_change = BooleanField(default=False)
+    match_type = StringField()
+
 class Results(Document):
     title = StringField()
-    date = StringField()
+    date = DateTimeField()
     location = StringField()
     promotion = StringField()
     results = ListField()
+    matches = ListField(EmbeddedDocumentField(Match))
+    matches_version = IntField()
+    content_hash = StringField()
 
     meta = {
-        "indexes": ["date", "title", "promotion"],
+        # Indexes are built without the _cls prefix so the raw queries in bulk_upsert and weekly can use them too
+        "indexes": [
+            {"fields": ["-date"], "cls": False},
+            # Upsert key, and a show by name
+            {"fields": ["title", "date"], "cls": False},
+            # A promotion's shows in a date range, or its latest shows
+            {"fields": ["promotion", "-date"], "cls": False},
+            # Multikey indexes over the match records
+            {"fields": ["matches.participants"], "cls": False},
+            {"fields": ["matches.title_change"], "cls": False},
+        ],
         "ordering": ["-date"],
         "allow_inheritance": True
     }
 
+class ScrapeLedger(Document):
+    promotion = StringField(required=True)
+    date = StringField(required=True, unique_with=['promotion'])
+    fetched_at = DateTimeField()
+    has_events = BooleanField()
+    content_hash = StringField()
+
+    meta = {
+        "indexes": ["date"]
+    }
+
+class PromotionActivity(Document):
+    promotion = StringField(required=True, unique=True)
+    name = StringField()
+    last_show = DateTimeField()
+    shows_per_week = FloatField()
+    weekdays = ListField(IntField())
+    last_full_scan = DateTimeField()
+    updated_at = DateTimeField()
+
+class BackfillRun(Document):
+    start = StringField(required=True)
+    end = StringField(required=True, unique_with=['start'])
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+    pages_total = IntField()
+    pages_done = IntField()
+
+class ScrapeJob(Document):
+    promotion = StringField(required=True)
+    date = StringField(required=True, unique_with=['promotion'])
+    status = StringField(default="pending", choices=["pending", "leased", "done"])
+    lease_owner = StringField()
+    lease_expires = DateTimeField()
+    attempts = IntField(default=0)
+    queued_at = DateTimeField()
+    finished_at = DateTimeField()
+
+    meta = {
+        "indexes": [("status", "lease_expires")]
+    }
+
+class Notifications(Document):
+    message = StringField(required=True)
+    run = StringField()
+    status = StringField(default="pending", choices=["pending", "sending", "sent", "failed"])
+    owner = StringField()
+    lease_until = DateTimeField()
+    parts_sent = IntField(default=0)
+    attempts = IntField(default=0)
+    created_at = DateTimeField()
+    next_attempt = DateTimeField()
+    sent_at = DateTimeField()
+    error = StringField()
+
+    meta = {
+        "indexes": [("status", "next_attempt"), ("status", "lease_until")]
+    }
+
+class RunReports(Document):
+    job = StringField(required=True)
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+    duration = FloatField()
+    succeeded = BooleanField()
+    report = DictField()
+
+    meta = {
+        "indexes": ["job", "-started_at"],
+        "ordering": ["-started_at"]
+    }
+
+class HostLimits(Document):
+    host = StringField(required=True, unique=True)
+    rate = FloatField()
+    paused_until = DateTimeField()
+    open_until = DateTimeField()
+    updated_at = DateTimeField()
+
 class Schedule(DynamicDocument):
     date = DateTimeField(unique_with=['promotion', 'time'])
     promotion = StringField()
@@ -49,12 +152,30 @@ class Schedule(DynamicDocument):
     link = StringField()
     location = StringField()
     venue = StringField()
+    content_hash = StringField()
 
     meta = {
         "allow_inheritance": True
         
     }
 
+class WeeklySummary(Document):
+    year = IntField(required=True)
+    week = IntField(required=True)
+    promotion = StringField(required=True, unique_with=['year', 'week'])
+    week_start = DateTimeField()
+    week_end = DateTimeField()
+    shows = IntField(default=0)
+    scheduled = IntField(default=0)
+    title_changes = IntField(default=0)
+    results = ListField(DictField())
+    schedule = ListField(DictField())
+    updated_at = DateTimeField()
+
+    meta = {
+        "indexes": [("year", "week")]
+    }
+
 class Users(Document):
     email = StringField(required=True, unique=True)
     receives_newsletter = BooleanField()
@@ -68,4 +189,13 @@ class Users(Document):
 class Replacements(Document):
     category = StringField()
     original = StringField(unique_with=['category'])
-    replacement = StringField()
\ No newline at end of file
+    replacement = StringField()
+    # Set on every save so the cleaners notice edited rules. Rules written outside mongoengine should set it too
+    updated_at = DateTimeField()
+
+    meta = {
+        "indexes": ["updated_at"]
+    }
+
+    def clean(self):
+        self.updated_at = datetime.utcnow()
\ No newline at end of file
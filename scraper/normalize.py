@@ -0,0 +1,181 @@
+"""
+Text normalisation rules for the cleaners, loaded from the Replacements collection
+
+Rules are compiled once per category into a dict, for whole value lookups, and a single combined regex, for
+replacing every matching substring in one pass. The compiled rules are cached and only rebuilt when the
+collection changes, so new rules can be added to the database without code changes
+"""
+# External Imports
+import re
+import time
+import logging
+import threading
+
+# Internal Imports
+from models import Replacements
+
+logger = logging.getLogger(__name__)
+
+# Rules the cleaners have always applied, used alongside the database rules
+# A Replacements document with the same category and original overrides the default
+DEFAULT_RULES = {
+    # Replaced anywhere in a cagematch show header, before it's split into title and location
+    "title_header": {
+        "- Event @": "@",
+        "- TV-Show @": "@",
+    },
+    # Replaced anywhere in a cleaned show title
+    "title": {
+        "- Tag ": "- Day ",
+        "Runde ": "Round ",
+    },
+    # Replaced anywhere in a match result
+    "result": {
+        "TITLE CHANGE !!!": "<b>TITLE CHANGE</b>",
+    },
+    # Whole puwota promotion names
+    "schedule_promotion": {
+        "Tokyo Womans": "Tokyo Joshi Pro",
+        "2AW(KDOJO)": "2AW",
+        "Michinoku": "Michinoku Pro",
+        "New Japan": "New Japan Pro Wrestling",
+        "Ryukyu": "Ryukyu Dragon Pro Wrestling",
+        "Shinshu": "Shinshu Pro Wrestling Federation",
+    },
+    # Whole puwota show locations
+    "schedule_location": {
+        "webcast": "Live Stream",
+    },
+}
+
+# Cached normaliser and the collection fingerprint it was built from
+_cache = {'normalizer': None, 'fingerprint': None, 'checked_at': 0}
+_cache_lock = threading.Lock()
+
+## Classes
+# Normalizer Class
+class Normalizer:
+    """
+    Compiled replacement rules, grouped by category
+
+    Attributes
+    ----------
+    rules : dict
+        Replacement text keyed by original text, for each category
+
+    patterns : dict
+        Combined regex matching any original text, for each category
+
+    Methods
+    -------
+    lookup()
+        Replace a whole value if there's a rule for it
+
+    substitute()
+        Replace every rule match in a string in a single pass
+    """
+    def __init__(self, rules):
+        self.rules = rules
+
+        # Longest originals first, so a rule that contains another shorter rule wins where both match
+        self.patterns = {
+            category: re.compile('|'.join(re.escape(original) for original in sorted(replacements, key=len, reverse=True)))
+            for category, replacements in rules.items() if replacements
+        }
+        logger.info("Compiled %s replacement rules across %s categories", sum(len(r) for r in rules.values()), len(rules))
+
+    def lookup(self, category, value):
+        """
+        Replace a whole value if there's a rule for it
+
+        Parameters
+        ----------
+        category : str
+            Rule category, ie "schedule_promotion"
+        value : str
+            Value to look up
+
+        Returns
+        -------
+        str
+            The replacement, or the value unchanged if there's no rule for it
+        """
+        return self.rules.get(category, {}).get(value, value)
+
+    def substitute(self, category, text):
+        """
+        Replace every rule match in a string in a single pass
+
+        Parameters
+        ----------
+        category : str
+            Rule category, ie "result"
+        text : str
+            Text to replace matches in
+
+        Returns
+        -------
+        str
+            The text with every match replaced
+        """
+        pattern = self.patterns.get(category)
+        if not pattern:
+            return text
+        replacements = self.rules[category]
+        return pattern.sub(lambda match: replacements[match.group(0)], text)
+
+## Functions
+def load_rules():
+    """
+    Merge the default rules with the rules in the Replacements collection
+
+    Returns
+    -------
+    rules : dict
+        Replacement text keyed by original text, for each category
+    """
+    rules = {category: dict(replacements) for category, replacements in DEFAULT_RULES.items()}
+    for rule in Replacements.objects().only('category', 'original', 'replacement'):
+        rules.setdefault(rule.category, {})[rule.original] = rule.replacement or ""
+    return rules
+
+def collection_fingerprint():
+    """
+    Build a cheap fingerprint of the Replacements collection, which changes whenever a rule is added, edited or removed
+
+    Returns
+    -------
+    fingerprint : tuple
+        Number of rules and the newest updated_at, read from the updated_at index
+    """
+    collection = Replacements._get_collection()
+    newest = collection.find_one({'updated_at': {'$ne': None}}, sort=[('updated_at', -1)], projection={'_id': 0, 'updated_at': 1})
+    return (collection.estimated_document_count(), newest['updated_at'] if newest else None)
+
+def get_normalizer(max_age=60):
+    """
+    Get the compiled rules, rebuilding them if the Replacements collection has changed
+
+    Parameters
+    ----------
+    max_age : float
+        Seconds between checks for changes to the collection, so the cleaners can call this freely
+
+    Returns
+    -------
+    normalizer : Normalizer
+        The compiled replacement rules
+    """
+    with _cache_lock:
+        now = time.monotonic()
+        if _cache['normalizer'] and now - _cache['checked_at'] < max_age:
+            return _cache['normalizer']
+
+        fingerprint = collection_fingerprint()
+        if not _cache['normalizer'] or fingerprint != _cache['fingerprint']:
+            logger.info("Loading replacement rules")
+            _cache['normalizer'] = Normalizer(load_rules())
+            _cache['fingerprint'] = fingerprint
+
+        _cache['checked_at'] = now
+        return _cache['normalizer']
@@ -1,10 +1,33 @@
 # External Imports
+import os
+import time
+import uuid
 import logging
+import threading
 import http.client
-import os
 import urllib
+from datetime import datetime, timedelta
+
+# Internal Imports
+from models import Notifications
+
+logger = logging.getLogger(__name__)
 
 ## Classes
+# PushoverError Class
+class PushoverError(Exception):
+    """
+    Raised when Pushover rejects or fails to deliver a message
+
+    Attributes
+    ----------
+    retry : bool
+        Whether sending the message again later may succeed
+    """
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
 # Pushover Class
 class Pushover():
     """
@@ -18,50 +41,320 @@ class Pushover():
     user : str
         Pushover API user
 
+    api_url : str
+        Base url of the Pushover API, can be pointed at a local stand-in with PUSHOVER_URL
+
+    timeout : float
+        Seconds to wait on the API before giving up on a message
+
     Methods
     -------
     push_message()
         Push out a notification to the Pushover client
+
+    close()
+        Close the connection to the API
     """
-    def __init__(self):
-        logging.info("Creating Pushover notifier")
-        
+    # Pushover truncates messages longer than this many characters
+    MAX_MESSAGE_LENGTH = 1024
+
+    def __init__(self, timeout=10):
+        logger.info("Creating Pushover notifier")
+
         # Get Pushover API credentials from env variables
-        logging.info("Grabbing Pushover credentials")
+        logger.info("Grabbing Pushover credentials")
 
         self.token = os.environ["PUSHOVER_TOKEN"]
         self.user = os.environ["PUSHOVER_USER"]
 
-        logging.debug(f"Pushover Token: ****{self.token[:4]}")
-        logging.debug(f"Pushover User: ****{self.user[:4]}")
+        logger.debug("Pushover Token: ****%s", self.token[:4])
+        logger.debug("Pushover User: ****%s", self.user[:4])
+
+        logger.info("Finished grabbing Pushover credentials")
+
+        self.api_url = os.environ.get("PUSHOVER_URL", "https://api.pushover.net")
+        self.timeout = timeout
 
-        logging.info("Finished grabbing Pushover credentials")
+        # One connection is kept open and reused for every message
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            url = urllib.parse.urlparse(self.api_url)
+            connection_cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            self._conn = connection_cls(url.netloc, timeout=self.timeout)
+        return self._conn
 
     def push_message(self, message):
         """
         Push out a notification to the Pushover client
-        
+
         Parameters
         ----------
         message : str
             The contents of the message to be pushed, as a string
+
+        Raises
+        ------
+        PushoverError
+            If the message wasn't accepted, with retry set if it may succeed later
         """
-        logging.info("Creating Pushover message")
-
-        # Connect to Pushover API endpoint
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-
-        # Send Pushover message request
-        conn.request("POST", "/1/messages.json",
-                     urllib.parse.urlencode({
-                         "token": self.token,
-                         "user": self.user,
-                         "message": (message)
-                         }),
-                     {"Content-type": "application/x-www-form-urlencoded"})
-
-        logging.debug(f"Pushover message: {message}")
-        
+        logger.debug("Pushover message: %s", message)
+        body = urllib.parse.urlencode({"token": self.token, "user": self.user, "message": message})
+        path = urllib.parse.urlparse(self.api_url).path.rstrip("/") + "/1/messages.json"
+
         # Send the Pushover notification
-        logging.info("Sending Pushover notification")
-        conn.getresponse()
+        logger.info("Sending Pushover notification")
+        try:
+            conn = self._connection()
+            conn.request("POST", path, body, {"Content-type": "application/x-www-form-urlencoded"})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            # The connection may have been dropped while idle, so start a fresh one next time
+            self.close()
+            raise PushoverError(f"Pushover request failed: {e}")
+
+        # Pushover asks for 4xx requests not to be retried, except when rate limited
+        if response.status >= 500 or response.status == 429:
+            raise PushoverError(f"Pushover returned {response.status}")
+        if response.status >= 400:
+            raise PushoverError(f"Pushover rejected the message with {response.status}", retry=False)
+
+    def close(self):
+        """
+        Close the connection to the API
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# Outbox Class
+class Outbox():
+    """
+    Notifications queued in the database and delivered by a background thread, so the scrapers never wait on Pushover
+
+    Messages queued close together are combined into digests up to Pushover's message size limit. Failed sends are
+    retried with exponential backoff, and messages left over by an earlier run are delivered on the next one. Any
+    number of processes can share the outbox, each message is claimed by one of them before it is sent
+
+    Attributes
+    ----------
+    client : Pushover
+        Client used to deliver the digests
+
+    run : str
+        Id of this run, messages are only combined with others from the same run
+
+    linger : float
+        Seconds to wait after a message is queued for others to combine with it
+
+    max_attempts : int
+        Messages are marked failed after this many unsuccessful sends
+
+    owner : str
+        Id of this outbox, recorded on the messages it has claimed
+
+    Methods
+    -------
+    push_message()
+        Queue a notification for delivery
+
+    close()
+        Deliver everything queued, then stop the sender
+    """
+    BACKOFF_SECONDS = 5
+    SEPARATOR = "\n\n"
+
+    # How long a process holds the messages it has claimed before other processes may send them
+    LEASE_SECONDS = 5 * 60
+
+    def __init__(self, client, run=None, linger=2, max_attempts=5):
+        self.client = client
+        self.run = run or uuid.uuid4().hex
+        self.owner = uuid.uuid4().hex
+        self.linger = linger
+        self.max_attempts = max_attempts
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sender = threading.Thread(target=self._send_loop, name="notification-sender", daemon=True)
+        self._sender.start()
+
+    def push_message(self, message):
+        """
+        Queue a notification for delivery, returning straight away
+
+        Parameters
+        ----------
+        message : str
+            The contents of the message to be pushed, as a string
+        """
+        now = datetime.utcnow()
+        Notifications(message=message, run=self.run, created_at=now, next_attempt=now).save()
+        logger.debug("Queued notification: %s", message)
+        self._wake.set()
+
+    def close(self, timeout=60):
+        """
+        Deliver everything queued, then stop the sender
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for delivery before giving up, anything undelivered is sent on the next run
+        """
+        self._stop.set()
+        self._wake.set()
+        self._sender.join(timeout)
+        self.client.close()
+
+    def _send_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(60)
+            self._wake.clear()
+
+            # Give messages queued together a moment to arrive so they go out as one digest
+            if not self._stop.wait(self.linger):
+                self._deliver()
+
+        # Final delivery on close, retrying until everything is sent or the backoff would outlast the close timeout
+        while self._deliver() and self._pending_due_within(self.BACKOFF_SECONDS * 2):
+            time.sleep(self.BACKOFF_SECONDS)
+
+    def _pending_due_within(self, seconds):
+        return Notifications.objects(status="pending", next_attempt__lte=datetime.utcnow() + timedelta(seconds=seconds)).count() > 0
+
+    def _deliver(self):
+        """
+        Claim every due message, then send them grouped into digests by run
+
+        Returns
+        -------
+        bool
+            True if any message is still pending afterwards
+        """
+        runs = {}
+        for notification in self._claim():
+            runs.setdefault(notification.run, []).append(notification)
+
+        for notifications in runs.values():
+            self._deliver_run(notifications)
+
+        return Notifications.objects(status="pending").count() > 0
+
+    def _claim(self):
+        """
+        Claim the due messages one at a time, so each is only sent by one of the processes sharing the outbox
+
+        Messages still claimed by a process that stopped before finishing with them are handed back first
+
+        Returns
+        -------
+        claimed : list
+            Claimed Notifications documents, in the order they were queued
+        """
+        now = datetime.utcnow()
+        reclaimed = Notifications.objects(status="sending", lease_until__lt=now).update(set__status="pending", unset__owner=True, unset__lease_until=True)
+        if reclaimed:
+            logger.warning("Reclaimed %s notifications left unsent by another process", reclaimed)
+
+        claimed = []
+        lease_until = now + timedelta(seconds=self.LEASE_SECONDS)
+        while True:
+            notification = Notifications.objects(status="pending", next_attempt__lte=now).order_by("created_at").modify(
+                set__status="sending", set__owner=self.owner, set__lease_until=lease_until, new=True)
+            if notification is None:
+                return claimed
+            claimed.append(notification)
+
+    def _deliver_run(self, notifications):
+        digests = self.digests(notifications, self.client.MAX_MESSAGE_LENGTH)
+
+        # Parts of each message that have gone out, so a retry carries on after them rather than repeating them
+        parts_sent = {notification.id: notification.parts_sent for notification in notifications}
+        error = None
+        for text, members in digests:
+            try:
+                self.client.push_message(text)
+            except PushoverError as e:
+                # Stop at the first failure so the digests go out in order on the retry
+                logger.warning("Notification delivery failed: %s", e)
+                error = e
+                break
+            for notification, part in members:
+                parts_sent[notification.id] = part + 1
+
+        now = datetime.utcnow()
+        unsent = 0
+        for notification in notifications:
+            # Updates are conditional on still holding the claim, in case the lease ran out and another process took it
+            claim = Notifications.objects(id=notification.id, owner=self.owner, status="sending")
+            if parts_sent[notification.id] >= len(self._split(notification.message, self.client.MAX_MESSAGE_LENGTH)):
+                claim.update(set__status="sent", set__sent_at=now, set__parts_sent=parts_sent[notification.id], unset__owner=True, unset__lease_until=True)
+                continue
+
+            unsent += 1
+            attempts = notification.attempts + 1
+            if not error.retry or attempts >= self.max_attempts:
+                logger.error("Giving up on notification after %s attempts: %s", attempts, notification.message)
+                claim.update(set__status="failed", set__attempts=attempts, set__parts_sent=parts_sent[notification.id], set__error=str(error), unset__owner=True, unset__lease_until=True)
+            else:
+                backoff = timedelta(seconds=self.BACKOFF_SECONDS * 2 ** (attempts - 1))
+                claim.update(set__status="pending", set__attempts=attempts, set__parts_sent=parts_sent[notification.id], set__next_attempt=now + backoff,
+                             set__error=str(error), unset__owner=True, unset__lease_until=True)
+
+        logger.info("Delivered %s notifications in %s digests, %s left to retry", len(notifications) - unsent, len(digests), unsent)
+
+    @classmethod
+    def digests(cls, notifications, limit):
+        """
+        Combine messages into digests no longer than the limit, splitting any message that is too long by itself
+
+        Parameters
+        ----------
+        notifications : list
+            Queued Notifications documents, in the order they were queued
+        limit : int
+            Maximum length of a digest
+
+        Returns
+        -------
+        digests : list
+            Text of each digest, with the notification and index of each part it contains. Parts already sent by an
+            earlier attempt are left out
+        """
+        digests = []
+        text, members = "", []
+        for notification in notifications:
+            parts = cls._split(notification.message, limit)
+            for index in range(notification.parts_sent or 0, len(parts)):
+                part = parts[index]
+                if text and len(text) + len(cls.SEPARATOR) + len(part) > limit:
+                    digests.append((text, members))
+                    text, members = "", []
+                text = text + cls.SEPARATOR + part if text else part
+                members.append((notification, index))
+        if text:
+            digests.append((text, members))
+        return digests
+
+    @staticmethod
+    def _split(message, limit):
+        # Split on line breaks where possible, only cutting through a line that is longer than the limit itself
+        parts, part = [], ""
+        for line in message.split("\n"):
+            while len(line) > limit:
+                if part:
+                    parts.append(part)
+                    part = ""
+                parts.append(line[:limit])
+                line = line[limit:]
+            if part and len(part) + 1 + len(line) > limit:
+                parts.append(part)
+                part = line
+            else:
+                part = part + "\n" + line if part else line
+        if part:
+            parts.append(part)
+        return parts
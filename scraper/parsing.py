@@ -0,0 +1,90 @@
+"""
+Targeted HTML parsing for the scrapers
+
+Rather than building a tree of the whole page, each function only builds the parts of the page the scraper reads,
+using a SoupStrainer. The returned elements are the same as searching the full tree, so extraction is unchanged
+https://www.crummy.com/software/BeautifulSoup/bs4/doc/#parsing-only-part-of-a-document
+"""
+# External Imports
+import os
+import re
+import logging
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Parser backends used for each site, overridable through the environment
+# Cagematch pages have always been parsed with lxml, puwota with the pure-Python html.parser
+CAGEMATCH_PARSER = os.environ.get("CAGEMATCH_PARSER", "lxml")
+PUWOTA_PARSER = os.environ.get("PUWOTA_PARSER", "html.parser")
+
+# Only the tables of contents are read from cagematch pages
+TABLE_CONTENTS = SoupStrainer('div', {'class': 'TableContents'})
+
+# Puwota's schedule is found from a <script> holding the date, then the <ul> of shows following it
+SCHEDULE_ELEMENTS = SoupStrainer(['script', 'ul'])
+SCHEDULE_DAY = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+logger = logging.getLogger(__name__)
+
+## Functions
+def cagematch_table(html):
+    """
+    Find the TableContents div of a cagematch page
+
+    Parameters
+    ----------
+    html : str
+        Text of the cagematch page
+
+    Returns
+    -------
+    table : Tag or None
+        The first TableContents div, None if the page doesn't have one
+    """
+    return BeautifulSoup(html, CAGEMATCH_PARSER, parse_only=TABLE_CONTENTS).find('div', {'class': 'TableContents'})
+
+def puwota_schedule(html, day):
+    """
+    Find the show elements for a day on the puwota schedule page
+
+    Parameters
+    ----------
+    html : str
+        Text of the puwota page
+    day : str
+        Date of the schedule to find, in the format %Y-%m-%d
+
+    Returns
+    -------
+    shows : list
+        The color01 (puro) and color02 (joshi) divs for the day's shows
+    """
+    soup = BeautifulSoup(html, PUWOTA_PARSER, parse_only=SCHEDULE_ELEMENTS)
+    script = soup.find('script', string=re.compile(day))
+    if not script:
+        logger.warning("No schedule found for %s", day)
+        return []
+    return script.find_next("ul").find_all("div", ["color01", "color02"])
+
+def puwota_schedule_days(html):
+    """
+    Find the show elements for every day on the puwota schedule page, from a single parse
+
+    Parameters
+    ----------
+    html : str
+        Text of the puwota page
+
+    Returns
+    -------
+    days : dict
+        The color01 (puro) and color02 (joshi) divs for each day's shows, keyed by date in the format %Y-%m-%d,
+        in the order the days appear on the page
+    """
+    soup = BeautifulSoup(html, PUWOTA_PARSER, parse_only=SCHEDULE_ELEMENTS)
+    days = {}
+    for script in soup.find_all('script', string=SCHEDULE_DAY):
+        day = SCHEDULE_DAY.search(script.string).group(0)
+        shows = script.find_next("ul")
+        days[day] = shows.find_all("div", ["color01", "color02"]) if shows else []
+    logger.debug("Schedule days found: %s", list(days))
+    return days
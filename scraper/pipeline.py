@@ -0,0 +1,228 @@
+"""
+A streaming pipeline of stages connected by bounded queues
+
+Each stage runs on its own thread, so fetching, parsing, cleaning and writing all overlap. The queues between
+stages are bounded, so a slow stage holds back the stages before it rather than letting work pile up in memory
+"""
+# External Imports
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+## Classes
+# Stage Class
+class Stage:
+    """
+    A step in the pipeline
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage, used in logs and thread names
+
+    func : function
+        Called with one item, or a list of items for batched stages, returning an iterable of outputs or None
+
+    workers : int
+        Number of items processed at once. Outputs always leave the stage in input order
+
+    batch_size : int or None
+        If set, func is called with lists of up to this many items, gathered from whatever is waiting on the queue
+    """
+    def __init__(self, name, func, workers=1, batch_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+
+# Pipeline Class
+class Pipeline:
+    """
+    A streaming pipeline of stages connected by bounded queues
+
+    Attributes
+    ----------
+    source : iterable
+        Items fed into the first stage, consumed lazily
+
+    stages : list
+        Stages in the order items pass through them
+
+    queue_size : int
+        Maximum number of items waiting between two stages
+
+    Methods
+    -------
+    add_stage()
+        Add a stage to the end of the pipeline
+
+    run()
+        Run items through every stage, returning the outputs of the last one
+    """
+    def __init__(self, source, queue_size=16):
+        self.source = source
+        self.stages = []
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors = []
+
+    def add_stage(self, name, func, workers=1, batch_size=None):
+        """
+        Add a stage to the end of the pipeline
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        func : function
+            Called with one item, or a list of items for batched stages, returning an iterable of outputs or None
+        workers : int
+            Number of items processed at once, for stages that mostly wait on I/O
+        batch_size : int, optional
+            Call func with lists of up to this many waiting items
+
+        Returns
+        -------
+        self : Pipeline
+            The pipeline, so calls can be chained
+        """
+        self.stages.append(Stage(name, func, workers, batch_size))
+        return self
+
+    def _put(self, q, item):
+        # Time out regularly so a failure elsewhere can't leave this thread blocked on a full queue
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _emit(self, outputs, q_out):
+        for output in outputs or []:
+            self._put(q_out, output)
+
+    def _feed(self, q_out):
+        try:
+            for item in self.source:
+                if self._stop.is_set():
+                    break
+                self._put(q_out, item)
+        except Exception as e:
+            self._fail("source", e)
+        finally:
+            self._put(q_out, _DONE)
+
+    def _fail(self, name, error):
+        logger.exception("Pipeline stage %s failed", name)
+        self._errors.append(error)
+        self._stop.set()
+
+    def _run_stage(self, stage, q_in, q_out):
+        try:
+            if stage.batch_size:
+                self._run_batched(stage, q_in, q_out)
+            elif stage.workers > 1:
+                self._run_concurrent(stage, q_in, q_out)
+            else:
+                while True:
+                    item = self._get(q_in)
+                    if item is _DONE:
+                        break
+                    self._emit(stage.func(item), q_out)
+        except Exception as e:
+            self._fail(stage.name, e)
+        finally:
+            self._put(q_out, _DONE)
+
+    def _run_concurrent(self, stage, q_in, q_out):
+        # Keep up to `workers` items in flight, emitting results in the order the items arrived
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=stage.name) as pool:
+            try:
+                while True:
+                    item = self._get(q_in)
+                    if item is _DONE:
+                        break
+                    in_flight.append(pool.submit(stage.func, item))
+                    if len(in_flight) >= stage.workers:
+                        self._emit(in_flight.popleft().result(), q_out)
+                while in_flight and not self._stop.is_set():
+                    self._emit(in_flight.popleft().result(), q_out)
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _run_batched(self, stage, q_in, q_out):
+        done = False
+        while not done:
+            item = self._get(q_in)
+            if item is _DONE:
+                break
+
+            # Take whatever else is already waiting, up to the batch size, without waiting for more
+            batch = [item]
+            while len(batch) < stage.batch_size:
+                try:
+                    item = q_in.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+
+            self._emit(stage.func(batch), q_out)
+
+    def run(self):
+        """
+        Run items through every stage, returning the outputs of the last one
+
+        Returns
+        -------
+        outputs : list
+            Everything the last stage produced, in order
+
+        Raises
+        ------
+        Exception
+            The first error raised by any stage, once the pipeline has stopped
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(queues[0],), name="pipeline-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(stage, queues[i], queues[i + 1]), name=f"pipeline-{stage.name}", daemon=True))
+
+        logger.info("Starting pipeline: %s", " -> ".join(stage.name for stage in self.stages))
+        for thread in threads:
+            thread.start()
+
+        # Drain the last queue here, so the final stage is never blocked
+        outputs = []
+        while True:
+            item = self._get(queues[-1])
+            if item is _DONE:
+                break
+            outputs.append(item)
+
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return outputs
@@ -1,11 +1,16 @@
 # External Imports
 import logging
-import requests
 import string
-from bs4 import BeautifulSoup
 
 # Internal Imports
 from models import Promotions
+from transport import Transport
+from bulk import bulk_upsert
+from parsing import cagematch_table
+from logconfig import count
+from metrics import timed
+
+logger = logging.getLogger(__name__)
 
 ## Classes
 # PromotionsScraper Class
@@ -17,19 +22,27 @@ class PromotionsScraper:
     ----------
     promotions_page
         URL of the promotions page on cagematch
+
+    transport : Transport
+        Shared HTTP transport used for fetching pages
     
     Methods
     -------
     update_promotions()
         Update the stored list of japanese promotions, adding new ones to the database
     """
-    def __init__(self):
-        logging.info("Building ResultsScraper object")
+    # The promotions list changes rarely, so a cached copy stays fresh for a day
+    PAGE_TTL = 24 * 60 * 60
+
+    def __init__(self, transport=None):
+        logger.info("Building ResultsScraper object")
+
+        self.transport = transport or Transport()
 
         # Url of the cagematch page listing japanese promotions
-        logging.info("Setting URL of promotions page")
+        logger.info("Setting URL of promotions page")
         self.promotions_page = "https://www.cagematch.net/?id=8&view=promotions&region=&status=aktiv&name=&location=japan"
-        logging.debug(f"Promotions page URL: {self.promotions_page}")
+        logger.debug("Promotions page URL: %s", self.promotions_page)
 
     def update_promotions(self):
         """
@@ -42,24 +55,26 @@ class PromotionsScraper:
 
         Returns
         -------
-        results_list : list
-            List of results found for the promotion in the date range
+        result : dict
+            Inserted, modified and unchanged counts from the bulk upsert
         """
-        logging.info("Updating promotions")
+        logger.info("Updating promotions")
         
-        # Build beautifulsoup object
+        # Parse the table of promotions from the page
         # Each row in the table is a promotion
-        logging.info(f"Scraping promotions page {self.promotions_page}")
-        promotions_data = BeautifulSoup((requests.get(self.promotions_page, headers={'Accept-Encoding': 'identity'})).text, "lxml").find('div', {'class': 'TableContents'}).find_all('tr')
+        logger.info("Scraping promotions page %s", self.promotions_page)
+        with timed("scraper_stage_seconds", scraper="promotions", stage="fetch"):
+            html = self.transport.get(self.promotions_page, ttl=self.PAGE_TTL).text
+        with timed("scraper_stage_seconds", scraper="promotions", stage="parse"):
+            promotions_data = cagematch_table(html).find_all('tr')
         
-        logging.info("Finiding promotions within the data")
+        logger.info("Finiding promotions within the data")
+        promotions = []
 
         # For each row, pull the relevant info about the promotion
         for p in promotions_data:
-            logging.info("Found a promotion, gathering info")
-
             # Create promotion dict
-            logging.debug("Building empty promotion dict")
+            logger.debug("Building empty promotion dict")
             promotion = {}
 
             # The 3rd td tag in each row contains the promotion name
@@ -74,17 +89,20 @@ class PromotionsScraper:
             # Remove spaces and punctuation from the promotion name to make a short name for consistent identification
             promotion['short_name'] = promotion['name'].translate(str.maketrans('', '', string.punctuation))
             promotion['short_name'] = promotion['short_name'].replace(" ", "")
-            logging.info(f"Got info for promotion {promotion['name']}")
-            logging.debug(f"promotion_info: {promotion}")
+            logger.debug("Got info for promotion %s", promotion['name'])
+            logger.debug("promotion_info: %s", promotion)
 
             # Ignore the entry with name "Name", this comes from the table header row
-            if promotion['name'] != "Name":               
-                logging.info(f"Updating database entry for {promotion['name']}")
+            if promotion['name'] != "Name":
+                promotions.append(promotion)
+                count('promotions')
 
-                # Update/add the promotion into the DB
-                update = Promotions.objects(cagematch_id=promotion["cagematch_id"]).update(upsert=True, full_result=True, **promotion)
+        # Update/add all the promotions into the DB in one batch
+        logger.info("Updating database entries for %s promotions", len(promotions))
+        with timed("scraper_stage_seconds", scraper="promotions", stage="write"):
+            result = bulk_upsert(Promotions, promotions, ['cagematch_id'])
+        for promotion in result['inserted_docs']:
+            logger.info("Added DB entry for %s", promotion['name'])
+            count('promotions_added')
 
-                if update.modified_count > 0:
-                    logging.info(f"Updated DB entry for {promotion['name']}")
-                else:
-                    logging.info(f"DB entry exists for {promotion['name']}")
\ No newline at end of file
+        return result
@@ -0,0 +1,353 @@
+"""
+Adaptive per-host rate limiting and circuit breaking for the HTTP transport
+
+Each host gets a token bucket whose rate creeps up while responses are quick and successful, and is cut whenever
+the host signals it's overloaded with a 429 or 503, a Retry-After header or slow responses. Repeated failures open
+a circuit breaker that stops requests to the host for a cooldown, then lets a single trial request through to see
+whether it has recovered. Optionally the learned rate and any pauses are shared through the database, so worker
+processes sharing a host back off together
+"""
+# External Imports
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import requests
+
+# Internal Imports
+from models import HostLimits
+from logconfig import count
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# HostUnavailable Class
+class HostUnavailable(requests.exceptions.RequestException):
+    """
+    Raised when a host's circuit breaker is open, or it is still throttling us after every retry
+    """
+
+# HostLimiter Class
+class HostLimiter:
+    """
+    Token bucket and circuit breaker for a single host
+
+    Attributes
+    ----------
+    host : str
+        Host the limits apply to
+
+    rate : float
+        Current requests per second allowed
+
+    paused_until : float
+        Monotonic time before which no requests are made, after the host throttled us
+
+    open_until : float
+        Monotonic time the circuit breaker stays open until, 0 while closed
+
+    failures : int
+        Failures since the last success
+
+    Methods
+    -------
+    acquire()
+        Wait for a token, and for an open circuit to close
+
+    success()
+        Record a successful response and its latency
+
+    throttled()
+        Record a 429/503 from the host, cutting the rate and pausing for any Retry-After
+
+    failure()
+        Record a failed request, opening the circuit after too many in a row
+    """
+    def __init__(self, host, limiter):
+        self.host = host
+        self.limiter = limiter
+        self.rate = limiter.initial_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.open_until = 0.0
+        self.cooldown = limiter.cooldown
+        self.failures = 0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+        # When the shared state was last read and written, and whether there are local changes to push
+        # Rate changes go out on the next regular sync, pauses and circuit changes are pushed straight away
+        self.synced = 0.0
+        self.pushed_at = datetime.min
+        self.dirty = False
+        self.urgent = False
+
+    def acquire(self):
+        """
+        Wait for a token, including while the circuit is open or a trial request is running
+
+        Raises
+        ------
+        HostUnavailable
+            If the circuit will stay open for longer than the limiter's max_wait, or the wait has already run that long
+        """
+        deadline = time.monotonic() + self.limiter.max_wait
+        while True:
+            self.limiter.sync(self)
+            with self.lock:
+                now = time.monotonic()
+
+                # Open circuit, wait for the cooldown to end then allow a single trial request through
+                # Other requests wait on the trial, and go ahead once it closes the circuit or wait again if it fails
+                if self.open_until:
+                    if now < self.open_until:
+                        if self.open_until > deadline:
+                            raise HostUnavailable(f"Circuit open for {self.host} for another {self.open_until - now:.0f}s")
+                        wait = self.open_until - now
+                    elif self.trial_running:
+                        if now >= deadline:
+                            raise HostUnavailable(f"Gave up waiting on a trial request to {self.host}")
+                        wait = self.limiter.trial_poll
+                    else:
+                        self.trial_running = True
+                        logger.info("Circuit half-open for %s, sending a trial request", self.host)
+                        return
+                elif now >= self.paused_until:
+                    self.tokens = min(self.limiter.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+
+            time.sleep(min(wait, self.limiter.sync_interval))
+
+    def success(self, latency):
+        """
+        Record a successful response and its latency, nudging the rate up while the host responds quickly
+
+        Parameters
+        ----------
+        latency : float
+            Seconds the request took
+        """
+        with self.lock:
+            if self.open_until:
+                logger.info("Circuit closed for %s after a successful trial request", self.host)
+                self.open_until = 0.0
+                self.cooldown = self.limiter.cooldown
+                self.trial_running = False
+                self.urgent = True
+            self.failures = 0
+
+            # Slow responses are an early sign the host is struggling, so ease off before it starts refusing us
+            if latency > self.limiter.target_latency * 2:
+                self._set_rate(self.rate * 0.8)
+            elif latency < self.limiter.target_latency:
+                self._set_rate(self.rate + self.limiter.increase)
+
+    def throttled(self, retry_after=None):
+        """
+        Record a 429/503 from the host, cutting the rate and pausing for any Retry-After
+
+        Parameters
+        ----------
+        retry_after : float, optional
+            Seconds the host asked us to wait
+        """
+        with self.lock:
+            self._set_rate(self.rate * 0.5)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.urgent = True
+        logger.warning("Throttled by %s, rate now %.2f/s, pausing %.1fs", self.host, self.rate, pause)
+        count('throttled')
+        self.failure(throttle=True)
+
+    def failure(self, throttle=False):
+        """
+        Record a failed request, opening the circuit after too many in a row
+
+        Parameters
+        ----------
+        throttle : bool
+            True when the failure was a throttling response, which has already cut the rate
+        """
+        with self.lock:
+            self.failures += 1
+            if not throttle:
+                self._set_rate(self.rate * 0.8)
+
+            # A failed trial request re-opens the circuit for twice as long
+            if self.trial_running or self.failures >= self.limiter.failure_threshold:
+                if self.trial_running:
+                    self.cooldown = min(self.cooldown * 2, self.limiter.max_cooldown)
+                self.trial_running = False
+                self.open_until = time.monotonic() + self.cooldown
+                self.urgent = True
+                logger.error("Circuit open for %s for %ss after %s failures", self.host, self.cooldown, self.failures)
+                count('circuit_opened')
+
+    def _set_rate(self, rate):
+        rate = max(self.limiter.min_rate, min(self.limiter.max_rate, rate))
+        if rate != self.rate:
+            self.rate = rate
+            self.dirty = True
+
+# RateLimiter Class
+class RateLimiter:
+    """
+    Adaptive rate limits and circuit breakers for every host the transport talks to
+
+    Attributes
+    ----------
+    initial_rate : float
+        Requests per second allowed to a host before anything has been learned about it
+
+    max_rate : float
+        Highest rate the limiter will climb to for any host
+
+    min_rate : float
+        Lowest rate the limiter will drop to when a host pushes back
+
+    burst : float
+        Requests that can be made at once after a quiet spell
+
+    target_latency : float
+        Responses quicker than this raise the rate, ones over twice this lower it
+
+    failure_threshold : int
+        Failures in a row before a host's circuit opens
+
+    cooldown : float
+        Seconds a circuit stays open the first time, doubling on each failed trial up to max_cooldown
+
+    shared : bool
+        Share rates, pauses and open circuits with other processes through the HostLimits collection
+
+    max_wait : float
+        Seconds a request will wait for an open circuit to close before HostUnavailable is raised
+
+    Methods
+    -------
+    host()
+        Get the limiter for a host
+
+    sync()
+        Exchange a host's state with other processes
+    """
+    def __init__(self, initial_rate=5, max_rate=None, min_rate=0.2, burst=4, target_latency=2, failure_threshold=5,
+                 cooldown=60, max_cooldown=15 * 60, shared=False, sync_interval=5, max_wait=5 * 60):
+        self.max_rate = max_rate or 50
+        self.initial_rate = min(initial_rate, self.max_rate)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.increase = 0.1
+        self.burst = burst
+        self.target_latency = target_latency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.max_wait = max_wait
+        self.trial_poll = 0.5
+
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def host(self, host):
+        """
+        Get the limiter for a host, creating it the first time the host is seen
+
+        Parameters
+        ----------
+        host : str
+            Host name, as in the url
+
+        Returns
+        -------
+        HostLimiter
+            Limits for the host
+        """
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostLimiter(host, self)
+            return self._hosts[host]
+
+    def sync(self, limits):
+        """
+        Exchange a host's state with other processes, at most once every sync_interval
+
+        The newest rate wins, and the longest pause and open circuit apply to everyone
+
+        Parameters
+        ----------
+        limits : HostLimiter
+            Limits for the host
+        """
+        if not self.shared:
+            return
+        now = time.monotonic()
+        with limits.lock:
+            if not limits.urgent and now - limits.synced < self.sync_interval:
+                return
+            limits.synced = now
+
+            # Monotonic times aren't comparable between processes, so pauses are shared as wall clock times
+            wall = datetime.utcnow()
+            try:
+                collection = HostLimits._get_collection()
+                shared = collection.find_one({'host': limits.host})
+                if shared:
+                    if not limits.dirty and shared.get('updated_at') and shared['updated_at'] > limits.pushed_at:
+                        limits.rate = shared.get('rate', limits.rate)
+                    if shared.get('paused_until'):
+                        limits.paused_until = max(limits.paused_until, now + (shared['paused_until'] - wall).total_seconds())
+                    if shared.get('open_until') and shared['open_until'] > wall and not limits.open_until:
+                        limits.open_until = now + (shared['open_until'] - wall).total_seconds()
+
+                if limits.dirty or limits.urgent or not shared:
+                    collection.update_one({'host': limits.host}, {
+                        '$set': {
+                            'rate': limits.rate,
+                            'updated_at': wall,
+                            'open_until': wall + timedelta(seconds=limits.open_until - now) if limits.open_until else None,
+                        },
+                        '$max': {'paused_until': wall + timedelta(seconds=max(0.0, limits.paused_until - now))},
+                    }, upsert=True)
+                    limits.pushed_at = wall
+                    limits.dirty = False
+                    limits.urgent = False
+            except Exception as e:
+                # The limits still apply within this process if the database can't be reached
+                logger.warning("Couldn't share rate limits for %s: %s", limits.host, e)
+
+## Functions
+def parse_retry_after(value):
+    """
+    Read a Retry-After header, given either as seconds or as an HTTP date
+
+    Parameters
+    ----------
+    value : str or None
+        The header value
+
+    Returns
+    -------
+    float or None
+        Seconds to wait, or None if there was no usable header
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(tz=parsedate_to_datetime(value).tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
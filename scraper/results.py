@@ -1,91 +1,460 @@
 # External Imports
 import logging
-import requests
 import string
-from bs4 import BeautifulSoup
+import threading
+from urllib.parse import urlparse, parse_qs, quote_plus
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 # Internal Imports
 from models import Results, Promotions
+from transport import Transport
+from bulk import bulk_upsert
+from parsing import cagematch_table
+from matches import parse_match, PARSER_VERSION
+from weekly import refresh, results_weeks
+from migrations import convert_saved_dates
+from logconfig import count
+from normalize import get_normalizer
+from pipeline import Pipeline
+from metrics import timed
+
+logger = logging.getLogger(__name__)
 
 ## Classes
 # ResultsScraper Class
 class ResultsScraper:
     """
     A class for the results scraper, with methods for retrieving webscraped data and saving to the database
+
+    Attributes
+    ----------
+    transport : Transport
+        Shared HTTP transport used for fetching pages
+
+    workers : int
+        Number of pages fetched in parallel, 1 keeps the original serial behaviour
+
+    host_concurrency : int
+        Maximum number of requests in flight to any one host
+
+    listing_location : str
+        Location filter for the all-events listing, "japan" by default as for the promotions list. Empty searches
+        every location, which also finds shows Japanese promotions run abroad but takes many more pages per date
     
     Methods
     -------    
     update_events()
         For each promotion in the database, search for new results and add to DB
 
+    scrape_pages()
+        Stream (promotion, date) pages through the fetch, parse, clean and write stages
+
+    update_events_by_date()
+        Search the all-events listing once per date and route each show to its promotion
+
+    get_date_shows()
+        Fetch every page of the all-events listing for a date
+
+    fetch_stage()
+        Pipeline stage downloading a (promotion, date) page
+
+    parse_stage()
+        Pipeline stage pulling the shows out of a downloaded page
+
+    clean_stage()
+        Pipeline stage running the cleaners on a page's shows
+
+    write_stage()
+        Pipeline stage saving a batch of pages' shows to the DB
+
+    store_events()
+        Save a promotion's cleaned shows to the DB
+
     get_events()
         Scrape the results for the promotion, for the dates provided
 
+    find_shows()
+        Find the show blocks in a cagematch results page
+
+    parse_show()
+        Pull the title and match results out of a show block
+
+    show_promotion_id()
+        Find the cagematch id of the promotion that ran a show
+
+    normalise_promotion_id()
+        Reduce a cagematch promotion link to the form stored in Promotions
+
+    build_date_url()
+        Build the cagematch all-events listing url for a date
+
+    build_url()
+        Build the cagematch events url for a promotion and date
+
+    page_ttl()
+        Work out how long a cached results page for the date stays fresh
+
+    fetch_page()
+        Download a single page, respecting the per-host concurrency limit
+
     clean_titles()
         Clean up and standardise the titles of shows found by the scraper
 
     clean_results()
         Clean up and standardise the text of results found by the scraper
     """
-    def __init__(self):
-        logging.info("Building ResultsScraper object")
+    # Cache lifetimes in seconds for results pages, by how many days ago the date was
+    # Results for the last couple of days are still being posted, older dates are settled and rarely change
+    RESULTS_TTL = {0: 15 * 60, 1: 60 * 60, 2: 6 * 60 * 60}
+    SETTLED_TTL = 7 * 24 * 60 * 60
+
+    # Cagematch lists 100 shows per page on the all-events listing
+    LISTING_PAGE_SIZE = 100
+    # A day's shows in Japan fit on one page, this only stops a listing that never comes back short running away
+    MAX_LISTING_PAGES = 5
+
+    # Number of pages saved together by the write stage
+    WRITE_BATCH = 20
+
+    # Fields hashed to spot shows that haven't changed since they were saved, which are then not written again
+    HASH_FIELDS = ['title', 'location', 'promotion', 'results', 'matches']
+
+    def __init__(self, transport=None, workers=1, host_concurrency=4, listing_location="japan"):
+        logger.info("Building ResultsScraper object")
+
+        self.transport = transport or Transport(pool_maxsize=host_concurrency)
+
+        # Fetching is almost entirely network bound, so the fetch stage downloads this many pages in parallel
+        # The per-host semaphores stop us hammering a single site with every worker at once
+        self.workers = max(1, workers)
+        self.host_concurrency = max(1, host_concurrency)
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+        logger.info("Fetch workers: %s, per-host concurrency: %s", self.workers, self.host_concurrency)
+
+        # The all-events listing takes the same location filter as the promotions list
+        self.listing_location = listing_location
 
-    def update_events(self, date_list):
+    def update_events(self, date_list, ledger=None, activity=None):
         """
         For all promotions in the database, search for new results and add to DB
 
+        Each (promotion, date) page streams through fetch, parse, clean and write stages, so pages are saved while
+        later ones are still downloading
+
         Parameters
         ----------
         date_list : list
             List of dates to retrieve results for
+        ledger : Ledger, optional
+            Scrape ledger used to skip (promotion, date) pages that have settled. Every page is fetched when not provided
+        activity : Activity, optional
+            Promotion activity used to scan dormant promotions less often. Every promotion is scanned when not provided
 
         Returns
         -------
-        updated_shows :list
+        updated_shows : str
             Simple list of updated shows for use in notifications
         """
-        logging.info("Updating events")
-        
-        # Build updated_shows list used later for notifications
+        logger.info("Updating events")
+
+        # Get list of promotions from database
+        promotions = list(Promotions.objects())
+        logger.debug("promotions: %s", promotions)
+
+        def due_pages():
+            # Pages are generated as the fetch stage takes them, skipping dates the promotion is unlikely to have run
+            # a show on and dates the ledger says have settled
+            for promotion in promotions:
+                dates = activity.due_dates(promotion.cagematch_id, date_list) if activity else date_list
+                dates = ledger.due_dates(promotion.cagematch_id, dates) if ledger else dates
+                for date in dates:
+                    yield promotion, date
+
+        updated_shows = self.scrape_pages(due_pages(), ledger)
+
+        # Full scans are only recorded once the run has saved its pages, so a failed run sweeps again next time
+        if activity:
+            activity.flush()
+
+        # Create string of updated shows for notifications
+        return '\n'.join(updated_shows)
+
+    def scrape_pages(self, pages, ledger=None, on_written=None, ttl=None):
+        """
+        Stream (promotion, date) pages through the fetch, parse, clean and write stages
+
+        Parameters
+        ----------
+        pages : iterable
+            Promotion object and date for each page, consumed lazily as the fetch stage takes them
+        ledger : Ledger, optional
+            Scrape ledger to record the pages in once saved
+        on_written : function, optional
+            Called with each batch of (promotion, date, shows) once it has been saved
+        ttl : int, optional
+            Seconds a cached copy of each page stays fresh, worked out from each page's date when not given
+
+        Returns
+        -------
+        updated_shows : list
+            Simple list of newly added shows for use in notifications
+        """
+        # Pages leave each stage in the order they went in, so the saved results match the serial path
+        # The bounded queues between stages keep memory flat however many pages there are
+        pipeline = Pipeline(pages, queue_size=self.workers * 2 + self.WRITE_BATCH)
+        pipeline.add_stage("fetch", lambda page: self.fetch_stage(page, ttl), workers=self.workers)
+        pipeline.add_stage("parse", self.parse_stage)
+        pipeline.add_stage("clean", self.clean_stage)
+        pipeline.add_stage("write", lambda batch: self.write_stage(batch, ledger, on_written), batch_size=self.WRITE_BATCH)
+        return pipeline.run()
+
+    def fetch_stage(self, page, ttl=None):
+        """
+        Pipeline stage downloading a (promotion, date) page
+
+        Parameters
+        ----------
+        page : tuple
+            Promotion object and date
+        ttl : int, optional
+            Seconds a cached copy of the page stays fresh, worked out from the date when not given
+
+        Returns
+        -------
+        list
+            The promotion, date and page html
+        """
+        promotion, date = page
+        logger.debug("Grabbing web data to be scraped for %s, %s", promotion.name, date)
+        count('pages')
+        with timed("scraper_stage_seconds", scraper="results", stage="fetch", promotion=promotion.name):
+            html = self.fetch_page(self.build_url(promotion, date), ttl or self.page_ttl(date))
+        return [(promotion, date, html)]
+
+    def parse_stage(self, page):
+        """
+        Pipeline stage pulling the shows out of a downloaded page
+
+        Parameters
+        ----------
+        page : tuple
+            Promotion object, date and page html
+
+        Returns
+        -------
+        list
+            The promotion, date and raw show dicts
+        """
+        promotion, date, html = page
+        with timed("scraper_stage_seconds", scraper="results", stage="parse", promotion=promotion.name):
+            shows = [self.parse_show(show, date) for show in self.find_shows(html)]
+        return [(promotion, date, shows)]
+
+    def clean_stage(self, page):
+        """
+        Pipeline stage running the cleaners on a page's shows and tagging them with the promotion
+
+        Parameters
+        ----------
+        page : tuple
+            Promotion object, date and raw show dicts
+
+        Returns
+        -------
+        list
+            The promotion, date and cleaned show dicts
+        """
+        promotion, date, shows = page
+        if shows:
+            with timed("scraper_stage_seconds", scraper="results", stage="clean", promotion=promotion.name):
+                self.clean_titles(shows)
+                self.clean_results(shows)
+                for show in shows:
+                    show['promotion'] = promotion.name
+        return [page]
+
+    def write_stage(self, pages, ledger=None, on_written=None):
+        """
+        Pipeline stage saving a batch of pages' shows to the DB and recording them in the ledger
+
+        Parameters
+        ----------
+        pages : list
+            Promotion object, date and cleaned show dicts for each page
+        ledger : Ledger, optional
+            Scrape ledger to record the pages in
+        on_written : function, optional
+            Called with the batch once it has been saved
+
+        Returns
+        -------
+        updated_shows : list
+            Simple list of newly added shows for use in notifications
+        """
         updated_shows = []
 
-        logging.debug(Promotions.objects())
+        events = [show for _, _, shows in pages for show in shows]
+        if events:
+            # Upsert the whole batch in one round trip, keyed on the event name and date
+            with timed("scraper_stage_seconds", scraper="results", stage="write"):
+                convert_saved_dates(events)
+                result = bulk_upsert(Results, events, ['title', 'date'], hash_fields=self.HASH_FIELDS)
 
-        # Get list of promotions from database
-        for promotion in Promotions.objects():
-            logging.info(f"Finding Events for {promotion.name}")
+            # Bring the weekly summaries the changed shows fall in up to date
+            with timed("scraper_stage_seconds", scraper="results", stage="materialize"):
+                refresh(results_weeks(result['written_docs']))
+            count('shows_skipped', result['skipped'])
+            for event in result['inserted_docs']:
+                logger.info("Saved %s, %s, %s", event['promotion'], event['title'], event['date'])
+                count('shows_added')
+                updated_shows.append(event['promotion'] + " - " + event['title'])
 
-            logging.debug(f"Creating Promotion object for {promotion['name']}")
-            # For each promotion, build a list of events
-            events = self.get_events(promotion, date_list)
+        # Record each page only once its shows are saved, so a failed run fetches them again
+        if ledger:
+            for promotion, date, shows in pages:
+                ledger.record(promotion.cagematch_id, date, shows)
+            ledger.flush()
 
+        if on_written:
+            on_written(pages)
+
+        return updated_shows
+
+    def update_events_by_date(self, date_list, ledger=None):
+        """
+        Search cagematch's all-events listing once per date and route each show to its promotion, adding new results to DB
+
+        Produces the same Results documents as update_events, with one request per date (plus pagination)
+        instead of one per promotion and date
+
+        Parameters
+        ----------
+        date_list : list
+            List of dates to retrieve results for
+        ledger : Ledger, optional
+            Scrape ledger used to skip dates that have settled for every promotion
+
+        Returns
+        -------
+        updated_shows : str
+            Simple list of updated shows for use in notifications
+        """
+        logger.info("Updating events by date")
+
+        promotions = list(Promotions.objects())
+        promotions_by_id = {self.normalise_promotion_id(promotion.cagematch_id): promotion for promotion in promotions}
+
+        # A date only needs fetching if it's due for at least one promotion
+        if ledger:
+            date_list = [date for date in date_list if any(ledger.is_due(promotion.cagematch_id, date) for promotion in promotions)]
+        logger.info("%s dates due", len(date_list))
+
+        # Listings for each date are independent, so fetch them in parallel in concurrent mode
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                date_shows = list(pool.map(self.get_date_shows, date_list))
+        else:
+            date_shows = [self.get_date_shows(date) for date in date_list]
+
+        # Route every show on the listing to its promotion, ignoring shows by promotions we don't track
+        events_by_promotion = {}
+        for date, shows in zip(date_list, date_shows):
+            for show in shows:
+                promotion = promotions_by_id.get(self.show_promotion_id(show))
+                if promotion:
+                    events_by_promotion.setdefault(promotion.cagematch_id, []).append(self.parse_show(show, date))
+
+        # Clean and save in database order, so the saved results match update_events
+        updated_shows = []
+        for promotion in promotions:
+            events = events_by_promotion.get(promotion.cagematch_id)
             if events:
-                # Continue only if there are any events found for the promotion in the time frame
-                logging.info(f"Found events for {promotion.name}")
-
-                for event in events:
-                    # For each event, add the promotion name to its attributes
-                    event['promotion'] = promotion.name
-
-                    # Check whether the show already exists, based on the event name and date
-                    if not Results.objects(title=event['title'], date=event['date']):
-                        # If it doesn't already exist, save it to the db and add to the list of updated shows
-                        db_show = Results(**event).save()
-                        logging.info(f"Saved document ID {db_show.id} for {event['promotion']}, {event['title']}, {event['date']}")
-                        updated_shows.append(event['promotion'] + " - " + event['title'])
-                    else:
-                        # If show is already in the db, update the details
-                        update = Results.objects(title=event['title'], date=event['date']).update(**event, full_result=True)
-                        if update.modified_count > 0:
-                            logging.info(f"Updated DB entry for {event['promotion']}, {event['title']}, {event['date']}")
-                        else:
-                            logging.info(f"DB entry exists for {event['promotion']}, {event['title']}, {event['date']}")
-            else:
-                logging.info(f"No events found for {promotion.name}")
-            
-        # Create string of updated shows for notifications
-        updated_shows = '\n'.join(updated_shows)
-        
+                logger.debug("Running cleaners on event and result texts")
+                self.clean_titles(events)
+                self.clean_results(events)
+                updated_shows.extend(self.store_events(promotion, events))
+
+            if ledger:
+                for date in date_list:
+                    day = datetime.strptime(date, '%d.%m.%Y')
+                    ledger.record(promotion.cagematch_id, date, [event for event in events or [] if event['date'] == day])
+
+        if ledger:
+            ledger.flush()
+
+        return '\n'.join(updated_shows)
+
+    def get_date_shows(self, date):
+        """
+        Fetch every page of cagematch's all-events listing for a date
+
+        Parameters
+        ----------
+        date : str
+            Date in the format %d.%m.%Y
+
+        Returns
+        -------
+        shows : list
+            QuickResults elements for every show on the date
+        """
+        logger.info("Grabbing all events listed for %s", date)
+        shows = []
+
+        # The listing is paginated, keep going until a page comes back short
+        for page in range(self.MAX_LISTING_PAGES):
+            page_shows = self.find_shows(self.fetch_page(self.build_date_url(date, page * self.LISTING_PAGE_SIZE), self.page_ttl(date)))
+            shows.extend(page_shows)
+            count('pages')
+            if len(page_shows) < self.LISTING_PAGE_SIZE:
+                break
+        else:
+            logger.warning("Stopped after %s listing pages for %s", self.MAX_LISTING_PAGES, date)
+
+        logger.info("Found %s shows listed for %s", len(shows), date)
+        return shows
+
+    def store_events(self, promotion, events):
+        """
+        Save a promotion's cleaned shows to the DB
+
+        Parameters
+        ----------
+        promotion : object
+            Promotion object pulled from DB
+        events : list
+            Cleaned show dicts for the promotion, may be empty or None
+
+        Returns
+        -------
+        updated_shows : list
+            Simple list of newly added shows for use in notifications
+        """
+        updated_shows = []
+
+        if events:
+            # Continue only if there are any events found for the promotion in the time frame
+            logger.info("Found events for %s", promotion.name)
+
+            for event in events:
+                # For each event, add the promotion name to its attributes
+                event['promotion'] = promotion.name
+
+            # Upsert all the promotion's shows in one round trip, keyed on the event name and date
+            # Shows that didn't already exist are added to the list of updated shows
+            convert_saved_dates(events)
+            result = bulk_upsert(Results, events, ['title', 'date'], hash_fields=self.HASH_FIELDS)
+            refresh(results_weeks(result['written_docs']))
+            count('shows_skipped', result['skipped'])
+            for event in result['inserted_docs']:
+                logger.info("Saved %s, %s, %s", event['promotion'], event['title'], event['date'])
+                count('shows_added')
+                updated_shows.append(event['promotion'] + " - " + event['title'])
+        else:
+            logger.debug("No events found for %s", promotion.name)
+
         return updated_shows
 
     def get_events(self, promotion, date_list):
@@ -103,62 +472,225 @@ class ResultsScraper:
         results_list
             List of results found for the promotion in the date range
         """
-        logging.info(f"Getting events for {promotion.name}")
+        logger.debug("Getting events for %s", promotion.name)
         
         # Create results_list to add found shows to
         results_list = []
 
         for date in date_list:
 
-            logging.info(f"Grabbing web data to be scraped for {promotion.name}, {date}")
+            logger.debug("Grabbing web data to be scraped for %s, %s", promotion.name, date)
+            count('pages')
             
-            # Build url based on promotion and date
-            url = f"https://www.cagematch.net/{promotion.cagematch_id}&page=8&name=&vDay={date.split('.')[0]}&vMonth={date.split('.')[1]}&vYear={date.split('.')[2]}&showtype=&location=&arena=&region="
-            logging.debug(f"scrape url: {url}")
+            html = self.fetch_page(self.build_url(promotion, date), self.page_ttl(date))
             
-            logging.info("Looking for events in the data")
-            
-            # Find the table of events for the date (usually one per day but can be multiple)
-            events_table = BeautifulSoup(requests.get(url, headers={'Accept-Encoding': 'identity'}).text, "lxml").find('div', {'class': 'TableContents'})
-            
-            if events_table:
-                logging.info(f"Pulling the shows for {date}")
+            shows = self.find_shows(html)
+
+            if shows:
+                logger.debug("Pulling the shows for %s", date)
 
-                # Find each show in the table for the date
-                shows = events_table.find_all('div', {'class': 'QuickResults'})
-                
                 for show in shows:
-                    logging.info(f"Found a show, gathering info")
-                    show_dict = {}
-                    show_dict['title'] = show.find('div', {'class': 'QuickResultsHeader'}).text.strip()
-                    show_dict['date'] = date
-                    logging.info(f"Found show {show_dict['title']}, {show_dict['date']}")
-
-                    logging.info(f"Finding match results for show {show_dict['title']}")
-                    results = show.find_all('span', {'class': 'MatchResults'})
-                    match_list = []
-                    
-                    for result in results:
-                        logging.info(f"Found matched result {result.text}")
-                        match_list.append(result.text)
-                    
-                    logging.debug(match_list)
-                    show_dict['results'] = match_list
-                    logging.debug(show_dict)
-                    results_list.append(show_dict)
+                    results_list.append(self.parse_show(show, date))
 
             else:
-                logging.info(f"No events found for {promotion.name}, {date}")
+                logger.debug("No events found for %s, %s", promotion.name, date)
         
         if results_list:
 
-            logging.info("Running cleaners on event and result texts")
+            logger.debug("Running cleaners on event and result texts")
             self.clean_titles(results_list)
             self.clean_results(results_list)
-            logging.debug(results_list)
+            logger.debug("results_list: %s", results_list)
 
             return results_list
 
+    def find_shows(self, html):
+        """
+        Find the show blocks in a cagematch results page
+
+        Parameters
+        ----------
+        html : str
+            Text of the results page
+
+        Returns
+        -------
+        shows : list
+            QuickResults elements, one per show, empty if the page has no events table
+        """
+        # Find the table of events for the date (usually one per day but can be multiple)
+        # Only the table is parsed, the rest of the page is skipped
+        events_table = cagematch_table(html)
+
+        if not events_table:
+            return []
+
+        # Find each show in the table for the date
+        return events_table.find_all('div', {'class': 'QuickResults'})
+
+    def parse_show(self, show, date):
+        """
+        Pull the title and match results out of a show block
+
+        Parameters
+        ----------
+        show : Tag
+            QuickResults element for the show
+        date : str
+            Date of the show in the format %d.%m.%Y
+
+        Returns
+        -------
+        show_dict : dict
+            Raw title, date (as a datetime) and list of match results for the show
+        """
+        show_dict = {}
+        show_dict['title'] = show.find('div', {'class': 'QuickResultsHeader'}).text.strip()
+        # Stored as a datetime so Results sort and range query by date, the page date stays a string for building urls
+        show_dict['date'] = datetime.strptime(date, '%d.%m.%Y')
+        logger.debug("Found show %s, %s", show_dict['title'], date)
+
+        # Pull the text of each match result in the show, along with a structured record of the match
+        # The match type label, when there is one, is the span just before the result
+        show_dict['results'] = []
+        show_dict['matches'] = []
+        for result in show.find_all('span', {'class': 'MatchResults'}):
+            label = result.find_previous_sibling('span')
+            match_type = label.text if label and 'MatchType' in label.get('class', []) else None
+            show_dict['results'].append(result.text)
+            show_dict['matches'].append(parse_match(result.text, match_type))
+        show_dict['matches_version'] = PARSER_VERSION
+        logger.debug("show_dict: %s", show_dict)
+
+        count('shows')
+        count('matches', len(show_dict['results']))
+        return show_dict
+
+    def show_promotion_id(self, show):
+        """
+        Find the cagematch id of the promotion that ran a show, from the promotion link in its block
+
+        Parameters
+        ----------
+        show : Tag
+            QuickResults element for the show
+
+        Returns
+        -------
+        cagematch_id : str or None
+            Normalised promotion id, ie "?id=8&nr=7", None if the show has no promotion link
+        """
+        for link in show.find_all('a', href=True):
+            cagematch_id = self.normalise_promotion_id(link['href'])
+            if cagematch_id:
+                return cagematch_id
+        return None
+
+    @staticmethod
+    def normalise_promotion_id(href):
+        """
+        Reduce a cagematch promotion link to the "?id=8&nr=N" form stored in Promotions
+
+        Parameters
+        ----------
+        href : str
+            Link to a cagematch page, in short or full form
+
+        Returns
+        -------
+        cagematch_id : str or None
+            Normalised promotion id, None if the link isn't to a promotion
+        """
+        query = parse_qs(urlparse(href).query)
+        if query.get('id') == ['8'] and query.get('nr'):
+            return f"?id=8&nr={query['nr'][0]}"
+        return None
+
+    def build_date_url(self, date, offset=0):
+        """
+        Build the cagematch all-events listing url for a date, filtered to listing_location
+
+        Parameters
+        ----------
+        date : str
+            Date in the format %d.%m.%Y
+        offset : int
+            Index of the first show on the page, for pagination
+
+        Returns
+        -------
+        url : str
+            URL of the events listing for the date
+        """
+        day, month, year = date.split('.')
+        url = f"https://www.cagematch.net/?id=1&view=results&name=&vDay={day}&vMonth={month}&vYear={year}&showtype=&location={quote_plus(self.listing_location)}&arena=&region=&s={offset}"
+        logger.debug("scrape url: %s", url)
+        return url
+
+    def build_url(self, promotion, date):
+        """
+        Build the cagematch events url for a promotion and date
+
+        Parameters
+        ----------
+        promotion : object
+            Promotion object pulled from DB
+        date : str
+            Date in the format %d.%m.%Y
+
+        Returns
+        -------
+        url : str
+            URL of the promotion's events page for the date
+        """
+        url = f"https://www.cagematch.net/{promotion.cagematch_id}&page=8&name=&vDay={date.split('.')[0]}&vMonth={date.split('.')[1]}&vYear={date.split('.')[2]}&showtype=&location=&arena=&region="
+        logger.debug("scrape url: %s", url)
+        return url
+
+    def page_ttl(self, date):
+        """
+        Work out how long a cached results page for the date stays fresh
+
+        Parameters
+        ----------
+        date : str
+            Date in the format %d.%m.%Y
+
+        Returns
+        -------
+        ttl : int
+            Cache lifetime in seconds
+        """
+        age = (datetime.today().date() - datetime.strptime(date, '%d.%m.%Y').date()).days
+        return self.RESULTS_TTL.get(age, self.SETTLED_TTL if age > 0 else self.RESULTS_TTL[0])
+
+    def fetch_page(self, url, ttl=None):
+        """
+        Download a single page, respecting the per-host concurrency limit
+
+        Parameters
+        ----------
+        url : str
+            URL of the page to download
+        ttl : int, optional
+            Seconds a cached copy of the page stays fresh
+
+        Returns
+        -------
+        html : str
+            Text of the downloaded page
+        """
+        host = urlparse(url).netloc
+
+        # Create the semaphore for the host the first time it's seen
+        with self._host_limits_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.host_concurrency)
+            limit = self._host_limits[host]
+
+        with limit:
+            return self.transport.get(url, ttl=ttl).text
+
     def clean_titles(self, results_list):
         """
         Clean up and standardise the titles of shows found by the scraper
@@ -168,17 +700,17 @@ class ResultsScraper:
         result_list : list
             List of shows and their results, each show is a dict
         """
-        logging.info("Formatting show titles")
+        logger.debug("Formatting show titles")
+        normalizer = get_normalizer()
 
         for show in results_list:
-            logging.info(f"Formatting {show['title']}")
+            raw_title = show['title']
             show['location'] = show['title'].split('@ ')[1]
-            show['title'] = show['title'].replace("- Event @", "@")
-            show['title'] = show['title'].replace("- TV-Show @", "@")
+            # Drop the show type from the header, ie "- Event @", before splitting out the title
+            show['title'] = normalizer.substitute('title_header', show['title'])
             show['title'] = show['title'].split(') ', 1)[1].split('@')[0]
-            show['title'] = show['title'].replace("- Tag ", "- Day ")
-            show['title'] = show['title'].replace("Runde ", "Round ")
-            logging.info(f"Finished formatting {show['title']}")
+            show['title'] = normalizer.substitute('title', show['title'])
+            logger.debug("Formatted title %s as %s", raw_title, show['title'])
 
     def clean_results(self, results_list):
         """
@@ -189,11 +721,9 @@ class ResultsScraper:
         result_list : list
             List of shows and their results, each show is a dict
         """
-        logging.info("Formatting match results")
+        logger.debug("Formatting match results")
+        normalizer = get_normalizer()
         
         for show in results_list:
-            logging.info(f"Formatting match results for {show['title']}")
-            for i in range(len(show['results'])):
-                logging.info(f"Formatting match result {show['results'][i]}")
-                show['results'][i] = show['results'][i].replace("TITLE CHANGE !!!", "<b>TITLE CHANGE</b>")
-                logging.info(f"Finished formatting match result {show['results'][i]}")
\ No newline at end of file
+            logger.debug("Formatting match results for %s", show['title'])
+            show['results'] = [normalizer.substitute('result', result) for result in show['results']]
\ No newline at end of file
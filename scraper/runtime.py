@@ -0,0 +1,101 @@
+"""
+The long-lived resources a job needs, each created the first time it's used
+
+A job that never fetches a page doesn't build the HTTP transport, and nothing connects to the database or sets up
+notifications until a job asks for them, so short jobs and bad command lines start and exit quickly
+"""
+# External Imports
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# Runtime Class
+class Runtime:
+    """
+    Database connection, HTTP transport and notifier shared by the jobs of a process, created on first use
+
+    Attributes
+    ----------
+    args : Namespace
+        Parsed command line arguments
+
+    transport : Transport
+        Shared HTTP transport, with the response cache and rate limiter
+
+    pushover : Outbox
+        Notification outbox
+
+    Methods
+    -------
+    connect()
+        Connect to the database, once
+
+    log_stats()
+        Log and reset the transfer stats, if anything has been fetched
+
+    close()
+        Send any queued notifications and release the resources that were created
+    """
+    def __init__(self, args):
+        self.args = args
+        self._connected = False
+        self._transport = None
+        self._pushover = None
+
+    def connect(self):
+        """
+        Connect to the database, once
+        """
+        if not self._connected:
+            from mongoengine import connect
+
+            # Establish connection to the mongodb cluster
+            # http://docs.mongoengine.org/apireference.html?highlight=connect#mongoengine.connect
+            connect(host=os.environ['DBURL'])
+            self._connected = True
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            from cache import ResponseCache
+            from transport import Transport
+            from ratelimit import RateLimiter
+
+            # Rate limits are shared through the database
+            self.connect()
+            args = self.args
+
+            # Create the HTTP transport shared by all scrapers, so connections are pooled and reused across pages
+            # Pages are cached on disk so unchanged pages are served locally or revalidated rather than downloaded again
+            cache = None if args.no_cache else ResponseCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+            # Request rates adapt to how each host responds, and are shared through the database with any other scraper processes
+            limiter = RateLimiter(initial_rate=args.initial_rate, max_rate=args.max_rate, max_wait=args.max_wait, shared=True)
+            self._transport = Transport(timeout=(10, args.timeout), pool_maxsize=args.host_concurrency, cache=cache, limiter=limiter)
+        return self._transport
+
+    @property
+    def pushover(self):
+        if self._pushover is None:
+            from notifier import Pushover, Outbox
+
+            # Messages are queued in the database and sent in the background, so a slow Pushover API never holds up a scrape
+            self.connect()
+            self._pushover = Outbox(Pushover(timeout=self.args.notify_timeout), linger=self.args.notify_linger)
+        return self._pushover
+
+    def log_stats(self):
+        """
+        Log how much was transferred and how many connections were opened, then reset the stats for the next run
+        """
+        if self._transport is not None:
+            self._transport.log_stats()
+            self._transport.reset_stats()
+
+    def close(self):
+        """
+        Send any queued notifications and release the resources that were created
+        """
+        if self._pushover is not None:
+            self._pushover.close()
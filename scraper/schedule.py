@@ -1,14 +1,19 @@
 # External Imports
-import re
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
-from datetime import date
+from datetime import date, datetime
 
 # Internal Imports
 from models import Schedule
+from transport import Transport
+from bulk import bulk_upsert
+from parsing import puwota_schedule, puwota_schedule_days
+from logconfig import count
+from normalize import get_normalizer
+from pipeline import Pipeline
+from weekly import refresh, schedule_weeks
+from metrics import timed, timed_iter
+
+logger = logging.getLogger(__name__)
 
 
 class ScheduleScraper:
@@ -20,44 +25,159 @@ class ScheduleScraper:
     puwota_url : str
         the current url of the puwota website
 
+    transport : Transport
+        Shared HTTP transport used for fetching pages
+
     today : str
         generated string of today's date in format %Y-%m-%d
 
+    all_days : bool
+        Save the schedule for today and every later day on the page, rather than just today
+
+    parsed_days : list
+        Days found in the last page parsed, in format %Y-%m-%d
+
     Methods
     -------
+    update_schedule()
+        Scrape, clean and save the scheduled shows as a streaming pipeline
+
+    fetch_stage()
+        Pipeline stage downloading the puwota page
+
+    clean_stage()
+        Pipeline stage cleaning a single show
+
+    write_stage()
+        Pipeline stage saving a batch of cleaned shows
+
     get_today_schedule()
         Pull today's scheduled shows from the puwota website
 
+    parse_schedule()
+        Pull the scheduled shows out of the puwota page, one at a time
+
+    parse_show()
+        Pull the details of a single show out of its schedule entry
+
     clean_schedule()
         Clean up and standardise the format of text in the schedule data
 
     update_db()
         Insert the found scheduled shows into the database
+
+    remove_missing()
+        Delete saved shows that are no longer on the page
     """
-    def __init__(self):
-        logging.info("Building schedule scraper")
+    # The schedule is updated through the day, so only reuse a cached copy for re-runs close together
+    PAGE_TTL = 10 * 60
+
+    # Number of shows saved together by the write stage
+    WRITE_BATCH = 50
+
+    # Fields hashed to spot shows that haven't changed since they were saved, which are then not written again
+    HASH_FIELDS = ['time', 'location', 'venue', 'link']
+
+    def __init__(self, transport=None, all_days=False):
+        logger.info("Building schedule scraper")
         
         # URL for the english puwota site
         self.puwota_url = "https://en.puwota.com"
-        logging.debug(f"URL: {self.puwota_url}")
+        logger.debug("URL: %s", self.puwota_url)
 
-        # Set up requests session - puwota is quite strict with rate limiting so set retries accordingly
-        logging.info("Setting requests session parameters")
-        self.session = requests.Session()
-        retry = Retry(connect=3, backoff_factor=0.5)
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
-        self.session.keep_alive = False
+        # Use the shared transport - puwota is quite strict with rate limiting, retries are set up there
+        self.transport = transport or Transport()
 
         # Build a string of today's date for finding the relevant elements
-        logging.info("Setting today's date")
+        logger.info("Setting today's date")
         # Uncomment to set a specific day, eg for testing
         #self.today = "2022-01-22"
         # Otherwise use below to pull today's date
         self.today = date.today().strftime('%Y-%m-%d')
         
-        logging.info(f"Date: {self.today}")
+        logger.info("Date: %s", self.today)
+
+        # The front page holds the next week or so of shows, so one fetch can cover all of them
+        self.all_days = all_days
+        self.parsed_days = []
+
+    def update_schedule(self):
+        """
+        Scrape, clean and save the scheduled shows as a streaming pipeline
+
+        Shows are cleaned and written while the rest of the page is still being parsed. With all_days, saved shows
+        that have since been dropped from the page or moved to another time are removed once the page is saved
+
+        Returns
+        -------
+        show_list
+            List of the cleaned shows that were saved
+        """
+        logger.info("Updating schedule")
+
+        pipeline = Pipeline([self.puwota_url])
+        pipeline.add_stage("fetch", self.fetch_stage)
+        pipeline.add_stage("parse", lambda html: timed_iter(self.parse_schedule(html), "scraper_stage_seconds", scraper="schedule", stage="parse"))
+        pipeline.add_stage("clean", self.clean_stage)
+        pipeline.add_stage("write", self.write_stage, batch_size=self.WRITE_BATCH)
+        show_list = pipeline.run()
+
+        if self.all_days:
+            self.remove_missing(show_list)
+
+        return show_list
+
+    def fetch_stage(self, url):
+        """
+        Pipeline stage downloading the puwota page
+
+        Parameters
+        ----------
+        url : str
+            URL of the page
+
+        Returns
+        -------
+        list
+            The page html
+        """
+        with timed("scraper_stage_seconds", scraper="schedule", stage="fetch"):
+            return [self.transport.get(url, ttl=self.PAGE_TTL).text]
+
+    def clean_stage(self, show):
+        """
+        Pipeline stage cleaning a single show
+
+        Parameters
+        ----------
+        show : dict
+            Show details, as found by the parser
+
+        Returns
+        -------
+        list
+            The cleaned show
+        """
+        with timed("scraper_stage_seconds", scraper="schedule", stage="clean"):
+            return self.clean_schedule([show])
+
+    def write_stage(self, show_list):
+        """
+        Pipeline stage saving a batch of cleaned shows
+
+        Parameters
+        ----------
+        show_list
+            List of shows with formatted and standardised text
+
+        Returns
+        -------
+        show_list
+            The same shows, once saved
+        """
+        with timed("scraper_stage_seconds", scraper="schedule", stage="write"):
+            self.update_db(show_list)
+        return show_list
 
     def get_today_schedule(self):
         """
@@ -68,96 +188,130 @@ class ScheduleScraper:
         show_list
             List of shows found in the web scrape
         """
-        # Build BS object
-        logging.info("Retrieving page data")
-        page = self.session.get(self.puwota_url)
-        soup = BeautifulSoup(page.text, "html.parser")
+        logger.info("Retrieving page data")
+        page = self.transport.get(self.puwota_url, ttl=self.PAGE_TTL)
 
-        # Find today's shedule by locating the <script> with today's date in
-        # Puwota colours the sections according to type of promotion, so find color01 (puro) and color02 (joshi)
-        logging.info("Finding today's schedule")
-        shows = soup.find('script', string=re.compile(self.today)).find_next("ul").find_all("div", ["color01", "color02"])
-        logging.debug(f"Schedule source data: {shows}")
+        return list(self.parse_schedule(page.text))
+
+    def parse_schedule(self, html):
+        """
+        Pull the scheduled shows out of the puwota page, one at a time
 
-        # Build the empty show_list for the dictionaries to be stored in
-        logging.debug("Creating empty show_list")
-        show_list = []
+        Only today's shows are read, unless all_days is set, in which case today's and every later day on the page are
 
-        logging.info("Finding shows in today's schedule")
+        Parameters
+        ----------
+        html : str
+            Text of the puwota page
 
+        Yields
+        ------
+        show_dict
+            Details of each show found in the page
+        """
+        # Find the schedule by locating the <script> with the date in
+        # Puwota colours the sections according to type of promotion, so find color01 (puro) and color02 (joshi)
+        if self.all_days:
+            # Earlier days are still on the page, but puwota has taken their links down so they're left as they were saved
+            logger.info("Finding the schedule for every day on the page")
+            days = {day: shows for day, shows in puwota_schedule_days(html).items() if day >= self.today}
+        else:
+            logger.info("Finding today's schedule")
+            days = {self.today: puwota_schedule(html, self.today)}
+        self.parsed_days = list(days)
+        logger.debug("Schedule source data: %s", days)
+
+        for day, shows in days.items():
+            logger.info("Finding shows in the schedule for %s", day)
+            for show in shows:
+                show_dict = self.parse_show(show, day)
+
+                # Pass the show dictionary on
+                # If the dict doesn't have a "promotion" key, this one was likely picked up due to a parsing error
+                if show_dict.get('promotion'):
+                    yield show_dict
+
+    def parse_show(self, show, day):
+        """
+        Pull the details of a single show out of its schedule entry
+
+        Parameters
+        ----------
+        show : Tag
+            The color0X div for the show
+        day : str
+            Date the show is listed under, in the format %Y-%m-%d
+
+        Returns
+        -------
+        show_dict
+            Details of the show
+        """
         # "show" is the li element found matching the color0X class
         # Example: <li class="cname_a color01">New Japan</li>
-        for show in shows:
-            
-            # Show time, location etc is hyperlinked in the next li element down from "show"
-            # Example: <a href="https://www.njpw.co.jp/schedule" rel="nofollow" target="_blank">18:00 Hokkaido<br/>Makomanai Sekisui Heim Ice Arena</a>
-            show_info = show.find_next("div").find("a")
-            logging.debug(f"show_info: {show_info}")
-
-            # Build a list from the text found in the hyperlink
-            # Time and city are on one line, then venue (if any) on the next
-            show_text = [text for text in show_info.stripped_strings]
-            logging.debug(f"show_text: {show_text}")
-            
-            # Build the dictionary for the show details to be held in
-            show_dict = {}
-
-            # Get the promotion name from the text of "show"
-            # This should always exist at the mimimum, but catch errors to prevent crashes
-            try:
-                show_dict['promotion'] = show.get_text()
-                logging.info(f"Promotion name: {show_dict['promotion']}")
-            except Exception as e:
-                logging.error(e)
-            
-            # Set the link by pulling the href from the "show_info" element
-            # Catch errors in case there is no link (puwota removes links after the date has passed, so this probably depends on timing)
-            try:
-                show_dict['link'] = show_info['href']
-                logging.info(f"Show link: {show_dict['link']}")
-            except Exception as e:
-                logging.warning(f"No link found for {show_dict['promotion']}")
-                logging.error(e)
-
-            # Set the show time by pulling it from the text and catch errors if it doesn't exist
-            try:
-                show_dict['time'] = show_text[0].split()[0]
-                logging.info(f"Show time: {show_dict['time']}")
-            except IndexError as e:
-                logging.warning(f"No time found for {show_dict['promotion']}")
-                logging.error(e)
-
-            # Set the show location/city by pulling it from the text and catch errors if it doesn't exist
-            # If the show is live stream only, that is found here
-            try:
-                show_dict['location'] = show_text[0].split()[1]
-            except IndexError as e:
-                logging.warning(f"No location found for {show_dict['promotion']}")
-                logging.error(e)
-
-            # Set the show venue by pulling it from the text and catch errors if it doesn't exist
-            # Venue often doesn't exist, especially for smaller shows
-            try:
-                show_dict['venue'] = show_text[1]
-            except IndexError as e:
-                logging.warning(f"No venue found for {show_dict['promotion']}")
-                logging.error(e)
-
-            # Set show date as today. This is a string now and set as a datetime when added to the DB
-            show_dict['date'] = self.today
-            
-            logging.info(f"Found show: {show_dict['promotion']}, {show_dict['time']}")
-            logging.debug(f"show_dict: {show_dict}")
-            
-            logging.debug("Adding show to show_list")
-
-            # Add the show dictionary to the list of shows to be returned
-            # If the dict doesn't have a "promotion" key, this one was likely picked up due to a parsing error
-            if show_dict['promotion']:
-                show_list.append(show_dict)
         
-        # Return the list of show dicts
-        return show_list
+        # Show time, location etc is hyperlinked in the next li element down from "show"
+        # Example: <a href="https://www.njpw.co.jp/schedule" rel="nofollow" target="_blank">18:00 Hokkaido<br/>Makomanai Sekisui Heim Ice Arena</a>
+        show_info = show.find_next("div").find("a")
+        logger.debug("show_info: %s", show_info)
+
+        # Build a list from the text found in the hyperlink
+        # Time and city are on one line, then venue (if any) on the next
+        show_text = [text for text in show_info.stripped_strings]
+        logger.debug("show_text: %s", show_text)
+        
+        # Build the dictionary for the show details to be held in
+        show_dict = {}
+
+        # Get the promotion name from the text of "show"
+        # This should always exist at the mimimum, but catch errors to prevent crashes
+        try:
+            show_dict['promotion'] = show.get_text()
+            logger.debug("Promotion name: %s", show_dict['promotion'])
+        except Exception as e:
+            logger.error(e)
+        
+        # Set the link by pulling the href from the "show_info" element
+        # Catch errors in case there is no link (puwota removes links after the date has passed, so this probably depends on timing)
+        try:
+            show_dict['link'] = show_info['href']
+            logger.debug("Show link: %s", show_dict['link'])
+        except Exception as e:
+            logger.warning("No link found for %s", show_dict['promotion'])
+            logger.error(e)
+
+        # Set the show time by pulling it from the text and catch errors if it doesn't exist
+        try:
+            show_dict['time'] = show_text[0].split()[0]
+            logger.debug("Show time: %s", show_dict['time'])
+        except IndexError as e:
+            logger.warning("No time found for %s", show_dict['promotion'])
+            logger.error(e)
+
+        # Set the show location/city by pulling it from the text and catch errors if it doesn't exist
+        # If the show is live stream only, that is found here
+        try:
+            show_dict['location'] = show_text[0].split()[1]
+        except IndexError as e:
+            logger.warning("No location found for %s", show_dict['promotion'])
+            logger.error(e)
+
+        # Set the show venue by pulling it from the text and catch errors if it doesn't exist
+        # Venue often doesn't exist, especially for smaller shows
+        try:
+            show_dict['venue'] = show_text[1]
+        except IndexError as e:
+            logger.warning("No venue found for %s", show_dict['promotion'])
+            logger.error(e)
+
+        # Set show date as the day it's listed under. This is a string now and set as a datetime when added to the DB
+        show_dict['date'] = day
+        
+        logger.debug("Found show: %s, %s", show_dict.get('promotion'), show_dict.get('time'))
+        count('schedule_shows')
+        logger.debug("show_dict: %s", show_dict)
+        
+        return show_dict
 
     def clean_schedule(self, show_list):
         """
@@ -173,44 +327,30 @@ class ScheduleScraper:
         show_list
             List of shows with formatted and standardised text
         """        
-        logging.info("Cleaning up formatting of show text")
-        logging.debug(f"show_list: {show_list}")
+        logger.debug("Cleaning up formatting of show text")
+        logger.debug("show_list: %s", show_list)
+
+        # Replacement rules are loaded from the database, along with the defaults in normalize.py
+        normalizer = get_normalizer()
 
-        # For each show in the list, there are some common replacements due to formatting on puwota that isn't common in english speaking usage
         for show in show_list:
             # For each show in the list, there are some common replacements due to formatting on puwota that isn't common in english speaking usage
-            if show["location"] == "webcast":
-                logging.debug(f"Replacing \"webcast\" with \"Live Stream\" for show {show['promotion']} {show['time']}")
-                show["location"] = "Live Stream"
-
-            if show["promotion"] == "Tokyo Womans":
-                show["promotion"] = "Tokyo Joshi Pro"
-
-            if show["promotion"] == "2AW(KDOJO)":
-                show["promotion"] = "2AW"
-
-            if show["promotion"] == "Michinoku":
-                show["promotion"] = "Michinoku Pro"
+            if "location" in show:
+                show["location"] = normalizer.lookup('schedule_location', show["location"])
 
-            if show["promotion"] == "New Japan":
-                show["promotion"] = "New Japan Pro Wrestling"
-
-            if show["promotion"] == "Ryukyu":
-                show["promotion"] = "Ryukyu Dragon Pro Wrestling"
-
-            if show["promotion"] == "Shinshu":
-                show["promotion"] = "Shinshu Pro Wrestling Federation"
+            if "promotion" in show:
+                show["promotion"] = normalizer.lookup('schedule_promotion', show["promotion"])
 
             # Set title case for the promotion name, unless it is already all caps (ie DDT)
-            logging.debug(f"Setting title case on promotion name for show {show['promotion']} {show['time']}")
+            logger.debug("Setting title case on promotion name for show %s %s", show['promotion'], show['time'])
             if "promotion" in show.keys() and not show['promotion'].isupper():
                 show["promotion"] = show["promotion"].title()
             
             # Title case location and venue, but ignore all caps words, ie Shinjuku FACE
-            logging.debug(f"Setting title case on location name for show {show['promotion']} {show['time']}")
+            logger.debug("Setting title case on location name for show %s %s", show['promotion'], show['time'])
             if "location" in show.keys():
                 show["location"] = ' '.join([word.title() if word.islower() else word for word in show["location"].split()])
-            logging.debug(f"Setting title case on venue name for show {show['promotion']} {show['time']}")
+            logger.debug("Setting title case on venue name for show %s %s", show['promotion'], show['time'])
             if "venue" in show.keys():
                 show["venue"] = ' '.join([word.title() if word.islower() else word for word in show["venue"].split()])
 
@@ -220,7 +360,7 @@ class ScheduleScraper:
                     show["location"] = "Tokyo"
                     show["venue"] = "Ichigaya Chocolate Square"
 
-        logging.debug(f"Cleaned show_list: {show_list}")
+        logger.debug("Cleaned show_list: %s", show_list)
         return show_list
 
     def update_db(self, show_list):
@@ -231,23 +371,65 @@ class ScheduleScraper:
         ----------
         show_list
             List of shows with formatted and standardised text
+
+        Returns
+        -------
+        result : dict
+            Inserted, modified and unchanged counts from the bulk upsert
         """
-        logging.info("Adding shows to database")
+        logger.info("Adding shows to database")
         
-        # For each show in the list, add it to the DB
-        for show in show_list:
-            # If show isn't already in DB, save it
-            # Query has to be based on promotion, date AND time at minimum in case of 2 shows from one promotion in a day
-            if not Schedule.objects(promotion=show['promotion'], date=show['date'], time=show['time']):
-                db_show = Schedule(**show).save()
-                logging.info(f"Saved document ID {db_show.id} for  {show['promotion']}, {show['time']}")
-
-            # If the show is already present in the DB, update it incase the script is being re-run on a specific day
-            # Run an update in case of changes since the last time the scraper ran (or changes were made to the clean_schedule method)
-            else:
-                update = Schedule.objects(promotion=show['promotion'], date=show['date'], time=show['time']).update(**show, full_result=True)
-                if update.modified_count > 0:
-                    logging.info(f"Updated DB entry for {show['promotion']}, {show['time']}")
-                else:
-                    logging.info(f"DB entry exists for {show['promotion']}, {show['time']}")
+        # Upsert every show in one round trip
+        # Key has to be based on promotion, date AND time at minimum in case of 2 shows from one promotion in a day
+        # Existing shows are updated in case the script is being re-run on a specific day, or changes were made to the clean_schedule method
+        result = bulk_upsert(Schedule, show_list, ['promotion', 'date', 'time'], hash_fields=self.HASH_FIELDS)
+        count('schedule_shows_skipped', result['skipped'])
 
+        # Bring the weekly summaries the changed shows fall in up to date
+        refresh(schedule_weeks(result['written_docs']))
+        for show in result['inserted_docs']:
+            logger.info("Saved %s, %s", show['promotion'], show['time'])
+            count('schedule_shows_added')
+
+        return result
+
+    def remove_missing(self, show_list):
+        """
+        Delete saved shows on the days just parsed that are no longer on the page, ie cancelled or moved to another time
+
+        Days the page listed no shows for are left alone, as that's more likely a parsing problem than every show being called off
+
+        Parameters
+        ----------
+        show_list
+            Every show saved from the page
+
+        Returns
+        -------
+        removed : int
+            Number of shows deleted
+        """
+        seen = {}
+        for show in show_list:
+            seen.setdefault(show['date'], []).append({'promotion': show['promotion'], 'time': show.get('time')})
+
+        removed = 0
+        weeks = set()
+        collection = Schedule._get_collection()
+        for day in self.parsed_days:
+            if day not in seen:
+                logger.warning("No shows found for %s, keeping the saved schedule for the day", day)
+                continue
+            missing = {'date': datetime.strptime(day, '%Y-%m-%d'), '$nor': seen[day]}
+            missing_shows = list(collection.find(missing, {'date': 1, 'promotion': 1}))
+            if not missing_shows:
+                continue
+            result = collection.delete_many({'_id': {'$in': [show['_id'] for show in missing_shows]}})
+            logger.info("Removed %s shows no longer listed for %s", result.deleted_count, day)
+            removed += result.deleted_count
+            weeks |= schedule_weeks(missing_shows)
+
+        # The removed shows come out of their weekly summaries too
+        refresh(weeks)
+        count('schedule_shows_removed', removed)
+        return removed
@@ -0,0 +1,184 @@
+"""
+Results pages worth fetching, worked out from the shows in the schedule
+
+The schedule scraper already knows which promotions ran a show today and when it started. Rather than searching
+every promotion, the scheduled results mode fetches only the (promotion, date) pages of scheduled shows that have
+had time to finish and don't have results saved yet, earliest start first. A show stays a target on each run until
+its results are posted or it falls out of the polling window, so results are picked up soon after they go up
+without paying for the pages of promotions that didn't run
+"""
+# External Imports
+import re
+import logging
+from datetime import datetime, time, timedelta, timezone
+
+# Internal Imports
+from models import Results, Schedule, Promotions
+from logconfig import count
+from normalize import get_normalizer
+
+logger = logging.getLogger(__name__)
+
+# Puwota lists start times in Japan time, which has no daylight saving
+JST = timezone(timedelta(hours=9))
+
+# Words that puwota and cagematch use inconsistently in promotion names, ie "DDT" and "DDT Pro-Wrestling"
+GENERIC_WORDS = re.compile(r'\b(?:pro|wrestling)\b')
+NOT_ALPHANUMERIC = re.compile(r'[^a-z0-9]')
+
+## Functions
+def name_key(name):
+    """
+    Reduce a promotion name to a key that matches between puwota and cagematch
+
+    Parameters
+    ----------
+    name : str
+        Promotion name, ie "Pro Wrestling NOAH"
+
+    Returns
+    -------
+    str
+        Lower case name without punctuation, spaces or the generic words, ie "noah"
+    """
+    lowered = name.lower().replace('-', ' ')
+    return NOT_ALPHANUMERIC.sub('', GENERIC_WORDS.sub(' ', lowered)) or NOT_ALPHANUMERIC.sub('', lowered)
+
+def match_promotions(names, promotions):
+    """
+    Match the promotion names from the schedule to Promotions
+
+    A Replacements rule in the "schedule_cagematch" category, from the schedule name to a cagematch id, takes
+    priority, for promotions whose names don't line up. Otherwise names are matched on name_key(), and names that
+    match nothing or more than one promotion are left out
+
+    Parameters
+    ----------
+    names : iterable
+        Promotion names as cleaned by the schedule scraper
+    promotions : iterable
+        Promotion objects pulled from DB
+
+    Returns
+    -------
+    matched : dict
+        Promotion object for each schedule name that could be matched
+    """
+    by_id = {}
+    by_key = {}
+    for promotion in promotions:
+        by_id[promotion.cagematch_id] = promotion
+        by_key.setdefault(name_key(promotion.name), []).append(promotion)
+
+    normalizer = get_normalizer()
+    matched = {}
+    for name in names:
+        override = normalizer.lookup('schedule_cagematch', name)
+        candidates = [by_id[override]] if override in by_id else by_key.get(name_key(name), [])
+        if len(candidates) == 1:
+            matched[name] = candidates[0]
+        else:
+            logger.info("Can't match scheduled promotion %s to cagematch, %s candidates", name, len(candidates))
+            count('scheduled_unmatched')
+    return matched
+
+## Classes
+# ScheduleTargets Class
+class ScheduleTargets:
+    """
+    Scheduled shows still waiting on results, as the results pages to fetch for them
+
+    Attributes
+    ----------
+    poll_days : int
+        Shows from this many days ago are still polled for results, older ones are left to the regular results scan
+
+    start_delay : int
+        Minutes after a show starts before its results page is first fetched
+
+    now : datetime
+        Current time in Japan, without a timezone to compare with the stored dates
+
+    pending : list
+        Start time, promotion object and date of each show still waiting on results, earliest start first
+
+    Methods
+    -------
+    pages()
+        The results pages to fetch, in the format taken by ResultsScraper.scrape_pages()
+    """
+    # Polled pages are fetched every run, so a cached copy is only reused for re-runs straight after
+    PAGE_TTL = 60
+
+    def __init__(self, poll_days=2, start_delay=120):
+        logger.info("Loading scheduled shows")
+
+        self.poll_days = poll_days
+        self.start_delay = start_delay
+        self.now = datetime.now(JST).replace(tzinfo=None)
+        today = datetime.combine(self.now.date(), time.min)
+
+        shows = list(Schedule._get_collection().find({'date': {'$gte': today - timedelta(days=poll_days), '$lte': today}}, {'promotion': 1, 'date': 1, 'time': 1}))
+        promotions = match_promotions({show['promotion'] for show in shows if show.get('promotion')}, Promotions.objects().only('cagematch_id', 'name'))
+
+        # Start times of the shows each promotion ran on each day
+        scheduled = {}
+        for show in shows:
+            promotion = promotions.get(show.get('promotion'))
+            if promotion:
+                scheduled.setdefault((promotion.cagematch_id, show['date']), (promotion, []))[1].append(self.start_time(show))
+
+        # Results already saved for those promotions and days, in one query on the (promotion, date) index
+        posted = {}
+        query = {'promotion': {'$in': list({promotion.name for promotion, _ in scheduled.values()})}, 'date': {'$in': list({day for _, day in scheduled})}}
+        for show in Results._get_collection().find(query, {'promotion': 1, 'date': 1}) if scheduled else ():
+            posted[(show['promotion'], show['date'])] = posted.get((show['promotion'], show['date']), 0) + 1
+
+        self.pending = []
+        for (_, day), (promotion, starts) in scheduled.items():
+            saved = posted.get((promotion.name, day), 0)
+            if saved >= len(starts):
+                count('scheduled_posted')
+                continue
+
+            # With two shows in a day and one posted, it's the later show that's being waited on
+            started = sorted(starts)[saved]
+            if self.now < started + timedelta(minutes=start_delay):
+                count('scheduled_not_finished')
+                continue
+
+            count('scheduled_pending')
+            self.pending.append((started, promotion, day))
+        self.pending.sort(key=lambda target: target[0])
+        logger.info("%s scheduled shows on %s promotion days, %s waiting on results", len(shows), len(scheduled), len(self.pending))
+
+    @staticmethod
+    def start_time(show):
+        """
+        Work out when a scheduled show starts
+
+        Parameters
+        ----------
+        show : dict
+            Schedule document, with a date and time in the format %H:%M
+
+        Returns
+        -------
+        datetime
+            Start time in Japan, the start of the day if the time is missing or unreadable
+        """
+        try:
+            return datetime.combine(show['date'].date(), datetime.strptime(show.get('time') or '', '%H:%M').time())
+        except ValueError:
+            return show['date']
+
+    def pages(self):
+        """
+        The results pages to fetch, one for each promotion and day with a show waiting on results
+
+        Returns
+        -------
+        list
+            Promotion object and date, in the format %d.%m.%Y, earliest start first
+        """
+        return [(promotion, day.strftime('%d.%m.%Y')) for _, promotion, day in self.pending]
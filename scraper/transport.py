@@ -0,0 +1,246 @@
+# External Imports
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+# Internal Imports
+from metrics import inc, observe
+from ratelimit import RateLimiter, HostUnavailable, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# Transport Class
+class Transport:
+    """
+    A shared HTTP transport for the scrapers, with pooled keep-alive connections, compressed transfer and retries
+
+    Attributes
+    ----------
+    session : requests.Session
+        Session used for every request, so connections are reused between pages
+
+    timeout : tuple
+        Connect and read timeouts in seconds, passed to every request
+
+    cache : ResponseCache
+        Optional on-disk response cache, used for requests made with a ttl
+
+    limiter : RateLimiter
+        Adaptive per-host rate limits and circuit breakers. Cache hits don't count towards them
+
+    retries : int
+        Times a request is retried after a throttling response, server error or dropped connection
+
+    stats : dict
+        Per-host counts of requests, bytes over the wire, new connections opened and cache hits
+
+    Methods
+    -------
+    get()
+        Fetch a url through the shared session and record its transfer stats
+
+    total_stats()
+        Sum the recorded stats across all hosts
+
+    reset_stats()
+        Clear the recorded stats
+
+    log_stats()
+        Log the transfer stats for the run
+    """
+    # Responses that mean the host wants us to slow down
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, timeout=(10, 30), pool_maxsize=10, cache=None, max_rate=None, limiter=None, retries=3):
+        logger.info("Building HTTP transport")
+
+        self.timeout = timeout
+        logger.debug("Timeouts (connect, read): %s", self.timeout)
+
+        # Keep the retry policy the schedule scraper used, puwota is quite strict with rate limiting
+        # pool_maxsize is the number of idle keep-alive connections held per host, so should be at least the number of parallel workers
+        logger.info("Setting requests session parameters")
+        self.session = requests.Session()
+        retry = Retry(connect=3, backoff_factor=0.5)
+        self.adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        # Ask for compressed pages, requests decompresses them transparently
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        self.cache = cache
+
+        # Requests to each host are paced by a rate that adapts to how the host responds
+        # max_rate caps how far the rate can climb for any host
+        self.limiter = limiter or RateLimiter(max_rate=max_rate)
+        self.retries = retries
+
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+        # Each connection pool and how many connections it had opened when last checked, by pool key
+        self._pool_connections = {}
+
+    def _record(self, host, **counts):
+        with self._stats_lock:
+            host_stats = self.stats.setdefault(host, {'requests': 0, 'bytes': 0, 'content_bytes': 0, 'connections': 0, 'cache_hits': 0, 'revalidated': 0})
+            for key, value in counts.items():
+                host_stats[key] += value
+
+    def _new_connections(self, url):
+        # urllib3 counts every connection a pool has opened over its life, so only the increase since the last check
+        # is new. requests may keep more than one pool per host, ie with different TLS settings, so every pool for
+        # the host is checked, and a pool the pool manager has replaced starts counting from zero again
+        hostname = urlparse(url).hostname
+        pools = self.adapter.poolmanager.pools
+        new = 0
+        with self._stats_lock:
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None or pool.host != hostname:
+                    continue
+                previous_pool, previous = self._pool_connections.get(key, (None, 0))
+                if previous_pool is not pool:
+                    previous = 0
+                self._pool_connections[key] = (pool, pool.num_connections)
+                new += max(0, pool.num_connections - previous)
+        return new
+
+    def _send(self, url, host, **kwargs):
+        # Make the request through the host's rate limiter, retrying throttling responses, server errors and dropped connections
+        limits = self.limiter.host(host)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            limits.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+
+                # Reading content here means raw.tell() reflects the compressed bytes actually transferred
+                response.content
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                limits.failure()
+                logger.warning("Request to %s failed on attempt %s: %s", url, attempt + 1, e)
+                if last_attempt:
+                    raise
+                continue
+            latency = time.perf_counter() - start
+            observe("scraper_http_request_seconds", latency, host=host)
+
+            if response.status_code in self.THROTTLE_STATUSES:
+                limits.throttled(parse_retry_after(response.headers.get('Retry-After')))
+            elif response.status_code >= 500:
+                limits.failure()
+            else:
+                limits.success(latency)
+                return response
+
+            # Don't hand a throttling or error page to the parsers, it would look like a day with no shows
+            logger.warning("%s returned %s on attempt %s", url, response.status_code, attempt + 1)
+            if last_attempt:
+                raise HostUnavailable(f"{url} still returning {response.status_code} after {self.retries + 1} attempts", response=response)
+
+    def get(self, url, ttl=None, **kwargs):
+        """
+        Fetch a url through the shared session and record its transfer stats
+
+        Parameters
+        ----------
+        url : str
+            URL of the page to fetch
+        ttl : float, optional
+            Seconds a cached copy of the page stays fresh. The cache is only used when this is given
+        **kwargs
+            Extra keyword arguments passed through to requests
+
+        Returns
+        -------
+        response : requests.Response or CachedResponse
+            The response, with its content already read
+        """
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+        use_cache = self.cache is not None and ttl
+
+        # Serve fresh cache entries straight from disk, and revalidate stale ones with a conditional request
+        meta = None
+        if use_cache:
+            meta = self.cache.lookup(url)
+            if meta and self.cache.is_fresh(meta, ttl):
+                cached = self.cache.load(meta)
+                if cached:
+                    logger.debug("Cache hit for %s", url)
+                    self._record(host, cache_hits=1)
+                    inc("scraper_http_requests_total", host=host, source="cache")
+                    return cached
+            if meta:
+                kwargs['headers'] = {**kwargs.get('headers', {}), **self.cache.validators(meta)}
+
+        response = self._send(url, host, **kwargs)
+        content_length = len(response.content)
+        try:
+            wire_bytes = response.raw.tell() or content_length
+        except AttributeError:
+            wire_bytes = content_length
+        inc("scraper_http_requests_total", host=host, source="network", status=response.status_code)
+        inc("scraper_http_bytes_total", wire_bytes, host=host)
+
+        # urllib3 counts the connections each host pool has opened, so compare against it to spot new handshakes
+        self._record(host, requests=1, bytes=wire_bytes, content_bytes=content_length, connections=self._new_connections(url))
+        logger.debug("Fetched %s: %s, %s bytes over the wire, %s bytes decoded", url, response.status_code, wire_bytes, content_length)
+
+        if use_cache:
+            # The page hasn't changed since we cached it, so reset its age and serve it from disk
+            if meta and response.status_code == 304:
+                self.cache.touch(meta)
+                cached = self.cache.load(meta)
+                if cached:
+                    logger.debug("Revalidated cached copy of %s", url)
+                    self._record(host, revalidated=1)
+                    return cached
+                # The body went missing underneath us, fetch the page in full instead
+                return self.get(url, ttl=ttl, **{k: v for k, v in kwargs.items() if k != 'headers'})
+
+            if response.status_code == 200:
+                self.cache.store(url, response)
+
+        return response
+
+    def total_stats(self):
+        """
+        Sum the recorded stats across all hosts
+
+        Returns
+        -------
+        totals : dict
+            Total requests, bytes over the wire, decoded bytes, connections opened and cache hits
+        """
+        totals = {'requests': 0, 'bytes': 0, 'content_bytes': 0, 'connections': 0, 'cache_hits': 0, 'revalidated': 0}
+        with self._stats_lock:
+            for host_stats in self.stats.values():
+                for key in totals:
+                    totals[key] += host_stats[key]
+        return totals
+
+    def reset_stats(self):
+        """
+        Clear the recorded stats, so a long-running process can report each run separately
+        """
+        with self._stats_lock:
+            self.stats = {}
+
+    def log_stats(self):
+        """
+        Log the transfer stats for the run
+        """
+        for host, host_stats in self.stats.items():
+            logger.info("HTTP stats for %s: %s requests, %s connections, %s bytes transferred (%s decoded), %s cache hits, %s revalidated",
+                        host, host_stats['requests'], host_stats['connections'], host_stats['bytes'], host_stats['content_bytes'],
+                        host_stats['cache_hits'], host_stats['revalidated'])
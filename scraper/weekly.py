@@ -0,0 +1,236 @@
+"""
+Weekly per-promotion summaries of Results and Schedule, kept up to date as the scrapers write
+
+Each WeeklySummary holds a promotion's shows, title changes and scheduled shows for an ISO week, so the newsletter
+and the front end read a week with a single indexed query instead of gathering it from Results and Schedule. The
+scrapers pass the documents they have just written to refresh(), which rebuilds only the weeks those documents
+fall in, so a summary is always a straight copy of what is stored and never drifts from it
+"""
+# External Imports
+import time
+import logging
+from datetime import datetime, date, timedelta
+from pymongo import UpdateOne, DeleteOne
+
+# Internal Imports
+from models import Results, Schedule, WeeklySummary
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Formats of the dates the scrapers hand over as strings. Results written before dates were stored as datetimes
+# still hold the cagematch format until they are migrated
+RESULTS_DATE_FORMAT = '%d.%m.%Y'
+SCHEDULE_DATE_FORMAT = '%Y-%m-%d'
+
+# Bookkeeping fields left out of the copies held in a summary
+OMIT_FIELDS = ['_cls', 'content_hash', 'matches_version']
+
+## Functions
+def week_of(day):
+    """
+    Find the ISO year and week a day falls in
+
+    Parameters
+    ----------
+    day : date
+        The day
+
+    Returns
+    -------
+    tuple
+        ISO year and week number
+    """
+    iso = day.isocalendar()
+    return iso[0], iso[1]
+
+def week_start(year, week):
+    """
+    Find the Monday an ISO week starts on
+
+    Parameters
+    ----------
+    year : int
+        ISO year
+    week : int
+        ISO week number
+
+    Returns
+    -------
+    datetime
+        Midnight at the start of the week
+    """
+    return datetime.combine(date.fromisocalendar(year, week, 1), datetime.min.time())
+
+def _weeks(docs, date_format):
+    weeks = set()
+    for doc in docs:
+        day, promotion = doc.get('date'), doc.get('promotion')
+        if not day or not promotion:
+            continue
+        try:
+            day = day if isinstance(day, (date, datetime)) else datetime.strptime(day, date_format)
+        except ValueError:
+            logger.warning("Can't place %s show on %s in a week", promotion, day)
+            continue
+        weeks.add(week_of(day) + (promotion,))
+    return weeks
+
+def results_weeks(docs):
+    """
+    Find the weeks and promotions some Results documents belong to
+
+    Parameters
+    ----------
+    docs : list
+        Results documents or show dicts, with a date and promotion
+
+    Returns
+    -------
+    weeks : set
+        ISO year, week and promotion of each document
+    """
+    weeks = _weeks(docs, RESULTS_DATE_FORMAT)
+
+    # Shows are keyed on title and date, so a show saved under a different promotion than before also has to come
+    # out of the summary it was in. Those are found through the (year, week) index and the copies they hold
+    shows = [{'title': doc.get('title'), 'date': doc.get('date')} for doc in docs if doc.get('title')]
+    collection = WeeklySummary._get_collection()
+    for year, week in {(year, week) for year, week, _ in weeks} if shows else ():
+        promotions = [promotion for summary_year, summary_week, promotion in weeks if (summary_year, summary_week) == (year, week)]
+        query = {'year': year, 'week': week, 'promotion': {'$nin': promotions}, 'results': {'$elemMatch': {'$or': shows}}}
+        weeks |= {(year, week, summary['promotion']) for summary in collection.find(query, {'promotion': 1})}
+    return weeks
+
+def schedule_weeks(docs):
+    """
+    Find the weeks and promotions some Schedule documents belong to
+
+    Parameters
+    ----------
+    docs : list
+        Schedule documents or show dicts, with a date and promotion
+
+    Returns
+    -------
+    weeks : set
+        ISO year, week and promotion of each document
+    """
+    return _weeks(docs, SCHEDULE_DATE_FORMAT)
+
+def build(year, week, promotion):
+    """
+    Build a promotion's summary for a week from the stored Results and Schedule documents
+
+    Parameters
+    ----------
+    year : int
+        ISO year
+    week : int
+        ISO week number
+    promotion : str
+        Promotion name
+
+    Returns
+    -------
+    summary : dict
+        Week bounds, counts of shows, scheduled shows and title changes, and copies of the week's documents
+    """
+    start = week_start(year, week)
+    end = start + timedelta(days=7)
+    projection = dict.fromkeys(OMIT_FIELDS, 0)
+
+    results = list(Results._get_collection().find({'promotion': promotion, 'date': {'$gte': start, '$lt': end}}, projection))
+    results.sort(key=lambda show: (show['date'], show.get('title') or ''))
+    schedule = list(Schedule._get_collection().find({'promotion': promotion, 'date': {'$gte': start, '$lt': end}}, projection))
+    schedule.sort(key=lambda show: (show['date'], show.get('time') or ''))
+
+    return {
+        'week_start': start,
+        'week_end': end - timedelta(days=1),
+        'shows': len(results),
+        'scheduled': len(schedule),
+        'title_changes': sum(1 for show in results for match in show.get('matches') or [] if match.get('title_change')),
+        'results': results,
+        'schedule': schedule,
+        'updated_at': datetime.utcnow(),
+    }
+
+def refresh(weeks):
+    """
+    Rebuild the summaries for some weeks, removing any that no longer have shows
+
+    Parameters
+    ----------
+    weeks : set
+        ISO year, week and promotion of each summary to rebuild
+
+    Returns
+    -------
+    refreshed : int
+        Number of summaries rebuilt
+    """
+    if not weeks:
+        return 0
+    collection = WeeklySummary._get_collection()
+
+    with timed("scraper_db_operation_seconds", collection=collection.name, operation="refresh"):
+        operations = []
+        for year, week, promotion in sorted(weeks):
+            key = {'year': year, 'week': week, 'promotion': promotion}
+            summary = build(year, week, promotion)
+            if summary['shows'] or summary['scheduled']:
+                operations.append(UpdateOne(key, {'$set': summary}, upsert=True))
+            else:
+                operations.append(DeleteOne(key))
+        collection.bulk_write(operations, ordered=False)
+
+    logger.debug("Refreshed weekly summaries: %s", sorted(weeks))
+    return len(operations)
+
+def summaries(year, week):
+    """
+    Read every promotion's summary for a week, ie for the newsletter
+
+    Parameters
+    ----------
+    year : int
+        ISO year
+    week : int
+        ISO week number
+
+    Returns
+    -------
+    QuerySet
+        WeeklySummary documents for the week, by promotion
+    """
+    return WeeklySummary.objects(year=year, week=week).order_by('promotion')
+
+def rebuild(batch_size=500):
+    """
+    Build the summary for every week and promotion in Results and Schedule, ie to fill the collection the first time
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of summaries rebuilt in each round trip
+
+    Returns
+    -------
+    refreshed : int
+        Number of summaries rebuilt
+    """
+    projection = {'_id': 0, 'date': 1, 'promotion': 1}
+    weeks = _weeks(Results._get_collection().find({}, projection), RESULTS_DATE_FORMAT)
+    weeks |= schedule_weeks(Schedule._get_collection().find({}, projection))
+    weeks = sorted(weeks)
+    logger.info("Building %s weekly summaries", len(weeks))
+
+    refreshed = 0
+    started = time.monotonic()
+    for start in range(0, len(weeks), batch_size):
+        refreshed += refresh(set(weeks[start:start + batch_size]))
+        elapsed = time.monotonic() - started
+        logger.info("Built %s/%s weekly summaries, %.0f/s", refreshed, len(weeks), refreshed / elapsed if elapsed else 0)
+
+    return refreshed
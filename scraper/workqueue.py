@@ -0,0 +1,281 @@
+"""
+A work queue of (promotion, date) results pages held in Mongo, so any number of worker processes can share a scrape
+
+Workers claim a page by taking a lease on it, keep the lease alive with heartbeats while the page is in the
+pipeline, and ack it once its shows are saved. A lease that isn't renewed expires, so pages held by a worker
+that died are picked up again by the others. Each process has its own interpreter, so parsing scales across
+cores and containers rather than being held to one by the GIL
+"""
+# External Imports
+import os
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument, UpdateOne
+
+# Internal Imports
+from models import ScrapeJob, Promotions
+from logconfig import count
+
+logger = logging.getLogger(__name__)
+
+## Classes
+# WorkQueue Class
+class WorkQueue:
+    """
+    A lease-based queue of (promotion, date) pages in the ScrapeJob collection
+
+    Attributes
+    ----------
+    owner : str
+        Name of this worker, recorded on the pages it has leased
+
+    lease_seconds : float
+        How long a claimed page is held before other workers may take it, unless renewed
+
+    max_attempts : int
+        Pages claimed this many times without being acked are left in the queue for inspection rather than retried
+
+    Methods
+    -------
+    enqueue()
+        Add pages to the queue, re-queueing any that were already done
+
+    claim()
+        Lease the next available page
+
+    heartbeat()
+        Renew the leases on every page this worker holds
+
+    ack()
+        Mark pages as done once their shows are saved
+
+    release()
+        Hand the pages this worker holds back to the queue
+
+    pending()
+        Count the pages waiting to be claimed
+    """
+    def __init__(self, owner=None, lease_seconds=300, max_attempts=5):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._collection = ScrapeJob._get_collection()
+
+        # Ids of the pages this worker has claimed and not yet acked, renewed by heartbeat()
+        self._held = set()
+        self._held_lock = threading.Lock()
+
+    def enqueue(self, pages):
+        """
+        Add pages to the queue, re-queueing any that were already done
+
+        Parameters
+        ----------
+        pages : iterable
+            Cagematch id of the promotion and date for each page
+
+        Returns
+        -------
+        queued : int
+            Number of pages added or re-queued
+        """
+        now = datetime.utcnow()
+        operations = []
+        for cagematch_id, date in pages:
+            # Pages another worker holds right now are left alone, everything else goes back to pending
+            operations.append(UpdateOne(
+                {'promotion': cagematch_id, 'date': date, 'status': {'$ne': 'leased'}},
+                {'$set': {'status': 'pending', 'attempts': 0, 'queued_at': now}, '$unset': {'lease_owner': '', 'lease_expires': '', 'finished_at': ''}},
+            ))
+            operations.append(UpdateOne(
+                {'promotion': cagematch_id, 'date': date},
+                {'$setOnInsert': {'status': 'pending', 'attempts': 0, 'queued_at': now}},
+                upsert=True,
+            ))
+        if not operations:
+            return 0
+
+        write = self._collection.bulk_write(operations, ordered=True)
+        queued = write.upserted_count + write.modified_count
+        logger.info("Queued %s pages", queued)
+        return queued
+
+    def claim(self):
+        """
+        Lease the next available page, either never claimed or with a lease that has expired
+
+        Returns
+        -------
+        job : dict or None
+            The claimed ScrapeJob document, or None once the queue is empty
+        """
+        now = datetime.utcnow()
+        job = self._collection.find_one_and_update(
+            {
+                '$or': [{'status': 'pending'}, {'status': 'leased', 'lease_expires': {'$lt': now}}],
+                'attempts': {'$lt': self.max_attempts},
+            },
+            {
+                '$set': {'status': 'leased', 'lease_owner': self.owner, 'lease_expires': now + timedelta(seconds=self.lease_seconds)},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('_id', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job:
+            if job['attempts'] > 1:
+                logger.warning("Reclaimed %s, %s after an expired lease, attempt %s", job['promotion'], job['date'], job['attempts'])
+                count('pages_reclaimed')
+            with self._held_lock:
+                self._held.add(job['_id'])
+        return job
+
+    def heartbeat(self):
+        """
+        Renew the leases on every page this worker holds
+        """
+        with self._held_lock:
+            held = list(self._held)
+        if held:
+            expires = datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+            self._collection.update_many({'_id': {'$in': held}, 'lease_owner': self.owner, 'status': 'leased'}, {'$set': {'lease_expires': expires}})
+            logger.debug("Renewed %s leases until %s", len(held), expires)
+
+    def ack(self, job_ids):
+        """
+        Mark pages as done once their shows are saved
+
+        Parameters
+        ----------
+        job_ids : list
+            Ids of the ScrapeJob documents to mark done
+        """
+        if not job_ids:
+            return
+        # Only pages still leased to this worker, so acking twice, or after the lease was lost, changes nothing
+        write = self._collection.update_many(
+            {'_id': {'$in': list(job_ids)}, 'lease_owner': self.owner, 'status': 'leased'},
+            {'$set': {'status': 'done', 'finished_at': datetime.utcnow()}, '$unset': {'lease_expires': ''}},
+        )
+        with self._held_lock:
+            self._held.difference_update(job_ids)
+        count('pages_acked', write.modified_count)
+
+    def release(self):
+        """
+        Hand the pages this worker holds back to the queue, ie when it stops early
+        """
+        with self._held_lock:
+            held, self._held = list(self._held), set()
+        if held:
+            self._collection.update_many({'_id': {'$in': held}, 'lease_owner': self.owner, 'status': 'leased'},
+                                         {'$set': {'status': 'pending'}, '$unset': {'lease_owner': '', 'lease_expires': ''}})
+            logger.info("Released %s unfinished pages", len(held))
+
+    def pending(self):
+        """
+        Count the pages waiting to be claimed
+
+        Returns
+        -------
+        int
+            Number of pending pages
+        """
+        return self._collection.count_documents({'status': 'pending'})
+
+## Functions
+def enqueue_results(date_list, ledger=None, activity=None):
+    """
+    Queue a results page for every promotion and date, skipping pages the ledger says have settled
+
+    Parameters
+    ----------
+    date_list : list
+        List of dates to queue, in the format %d.%m.%Y
+    ledger : Ledger, optional
+        Scrape ledger used to skip settled pages. Every page is queued when not provided
+    activity : Activity, optional
+        Promotion activity used to queue dormant promotions less often. Every promotion is queued when not provided
+
+    Returns
+    -------
+    queued : int
+        Number of pages added or re-queued
+    """
+    pages = []
+    for promotion in Promotions.objects().only('cagematch_id'):
+        dates = activity.due_dates(promotion.cagematch_id, date_list) if activity else date_list
+        dates = ledger.due_dates(promotion.cagematch_id, dates) if ledger else dates
+        pages.extend((promotion.cagematch_id, date) for date in dates)
+    queued = WorkQueue().enqueue(pages)
+
+    # Queued pages are retried until they're done, so a full scan counts once it's queued
+    if activity:
+        activity.flush()
+    return queued
+
+def run_worker(scraper, queue, ledger=None):
+    """
+    Claim pages from the queue and scrape them until the queue is empty
+
+    Parameters
+    ----------
+    scraper : ResultsScraper
+        Scraper used to fetch and save the pages
+    queue : WorkQueue
+        Queue to claim pages from
+    ledger : Ledger, optional
+        Scrape ledger to record the saved pages in
+
+    Returns
+    -------
+    updated_shows : list
+        Simple list of newly added shows for use in notifications
+    """
+    logger.info("Starting worker %s", queue.owner)
+    promotions = {promotion.cagematch_id: promotion for promotion in Promotions.objects()}
+
+    # Job ids for each page, so a saved batch can be acked
+    job_ids = {}
+
+    def claimed_pages():
+        # Claimed lazily, so a worker only holds as many pages as its pipeline has room for
+        while True:
+            job = queue.claim()
+            if not job:
+                return
+            promotion = promotions.get(job['promotion'])
+            if not promotion:
+                logger.warning("Skipping queued page for unknown promotion %s", job['promotion'])
+                queue.ack([job['_id']])
+                continue
+            job_ids[(job['promotion'], job['date'])] = job['_id']
+            yield promotion, job['date']
+
+    def ack_batch(pages):
+        queue.ack([job_ids.pop((promotion.cagematch_id, date)) for promotion, date, _ in pages])
+
+    # Keep the leases alive for pages still working through the pipeline
+    stop = threading.Event()
+
+    def keep_alive():
+        while not stop.wait(queue.lease_seconds / 3):
+            # A failed renewal is tried again on the next beat, the leases have time to spare for a few misses
+            try:
+                queue.heartbeat()
+            except Exception:
+                logger.exception("Couldn't renew the leases held by %s", queue.owner)
+
+    heartbeat = threading.Thread(target=keep_alive, name="lease-heartbeat", daemon=True)
+    heartbeat.start()
+    try:
+        updated_shows = scraper.scrape_pages(claimed_pages(), ledger, on_written=ack_batch)
+    finally:
+        stop.set()
+        heartbeat.join()
+        queue.release()
+
+    logger.info("Worker %s finished, queue empty", queue.owner)
+    return updated_shows
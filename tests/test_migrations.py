@@ -0,0 +1,131 @@
+"""
+Tests for the results dates migration, run against an in-memory mongomock database
+
+Run from the repository root with "python -m unittest discover tests" or "python -m pytest tests"
+"""
+# External Imports
+import os
+import sys
+import unittest
+from unittest import mock
+from datetime import datetime
+import mongomock
+from mongoengine import connect, disconnect
+
+# The scraper modules import each other by name, as when run with "python3 scraper"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+# Internal Imports
+import migrations
+from models import Results, WeeklySummary
+from bulk import bulk_upsert
+from migrations import convert_dates, convert_saved_dates, migrate_dates
+
+## Classes
+# DatesMigrationTest Class
+class DatesMigrationTest(unittest.TestCase):
+    def setUp(self):
+        disconnect()
+        connect('test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        Results.drop_collection()
+        WeeklySummary.drop_collection()
+        migrations._dates_migrated['done'] = False
+        self.collection = Results._get_collection()
+
+    def tearDown(self):
+        disconnect()
+
+    def insert(self, title, date, promotion='DDT Pro-Wrestling'):
+        return self.collection.insert_one({'_cls': 'Results', 'title': title, 'date': date, 'promotion': promotion}).inserted_id
+
+    def string_dated(self):
+        return self.collection.count_documents({'date': {'$type': 'string'}})
+
+    def test_string_dates_are_converted(self):
+        doc_id = self.insert('Show', '16.10.2026')
+        self.assertEqual(convert_dates(list(self.collection.find())), 1)
+
+        self.assertEqual(self.collection.find_one({'_id': doc_id})['date'], datetime(2026, 10, 16))
+        self.assertEqual(WeeklySummary.objects.count(), 1)
+
+    def test_string_copy_of_a_saved_again_show_is_deleted(self):
+        old_id = self.insert('Show', '16.10.2026')
+        new_id = self.insert('Show', datetime(2026, 10, 16))
+        other_id = self.insert('Other Show', '16.10.2026')
+
+        self.assertEqual(convert_dates(list(self.collection.find({'date': {'$type': 'string'}}))), 2)
+        self.assertIsNone(self.collection.find_one({'_id': old_id}))
+        self.assertIsNotNone(self.collection.find_one({'_id': new_id}))
+        self.assertEqual(self.collection.find_one({'_id': other_id})['date'], datetime(2026, 10, 16))
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+    def test_unreadable_dates_are_left_in_place(self):
+        doc_id = self.insert('Show', 'sometime')
+        self.assertEqual(convert_dates(list(self.collection.find())), 0)
+        self.assertEqual(self.collection.find_one({'_id': doc_id})['date'], 'sometime')
+
+    def test_document_changed_since_read_is_left(self):
+        doc_id = self.insert('Show', '16.10.2026')
+        batch = list(self.collection.find())
+        self.collection.update_one({'_id': doc_id}, {'$set': {'date': '17.10.2026'}})
+
+        self.assertEqual(convert_dates(batch), 0)
+        self.assertEqual(self.collection.find_one({'_id': doc_id})['date'], '17.10.2026')
+
+    def test_migrate_converts_every_batch(self):
+        for day in range(1, 11):
+            self.insert(f'Show {day}', f'{day:02d}.10.2026')
+        self.insert('Show 1', datetime(2026, 10, 1))
+        self.insert('Broken', 'garbage')
+
+        self.assertEqual(migrate_dates(batch_size=3), 10)
+        self.assertEqual(self.collection.count_documents({}), 11)
+        self.assertEqual(self.collection.count_documents({'date': {'$type': 'date'}}), 10)
+        self.assertEqual(self.string_dated(), 1)
+
+    def test_migrate_resumes_after_an_interrupted_run(self):
+        for day in range(1, 11):
+            self.insert(f'Show {day}', f'{day:02d}.10.2026')
+
+        # Stopped after the first batch, as a killed migration would be
+        calls = []
+
+        def interrupted(batch):
+            if calls:
+                raise KeyboardInterrupt
+            calls.append(batch)
+            return convert_dates(batch)
+
+        with mock.patch.object(migrations, 'convert_dates', interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                migrate_dates(batch_size=4)
+        self.assertEqual(self.string_dated(), 6)
+
+        self.assertEqual(migrate_dates(batch_size=4), 6)
+        self.assertEqual(self.string_dated(), 0)
+        self.assertEqual(self.collection.count_documents({}), 10)
+        self.assertEqual(migrate_dates(batch_size=4), 0)
+
+    def test_show_saved_again_matches_its_string_dated_copy(self):
+        old_id = self.insert('Show', '16.10.2026')
+        show = {'title': 'Show', 'date': datetime(2026, 10, 16), 'promotion': 'DDT Pro-Wrestling', 'results': ['A def. B']}
+
+        self.assertEqual(convert_saved_dates([show]), 1)
+        result = bulk_upsert(Results, [show], ['title', 'date'])
+
+        self.assertEqual(result['inserted_docs'], [])
+        self.assertEqual(self.collection.count_documents({}), 1)
+        self.assertEqual(self.collection.find_one({'_id': old_id})['results'], ['A def. B'])
+
+    def test_saved_check_is_cached_once_dates_are_migrated(self):
+        show = {'title': 'Show', 'date': datetime(2026, 10, 16)}
+        self.assertEqual(convert_saved_dates([show]), 0)
+        self.assertTrue(migrations._dates_migrated['done'])
+
+        # No string dates are written any more, so the collection isn't checked again
+        with mock.patch.object(Results, '_get_collection') as get_collection:
+            convert_saved_dates([show])
+        get_collection.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
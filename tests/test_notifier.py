@@ -0,0 +1,231 @@
+"""
+Tests for the notification outbox, delivering to a local stand-in for the Pushover API and storing the queue in an
+in-memory mongomock database
+
+Run from the repository root with "python -m unittest discover tests" or "python -m pytest tests"
+"""
+# External Imports
+import os
+import sys
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import mongomock
+from mongoengine import connect, disconnect
+
+# The scraper modules import each other by name, as when run with "python3 scraper"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+# Internal Imports
+from models import Notifications
+from notifier import Pushover, Outbox, PushoverError
+
+## Classes
+# FakePushoverHandler Class
+class FakePushoverHandler(BaseHTTPRequestHandler):
+    """
+    Records each message posted to the server and answers with the next queued status, 200 once the queue is empty
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        server = self.server
+        with server.lock:
+            server.messages.append(body['message'][0])
+            status = server.statuses.pop(0) if server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+# OutboxTest Class
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        disconnect()
+        connect('test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        Notifications.drop_collection()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakePushoverHandler)
+        self.server.lock = threading.Lock()
+        self.server.messages = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.environ = dict(os.environ)
+        os.environ.update(PUSHOVER_TOKEN='token', PUSHOVER_USER='user', PUSHOVER_URL=f'http://127.0.0.1:{self.server.server_port}')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        disconnect()
+
+    def idle_outbox(self, limit=None):
+        """
+        An outbox with its sender already stopped, so the tests drive each delivery themselves
+        """
+        client = Pushover(timeout=5)
+        if limit:
+            client.MAX_MESSAGE_LENGTH = limit
+        outbox = Outbox(client, run='run', linger=0)
+        outbox.close()
+        return outbox
+
+    def queue(self, *messages, run='run', **fields):
+        now = datetime.utcnow()
+        for index, message in enumerate(messages):
+            Notifications(message=message, run=run, created_at=now + timedelta(microseconds=index), next_attempt=now, **fields).save()
+
+    def test_close_delivers_queued_messages_as_one_digest(self):
+        outbox = Outbox(Pushover(timeout=5), linger=0.1)
+        outbox.push_message("first")
+        outbox.push_message("second")
+        outbox.close()
+
+        self.assertEqual(self.server.messages, ["first\n\nsecond"])
+        self.assertEqual(Notifications.objects(status="sent").count(), 2)
+
+    def test_digests_are_packed_up_to_the_limit(self):
+        outbox = self.idle_outbox(limit=20)
+        self.queue("a" * 8, "b" * 8, "c" * 8)
+        outbox._deliver()
+
+        self.assertEqual(self.server.messages, ["a" * 8 + "\n\n" + "b" * 8, "c" * 8])
+        self.assertTrue(all(len(message) <= 20 for message in self.server.messages))
+
+    def test_runs_are_not_combined(self):
+        outbox = self.idle_outbox()
+        self.queue("first", run='one')
+        self.queue("second", run='two')
+        outbox._deliver()
+
+        self.assertEqual(sorted(self.server.messages), ["first", "second"])
+
+    def test_split_breaks_on_lines(self):
+        self.assertEqual(Outbox._split("aaaa\nbbbb\ncc", 10), ["aaaa\nbbbb", "cc"])
+
+    def test_split_cuts_lines_longer_than_the_limit(self):
+        parts = Outbox._split("short\n" + "x" * 25 + "\nend", 10)
+        self.assertEqual(parts, ["short", "x" * 10, "x" * 10, "x" * 5 + "\nend"])
+        self.assertEqual("".join(parts).replace("\n", ""), ("short" + "x" * 25 + "end"))
+
+    def test_retry_resumes_after_the_parts_sent(self):
+        outbox = self.idle_outbox(limit=10)
+        self.queue("aaaaaaaa\nbbbbbbbb\ncccccccc")
+        self.server.statuses = [200, 500]
+        outbox._deliver()
+
+        notification = Notifications.objects.get()
+        self.assertEqual(notification.status, "pending")
+        self.assertEqual(notification.parts_sent, 1)
+        self.assertEqual(self.server.messages, ["aaaaaaaa", "bbbbbbbb"])
+
+        notification.update(set__next_attempt=datetime.utcnow())
+        outbox._deliver()
+        self.assertEqual(self.server.messages, ["aaaaaaaa", "bbbbbbbb", "bbbbbbbb", "cccccccc"])
+        self.assertEqual(Notifications.objects.get().status, "sent")
+
+    def test_server_errors_are_retried_with_backoff(self):
+        outbox = self.idle_outbox()
+        self.queue("message")
+        self.server.statuses = [500, 429]
+
+        before = datetime.utcnow()
+        self.assertTrue(outbox._deliver())
+        notification = Notifications.objects.get()
+        self.assertEqual((notification.status, notification.attempts), ("pending", 1))
+        self.assertGreaterEqual(notification.next_attempt, before + timedelta(seconds=Outbox.BACKOFF_SECONDS))
+
+        # Not due again until the backoff has passed, then the wait doubles
+        outbox._deliver()
+        self.assertEqual(len(self.server.messages), 1)
+        notification.update(set__next_attempt=datetime.utcnow())
+        before = datetime.utcnow()
+        outbox._deliver()
+        notification = Notifications.objects.get()
+        self.assertEqual(notification.attempts, 2)
+        self.assertGreaterEqual(notification.next_attempt, before + timedelta(seconds=Outbox.BACKOFF_SECONDS * 2))
+
+    def test_gives_up_after_max_attempts(self):
+        outbox = self.idle_outbox()
+        outbox.max_attempts = 2
+        self.queue("message")
+        self.server.statuses = [500, 500]
+
+        outbox._deliver()
+        Notifications.objects.update(set__next_attempt=datetime.utcnow())
+        self.assertFalse(outbox._deliver())
+        self.assertEqual(Notifications.objects.get().status, "failed")
+
+    def test_rejected_messages_are_not_retried(self):
+        outbox = self.idle_outbox()
+        self.queue("message")
+        self.server.statuses = [400]
+
+        self.assertFalse(outbox._deliver())
+        notification = Notifications.objects.get()
+        self.assertEqual((notification.status, notification.attempts), ("failed", 1))
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_push_message_raises_with_retry_set_by_status(self):
+        client = Pushover(timeout=5)
+        self.server.statuses = [503, 404]
+        with self.assertRaises(PushoverError) as error:
+            client.push_message("message")
+        self.assertTrue(error.exception.retry)
+        with self.assertRaises(PushoverError) as error:
+            client.push_message("message")
+        self.assertFalse(error.exception.retry)
+        client.close()
+
+    def test_messages_claimed_elsewhere_are_left_alone(self):
+        outbox = self.idle_outbox()
+        self.queue("claimed", status="sending", owner="other", lease_until=datetime.utcnow() + timedelta(minutes=1))
+        outbox._deliver()
+
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(Notifications.objects.get().owner, "other")
+
+    def test_expired_claims_are_reclaimed(self):
+        outbox = self.idle_outbox()
+        self.queue("abandoned", status="sending", owner="other", lease_until=datetime.utcnow() - timedelta(seconds=1))
+        outbox._deliver()
+
+        self.assertEqual(self.server.messages, ["abandoned"])
+        notification = Notifications.objects.get()
+        self.assertEqual(notification.status, "sent")
+        self.assertIsNone(notification.owner)
+
+    def test_each_message_is_sent_by_one_outbox(self):
+        outboxes = [self.idle_outbox() for _ in range(4)]
+        self.queue(*[f"message {index}" for index in range(20)])
+
+        # MongoDB applies find_one_and_update atomically, mongomock finds then updates, so it's serialised here
+        lock = threading.Lock()
+        find_and_modify = mongomock.collection.Collection._find_and_modify
+
+        def atomic_find_and_modify(*args, **kwargs):
+            with lock:
+                return find_and_modify(*args, **kwargs)
+
+        with mock.patch.object(mongomock.collection.Collection, '_find_and_modify', atomic_find_and_modify):
+            threads = [threading.Thread(target=outbox._deliver) for outbox in outboxes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        sent = [line for message in self.server.messages for line in message.split("\n\n")]
+        self.assertEqual(sorted(sent), sorted(f"message {index}" for index in range(20)))
+        self.assertEqual(Notifications.objects(status="sent").count(), 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Tests for the per-host rate limiter and circuit breaker, on a fake clock so waits are instant and exact, with the
+shared limits in an in-memory mongomock database
+
+Run from the repository root with "python -m unittest discover tests" or "python -m pytest tests"
+"""
+# External Imports
+import os
+import sys
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+import mongomock
+from mongoengine import connect, disconnect
+
+# The scraper modules import each other by name, as when run with "python3 scraper"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+# Internal Imports
+import ratelimit
+from models import HostLimits
+from ratelimit import RateLimiter, HostUnavailable, parse_retry_after
+
+HOST = 'www.cagematch.net'
+
+## Classes
+# FakeClock Class
+class FakeClock:
+    """
+    Stands in for the time module in ratelimit, sleeping by moving the clock forward. The wall clock used for the
+    shared limits moves with it
+
+    Attributes
+    ----------
+    now : float
+        Current monotonic time
+
+    slept : float
+        Total seconds slept
+
+    on_sleep : callable or None
+        Called after each sleep, as another thread finishing its request would
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+        self.on_sleep = None
+
+        clock = self
+        started = datetime.utcnow()
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return started + timedelta(seconds=clock.now - 1000.0)
+
+        self.datetime = FakeDatetime
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+        if self.on_sleep:
+            self.on_sleep()
+
+    def advance(self, seconds):
+        self.now += seconds
+
+# RateLimitTest Class
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for name, fake in (('time', self.clock), ('datetime', self.clock.datetime)):
+            patcher = mock.patch.object(ratelimit, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def waited(self, limits):
+        """
+        Seconds an acquire had to wait
+        """
+        before = self.clock.slept
+        limits.acquire()
+        return self.clock.slept - before
+
+    def test_bucket_spaces_requests_at_the_rate(self):
+        limits = RateLimiter(initial_rate=2).host(HOST)
+        self.assertEqual(self.waited(limits), 0)
+        self.assertAlmostEqual(self.waited(limits), 0.5)
+        self.assertAlmostEqual(self.waited(limits), 0.5)
+
+    def test_bucket_allows_a_burst_after_a_quiet_spell(self):
+        limits = RateLimiter(initial_rate=2, burst=4).host(HOST)
+        self.clock.advance(60)
+        for _ in range(4):
+            self.assertEqual(self.waited(limits), 0)
+        self.assertAlmostEqual(self.waited(limits), 0.5)
+
+    def test_rate_climbs_on_quick_responses_and_drops_on_slow_ones(self):
+        limiter = RateLimiter(initial_rate=2, max_rate=2.5, target_latency=1)
+        limits = limiter.host(HOST)
+        for _ in range(10):
+            limits.success(0.1)
+        self.assertEqual(limits.rate, 2.5)
+
+        limits.success(5)
+        self.assertAlmostEqual(limits.rate, 2.0)
+
+    def test_throttle_halves_the_rate_and_pauses_for_retry_after(self):
+        limits = RateLimiter(initial_rate=4).host(HOST)
+        limits.acquire()
+        limits.throttled(retry_after=3)
+
+        self.assertEqual(limits.rate, 2)
+        self.assertAlmostEqual(self.waited(limits), 3)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        limits = RateLimiter(failure_threshold=2, cooldown=10, max_wait=5).host(HOST)
+        limits.failure()
+        self.assertFalse(limits.open_until)
+        limits.failure()
+        self.assertEqual(limits.open_until, self.clock.now + 10)
+
+        # The cooldown outlasts max_wait, so there is no point waiting
+        with self.assertRaises(HostUnavailable):
+            limits.acquire()
+        self.assertEqual(self.clock.slept, 0)
+
+    def test_circuit_trial_closes_on_success(self):
+        limits = RateLimiter(failure_threshold=1, cooldown=10).host(HOST)
+        limits.failure()
+
+        # The first request waits out the cooldown and goes through as the trial
+        self.assertAlmostEqual(self.waited(limits), 10)
+        self.assertTrue(limits.trial_running)
+
+        # Others wait on the trial, then go ahead once it succeeds
+        self.clock.on_sleep = lambda: limits.success(0.1)
+        self.assertAlmostEqual(self.waited(limits), limits.limiter.trial_poll)
+        self.assertEqual((limits.open_until, limits.trial_running, limits.failures), (0, False, 0))
+
+    def test_failed_trial_reopens_for_twice_as_long(self):
+        limiter = RateLimiter(failure_threshold=1, cooldown=10, max_cooldown=30)
+        limits = limiter.host(HOST)
+        limits.failure()
+
+        for cooldown in (20, 30, 30):
+            self.assertGreater(self.waited(limits), 0)
+            self.assertTrue(limits.trial_running)
+            limits.failure()
+            self.assertEqual(limits.cooldown, cooldown)
+            self.assertEqual(limits.open_until, self.clock.now + cooldown)
+
+        # A successful trial resets the cooldown for the next time the circuit opens
+        limits.acquire()
+        limits.success(0.1)
+        self.assertEqual(limits.cooldown, limiter.cooldown)
+
+    def test_waiting_on_a_trial_gives_up_at_max_wait(self):
+        limits = RateLimiter(failure_threshold=1, cooldown=1, max_wait=5).host(HOST)
+        limits.failure()
+        limits.acquire()
+
+        with self.assertRaises(HostUnavailable):
+            limits.acquire()
+        self.assertAlmostEqual(self.clock.slept, 1 + 5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after('-5'), 0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+# SharedLimitsTest Class
+class SharedLimitsTest(RateLimitTest):
+    """
+    The same behaviour with sharing on, plus two limiters standing in for two processes sharing a host
+    """
+    def setUp(self):
+        super().setUp()
+        disconnect()
+        connect('test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        HostLimits.drop_collection()
+
+    def tearDown(self):
+        disconnect()
+
+    def processes(self, **kwargs):
+        return RateLimiter(shared=True, **kwargs).host(HOST), RateLimiter(shared=True, **kwargs).host(HOST)
+
+    def test_pause_is_shared_straight_away(self):
+        first, second = self.processes(initial_rate=4, sync_interval=5)
+        second.acquire()
+        first.throttled(retry_after=30)
+        first.limiter.sync(first)
+        self.assertEqual(HostLimits.objects.get().rate, 2)
+
+        # The other process picks it up on its next sync
+        self.clock.advance(5)
+        self.assertAlmostEqual(self.waited(second), 25, places=1)
+
+    def test_open_circuit_is_shared(self):
+        first, second = self.processes(failure_threshold=1, cooldown=60, max_wait=5, sync_interval=5)
+        second.acquire()
+        first.failure()
+        first.limiter.sync(first)
+
+        self.clock.advance(5)
+        with self.assertRaises(HostUnavailable):
+            second.acquire()
+
+    def test_rate_increase_is_shared_on_the_next_sync(self):
+        first, second = self.processes(initial_rate=2, sync_interval=5)
+        first.acquire()
+        second.acquire()
+        for _ in range(5):
+            first.success(0.1)
+        self.assertAlmostEqual(first.rate, 2.5)
+
+        # Rate changes wait for the sync interval
+        first.limiter.sync(first)
+        self.assertEqual(HostLimits.objects.get().rate, 2)
+
+        self.clock.advance(5)
+        first.limiter.sync(first)
+        second.limiter.sync(second)
+        self.assertAlmostEqual(HostLimits.objects.get().rate, 2.5)
+        self.assertAlmostEqual(second.rate, 2.5)
+
+    def test_local_change_is_not_overwritten_by_an_older_shared_rate(self):
+        first, second = self.processes(initial_rate=2, sync_interval=5)
+        first.acquire()
+        second.acquire()
+        second.success(0.1)
+
+        self.clock.advance(5)
+        second.limiter.sync(second)
+        self.assertAlmostEqual(second.rate, 2.1)
+        self.assertAlmostEqual(HostLimits.objects.get().rate, 2.1)
+
+    def test_database_errors_leave_local_limits_working(self):
+        limits = RateLimiter(shared=True, initial_rate=2).host(HOST)
+        with mock.patch.object(HostLimits, '_get_collection', side_effect=RuntimeError("down")):
+            self.assertEqual(self.waited(limits), 0)
+            self.assertAlmostEqual(self.waited(limits), 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+"""
+Tests for the lease-based results work queue, run against an in-memory mongomock database
+
+Run from the repository root with "python -m unittest discover tests" or "python -m pytest tests"
+"""
+# External Imports
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+import mongomock
+from mongoengine import connect, disconnect
+
+# The scraper modules import each other by name, as when run with "python3 scraper"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+# Internal Imports
+from models import ScrapeJob, Promotions
+from workqueue import WorkQueue, enqueue_results, run_worker
+
+PAGES = [('?id=8&nr=1', '01.10.2026'), ('?id=8&nr=1', '02.10.2026'), ('?id=8&nr=2', '01.10.2026'), ('?id=8&nr=2', '02.10.2026')]
+
+## Classes
+# FakeScraper Class
+class FakeScraper:
+    """
+    Stands in for ResultsScraper, consuming the claimed pages and saving no shows
+
+    Attributes
+    ----------
+    fail_after : int or None
+        Raise after this many pages have been saved, as a worker crashing mid-run would
+
+    scraped : list
+        Promotion cagematch id and date of each page taken from the queue
+    """
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.scraped = []
+
+    def scrape_pages(self, pages, ledger=None, on_written=None):
+        for promotion, date in pages:
+            if self.fail_after is not None and len(self.scraped) >= self.fail_after:
+                raise RuntimeError("worker crashed")
+            self.scraped.append((promotion.cagematch_id, date))
+            on_written([(promotion, date, [])])
+        return []
+
+# WorkQueueTest Class
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        disconnect()
+        connect('test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        ScrapeJob.drop_collection()
+        Promotions.drop_collection()
+
+    def tearDown(self):
+        disconnect()
+
+    def expire_leases(self):
+        ScrapeJob._get_collection().update_many({'status': 'leased'}, {'$set': {'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+
+    def test_enqueue_adds_each_page_once(self):
+        queue = WorkQueue(owner='a')
+        self.assertEqual(queue.enqueue(PAGES), len(PAGES))
+        queue.enqueue(PAGES)
+        self.assertEqual(ScrapeJob.objects.count(), len(PAGES))
+        self.assertEqual(queue.pending(), len(PAGES))
+
+    def test_each_page_has_a_single_claimer(self):
+        WorkQueue(owner='setup').enqueue(PAGES * 5)
+        queues = [WorkQueue(owner=f'w{index}') for index in range(4)]
+        claimed = []
+        lock = threading.Lock()
+
+        def drain(queue):
+            while True:
+                job = queue.claim()
+                if not job:
+                    return
+                with lock:
+                    claimed.append(job['_id'])
+
+        threads = [threading.Thread(target=drain, args=(queue,)) for queue in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), len(PAGES))
+        self.assertEqual(len(set(claimed)), len(PAGES))
+        self.assertIsNone(queues[0].claim())
+
+    def test_unexpired_lease_is_not_taken(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        self.assertIsNotNone(WorkQueue(owner='a').claim())
+        self.assertIsNone(WorkQueue(owner='b').claim())
+
+    def test_expired_lease_is_reclaimed(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        first = WorkQueue(owner='a').claim()
+        self.expire_leases()
+
+        second = WorkQueue(owner='b').claim()
+        self.assertEqual(second['_id'], first['_id'])
+        self.assertEqual(second['lease_owner'], 'b')
+        self.assertEqual(second['attempts'], 2)
+
+    def test_page_is_left_after_max_attempts(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        for index in range(3):
+            self.assertIsNotNone(WorkQueue(owner=f'w{index}', max_attempts=3).claim())
+            self.expire_leases()
+        self.assertIsNone(WorkQueue(owner='last', max_attempts=3).claim())
+
+    def test_heartbeat_extends_the_lease(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        queue = WorkQueue(owner='a', lease_seconds=60)
+        job = queue.claim()
+        ScrapeJob._get_collection().update_one({'_id': job['_id']}, {'$set': {'lease_expires': datetime.utcnow() + timedelta(seconds=1)}})
+
+        queue.heartbeat()
+        lease_expires = ScrapeJob.objects.get(id=job['_id']).lease_expires
+        self.assertGreater(lease_expires, datetime.utcnow() + timedelta(seconds=30))
+        self.assertIsNone(WorkQueue(owner='b').claim())
+
+    def test_heartbeat_does_not_renew_a_lost_lease(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        queue = WorkQueue(owner='a')
+        queue.claim()
+        self.expire_leases()
+        WorkQueue(owner='b', lease_seconds=1).claim()
+        self.expire_leases()
+
+        queue.heartbeat()
+        self.assertIsNotNone(WorkQueue(owner='c').claim())
+
+    def test_ack_is_idempotent(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        queue = WorkQueue(owner='a')
+        job = queue.claim()
+
+        queue.ack([job['_id']])
+        finished_at = ScrapeJob.objects.get(id=job['_id']).finished_at
+        queue.ack([job['_id']])
+        queue.ack([])
+
+        saved = ScrapeJob.objects.get(id=job['_id'])
+        self.assertEqual(saved.status, 'done')
+        self.assertIsNotNone(finished_at)
+        self.assertEqual(saved.finished_at, finished_at)
+        self.assertEqual(queue.pending(), 0)
+        self.assertIsNone(queue.claim())
+
+    def test_ack_of_a_lost_lease_is_ignored(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        first = WorkQueue(owner='a')
+        job = first.claim()
+        self.expire_leases()
+        WorkQueue(owner='b').claim()
+
+        first.ack([job['_id']])
+        saved = ScrapeJob.objects.get(id=job['_id'])
+        self.assertEqual(saved.status, 'leased')
+        self.assertEqual(saved.lease_owner, 'b')
+
+    def test_release_is_idempotent(self):
+        WorkQueue(owner='setup').enqueue(PAGES)
+        queue = WorkQueue(owner='a')
+        acked = queue.claim()
+        queue.claim()
+        queue.ack([acked['_id']])
+
+        queue.release()
+        queue.release()
+
+        self.assertEqual(ScrapeJob.objects.get(id=acked['_id']).status, 'done')
+        self.assertEqual(queue.pending(), len(PAGES) - 1)
+        self.assertEqual(ScrapeJob.objects(status='leased').count(), 0)
+
+    def test_release_leaves_a_lost_lease_alone(self):
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        first = WorkQueue(owner='a')
+        job = first.claim()
+        self.expire_leases()
+        WorkQueue(owner='b').claim()
+
+        first.release()
+        self.assertEqual(ScrapeJob.objects.get(id=job['_id']).lease_owner, 'b')
+
+    def test_enqueue_requeues_done_pages_but_not_leased_ones(self):
+        queue = WorkQueue(owner='a')
+        queue.enqueue(PAGES[:2])
+        done = queue.claim()
+        queue.ack([done['_id']])
+        leased = queue.claim()
+
+        queue.enqueue(PAGES[:2])
+        self.assertEqual(ScrapeJob.objects.get(id=done['_id']).status, 'pending')
+        self.assertEqual(ScrapeJob.objects.get(id=leased['_id']).status, 'leased')
+        self.assertEqual(ScrapeJob.objects.get(id=leased['_id']).lease_owner, 'a')
+
+    def test_enqueue_results_queues_every_promotion_and_date(self):
+        for cagematch_id in ('?id=8&nr=1', '?id=8&nr=2'):
+            Promotions(name=cagematch_id, cagematch_id=cagematch_id).save()
+
+        self.assertEqual(enqueue_results(['01.10.2026', '02.10.2026']), len(PAGES))
+        self.assertEqual(sorted((job.promotion, job.date) for job in ScrapeJob.objects), sorted(PAGES))
+
+    def test_worker_drains_the_queue(self):
+        for cagematch_id in ('?id=8&nr=1', '?id=8&nr=2'):
+            Promotions(name=cagematch_id, cagematch_id=cagematch_id).save()
+        WorkQueue(owner='setup').enqueue(PAGES)
+
+        scraper = FakeScraper()
+        run_worker(scraper, WorkQueue(owner='a'))
+        self.assertEqual(sorted(scraper.scraped), sorted(PAGES))
+        self.assertEqual(ScrapeJob.objects(status='done').count(), len(PAGES))
+
+    def test_crashed_worker_pages_are_requeued(self):
+        for cagematch_id in ('?id=8&nr=1', '?id=8&nr=2'):
+            Promotions(name=cagematch_id, cagematch_id=cagematch_id).save()
+        WorkQueue(owner='setup').enqueue(PAGES)
+
+        # A worker that fails mid-run hands its unfinished pages back on the way out
+        with self.assertRaises(RuntimeError):
+            run_worker(FakeScraper(fail_after=1), WorkQueue(owner='a'))
+        self.assertEqual(ScrapeJob.objects(status='done').count(), 1)
+        self.assertEqual(ScrapeJob.objects(status='leased').count(), 0)
+
+        # A worker killed outright holds its pages until the leases expire, then another worker takes them
+        WorkQueue(owner='b').claim()
+        self.expire_leases()
+
+        scraper = FakeScraper()
+        run_worker(scraper, WorkQueue(owner='d'))
+        self.assertEqual(len(scraper.scraped), len(PAGES) - 1)
+        self.assertEqual(ScrapeJob.objects(status='done').count(), len(PAGES))
+
+    def test_heartbeat_survives_a_failed_renewal(self):
+        Promotions(name='?id=8&nr=1', cagematch_id='?id=8&nr=1').save()
+        WorkQueue(owner='setup').enqueue(PAGES[:1])
+        queue = WorkQueue(owner='a', lease_seconds=0.03)
+        beats = []
+        renewed = threading.Event()
+
+        def heartbeat():
+            beats.append(datetime.utcnow())
+            if len(beats) == 1:
+                raise RuntimeError("database unavailable")
+            renewed.set()
+
+        # The page is held until a renewal after the failed one has gone through
+        class SlowScraper(FakeScraper):
+            def scrape_pages(self, pages, ledger=None, on_written=None):
+                pages = list(pages)
+                renewed.wait(5)
+                return super().scrape_pages(pages, ledger, on_written)
+
+        queue.heartbeat = heartbeat
+        run_worker(SlowScraper(), queue)
+        self.assertTrue(renewed.is_set())
+        self.assertGreaterEqual(len(beats), 2)
+
+    def test_unknown_promotion_is_acked_and_skipped(self):
+        WorkQueue(owner='setup').enqueue([('?id=8&nr=999', '01.10.2026')])
+
+        scraper = FakeScraper()
+        run_worker(scraper, WorkQueue(owner='a'))
+        self.assertEqual(scraper.scraped, [])
+        self.assertEqual(ScrapeJob.objects(status='done').count(), 1)
+
+if __name__ == '__main__':
+    unittest.main()